@@ -1,15 +1,22 @@
+import hashlib
 import os
 import uuid
-import json
 import time  # Add this import at the top of the file
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, abort, send_from_directory, g
 from markupsafe import Markup
 from models.indexer import index_documents
 from models.retriever import retrieve_documents
-from models.responder import generate_response
+from models.responder import generate_response, generate_response_stream
+from models.model_loader import model_residency
+from models.preloader import start_preloading, model_states, is_ready
+from models.session_store import SessionStore
+from models.fragment_cache import FragmentCache
+from models.admission import executors, executor_stats, Overloaded
+from models.tracing import span, start_request, end_request, observe_request, metrics_payload
+from models.disk_gc import DiskGC
+from models.page_images import PAGE_THUMBNAIL_WIDTHS, parse_page_image, page_image_filename, thumbnail_filename, ensure_thumbnails
 from werkzeug.utils import secure_filename
 from logger import get_logger
-from byaldi import RAGMultiModalModel
 import markdown
 
 # Set the TOKENIZERS_PARALLELISM environment variable to suppress warnings
@@ -32,11 +39,96 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['STATIC_FOLDER'], exist_ok=True)
 os.makedirs(app.config['SESSION_FOLDER'], exist_ok=True)
 
+# Session metadata, chat history and indexed files live in one SQLite database
+session_store = SessionStore(os.getenv("SESSION_DB_PATH", os.path.join(app.config['SESSION_FOLDER'], 'sessions.db')))
+# With several web workers, set SESSION_MIGRATE_ON_START=false and run
+# `python -m models.session_store` once before starting them
+if os.getenv("SESSION_MIGRATE_ON_START", "true").lower() == "true":
+    session_store.migrate_json_sessions(app.config['SESSION_FOLDER'])
+
 # Initialize global variables
 RAG_models = {}  # Dictionary to store RAG models per session
 app.config['INITIALIZATION_DONE'] = False  # Flag to track initialization
+# Number of most recent messages rendered with the chat page, and per "load older" request
+app.config['CHAT_HISTORY_PAGE_SIZE'] = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", 100))
+# Number of sessions per page of the sidebar
+app.config['SESSION_LIST_PAGE_SIZE'] = int(os.getenv("SESSION_LIST_PAGE_SIZE", 50))
+# Page image URLs contain the content hash, so browsers may cache them for good
+app.config['PAGE_IMAGE_MAX_AGE'] = int(os.getenv("PAGE_IMAGE_MAX_AGE", 365 * 24 * 3600))
+# Let a fronting web server (nginx X-Accel, Apache mod_xsendfile) send image files
+app.config['USE_X_SENDFILE'] = os.getenv("USE_X_SENDFILE", "false").lower() == "true"
+# Indexes are loaded on first use per session unless this is set
+app.config['LOAD_INDEXES_AT_STARTUP'] = os.getenv("LOAD_INDEXES_AT_STARTUP", "false").lower() == "true"
 logger.info("Application started.")
 
+def remove_session(session_id):
+    """
+    Deletes a session with its uploads, retrieved pages and index.
+    """
+    session_store.delete_session(session_id)
+    reclaimed = disk_gc.remove_session_files(session_id)
+    RAG_models.pop(session_id, None)
+    logger.info(f"Session {session_id} deleted ({reclaimed / (1024 * 1024):.1f} MB reclaimed).")
+
+# Uploads, retrieved pages and indexes are kept within disk quotas in the background
+disk_gc = DiskGC(
+    session_roots=[app.config['UPLOAD_FOLDER'], os.path.join('static', 'images'), app.config['INDEX_FOLDER']],
+    image_folder=lambda session_id: os.path.join('static', 'images', session_id),
+    list_sessions=session_store.session_ids_by_activity,
+    delete_session=remove_session,
+    is_active=lambda session_id: session_id in RAG_models,
+)
+
+# Rendered chat messages, reused across page loads and history requests
+chat_fragments = FragmentCache()
+
+def render_chat_messages(messages):
+    """
+    Renders messages with chat_messages.html, reusing cached fragments of stored messages.
+    """
+    html = chat_fragments.render(messages, lambda message: render_template('chat_messages.html', messages=[message]))
+    return Markup(html)
+
+@app.template_global()
+def page_image_urls(image):
+    """
+    Returns the URLs used to show a retrieved page: 'src' and 'srcset' for the
+    thumbnails and 'full' for the full-size image opened on click.
+    Images that are not retrieved pages fall back to the static folder.
+    """
+    parsed = parse_page_image(image)
+    if parsed is None:
+        url = url_for('static', filename=image)
+        return {'src': url, 'srcset': '', 'full': url}
+    session_id, image_hash = parsed
+    thumbnails = [(width, url_for('page_image', session_id=session_id, image_hash=image_hash, width=width))
+                  for width in PAGE_THUMBNAIL_WIDTHS]
+    full = url_for('page_image', session_id=session_id, image_hash=image_hash)
+    return {
+        'src': thumbnails[0][1] if thumbnails else full,
+        'srcset': ', '.join(f"{url} {width}w" for width, url in thumbnails),
+        'full': full,
+    }
+
+def load_history_page(session_id, limit, before_id=None):
+    """
+    Returns the newest `limit` messages older than before_id, and whether older ones remain.
+    """
+    # One extra row tells whether older messages remain
+    messages = session_store.get_messages(session_id, limit=limit + 1, before_id=before_id)
+    return messages[-limit:], len(messages) > limit
+
+def chat_history_etag(session_id, limit, before_id, render):
+    """
+    Builds the ETag of a history page without loading it.
+
+    Messages are append-only, so a page is fully determined by its parameters
+    and the id of the newest message it can contain.
+    """
+    latest_id = session_store.latest_message_id(session_id, before_id=before_id)
+    key = f"{session_id}:{limit}:{before_id}:{render}:{latest_id}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
 def load_rag_model_for_session(session_id):
     """
     Loads the RAG model for the given session_id from the index on disk.
@@ -45,6 +137,8 @@ def load_rag_model_for_session(session_id):
 
     if os.path.exists(index_path):
         try:
+            # byaldi pulls in torch and colpali; import it only when an index is needed
+            from byaldi import RAGMultiModalModel
             RAG = RAGMultiModalModel.from_index(index_path)
             RAG_models[session_id] = RAG
             logger.info(f"RAG model for session {session_id} loaded from index.")
@@ -53,14 +147,44 @@ def load_rag_model_for_session(session_id):
     else:
         logger.warning(f"No index found for session {session_id}.")
 
+def retrieve_for_session(session_id, query):
+    """
+    Retrieves the pages for a query, loading the session's index on first use.
+    Returns None if the session has no index.
+    """
+    with span('session_cache', cache='hit' if session_id in RAG_models else 'miss'):
+        if session_id not in RAG_models:
+            load_rag_model_for_session(session_id)
+    rag_model = RAG_models.get(session_id)
+    if rag_model is None:
+        return None
+    return retrieve_documents(rag_model, query, session_id)
+
+def save_and_index(uploads, session_folder, **index_kwargs):
+    """
+    Saves uploaded files into the session folder and indexes it.
+
+    Args:
+        uploads (list): (filename, FileStorage) pairs.
+        session_folder (str): The session's upload folder.
+    """
+    os.makedirs(session_folder, exist_ok=True)
+    for filename, file in uploads:
+        file_path = os.path.join(session_folder, filename)
+        file.save(file_path)
+        logger.info(f"File saved: {file_path}")
+    return index_documents(session_folder, **index_kwargs)
+
 def load_existing_indexes():
     """
-    Loads all existing indexes from the .byaldi folder when the application starts.
+    Loads the indexes of all existing sessions from the .byaldi folder when the application starts.
+    Index folders without a session are left for the disk GC.
     """
     global RAG_models
     if os.path.exists(app.config['INDEX_FOLDER']):
+        known_sessions = set(session_store.session_ids_by_activity())
         for session_id in os.listdir(app.config['INDEX_FOLDER']):
-            if os.path.isdir(os.path.join(app.config['INDEX_FOLDER'], session_id)):
+            if session_id in known_sessions and os.path.isdir(os.path.join(app.config['INDEX_FOLDER'], session_id)):
                 load_rag_model_for_session(session_id)
     else:
         logger.warning("No .byaldi folder found. No existing indexes to load.")
@@ -68,13 +192,35 @@ def load_existing_indexes():
 @app.before_request
 def initialize_app():
     """
-    Initializes the application by loading existing indexes.
+    Initializes the application, loading existing indexes if LOAD_INDEXES_AT_STARTUP is set.
     This will run before the first request, but only once.
     """
     if not app.config['INITIALIZATION_DONE']:
-        load_existing_indexes()
+        if app.config['LOAD_INDEXES_AT_STARTUP']:
+            load_existing_indexes()
+            logger.info("Application initialized and indexes loaded.")
         app.config['INITIALIZATION_DONE'] = True
-        logger.info("Application initialized and indexes loaded.")
+
+@app.before_request
+def start_trace():
+    """
+    Gives every request an id (the client's X-Request-ID if sent) that tags its timing spans.
+    """
+    g.request_started = time.perf_counter()
+    g.request_id, g.trace_token = start_request(request.headers.get('X-Request-ID'))
+
+@app.after_request
+def finish_trace(response):
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+        endpoint = request.url_rule.rule if request.url_rule else None
+        observe_request(endpoint, request.method, response.status_code, time.perf_counter() - g.request_started)
+    return response
+
+@app.teardown_request
+def end_trace(exc):
+    if 'trace_token' in g:
+        end_request(g.trace_token)
 
 @app.before_request
 def make_session_permanent():
@@ -83,6 +229,16 @@ def make_session_permanent():
         session['session_id'] = str(uuid.uuid4())
 
 
+@app.errorhandler(Overloaded)
+def handle_overloaded(e):
+    """
+    Sheds load: a full work queue answers 503 with a Retry-After estimate.
+    """
+    response = jsonify({"success": False, "message": str(e)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
 @app.route('/', methods=['GET'])
 def home():
     return redirect(url_for('chat'))
@@ -93,17 +249,15 @@ def chat():
         session['session_id'] = str(uuid.uuid4())
 
     session_id = session['session_id']
-    session_file = os.path.join(app.config['SESSION_FOLDER'], f"{session_id}.json")
-
-    # Load session data from file
-    if os.path.exists(session_file):
-        with open(session_file, 'r') as f:
-            session_data = json.load(f)
-            chat_history = session_data.get('chat_history', [])
-            session_name = session_data.get('session_name', 'Untitled Session')
-            indexed_files = session_data.get('indexed_files', [])
+
+    # Load session data from the store
+    session_data = session_store.get_session(session_id)
+    if session_data is not None:
+        chat_history, has_older_messages = load_history_page(session_id, app.config['CHAT_HISTORY_PAGE_SIZE'])
+        session_name = session_data['name']
+        indexed_files = session_store.get_indexed_files(session_id)
     else:
-        chat_history = []
+        chat_history, has_older_messages = [], False
         session_name = 'Untitled Session'
         indexed_files = []
 
@@ -111,42 +265,36 @@ def chat():
         if 'upload' in request.form:
             # Handle file upload and indexing
             files = request.files.getlist('file')
+            if disk_gc.would_exceed_quota(session_id, request.content_length or 0):
+                return jsonify({"success": False, "message": "This session has reached its disk quota."}), 413
             session_folder = os.path.join(app.config['UPLOAD_FOLDER'], session_id)
-            os.makedirs(session_folder, exist_ok=True)
-            uploaded_files = []
-            for file in files:
-                if file and file.filename:
-                    filename = secure_filename(file.filename)
-                    file_path = os.path.join(session_folder, filename)
-                    file.save(file_path)
-                    uploaded_files.append(filename)
-                    logger.info(f"File saved: {file_path}")
+            uploads = [(secure_filename(file.filename), file) for file in files if file and file.filename]
+            uploaded_files = [filename for filename, _ in uploads]
             
             if uploaded_files:
                 try:
                     index_name = session_id
                     index_path = os.path.join(app.config['INDEX_FOLDER'], index_name)
                     indexer_model = session.get('indexer_model', 'vidore/colpali')
-                    RAG = index_documents(session_folder, index_name=index_name, index_path=index_path, indexer_model=indexer_model)
+                    # Files are saved on the indexing pool, so an upload it sheds leaves nothing on disk
+                    RAG = executors['indexing'].run(save_and_index, uploads, session_folder, index_name=index_name,
+                                                    index_path=index_path, indexer_model=indexer_model)
                     if RAG is None:
                         raise ValueError("Indexing failed: RAG model is None")
                     RAG_models[session_id] = RAG
                     session['index_name'] = index_name
                     session['session_folder'] = session_folder
-                    indexed_files.extend(uploaded_files)
-                    session_data = {
-                        'session_name': session_name,
-                        'chat_history': chat_history,
-                        'indexed_files': indexed_files
-                    }
-                    with open(session_file, 'w') as f:
-                        json.dump(session_data, f)
+                    session_store.create_session(session_id, session_name)
+                    session_store.add_indexed_files(session_id, uploaded_files)
+                    indexed_files = session_store.get_indexed_files(session_id)
                     logger.info("Documents indexed successfully.")
                     return jsonify({
                         "success": True, 
                         "message": "Files indexed successfully.",
                         "indexed_files": indexed_files
                     })
+                except Overloaded:
+                    raise
                 except Exception as e:
                     logger.error(f"Error indexing documents: {str(e)}")
                     return jsonify({"success": False, "message": f"Error indexing files: {str(e)}"})
@@ -160,42 +308,34 @@ def chat():
                 generation_model = session.get('generation_model', 'qwen')
                 resized_height = session.get('resized_height', 280)
                 resized_width = session.get('resized_width', 280)
+                visual_token_budget = session.get('visual_token_budget') or None
+                latency_target = session.get('latency_target') or None
                 
                 # Retrieve relevant documents
-                rag_model = RAG_models.get(session_id)
-                if rag_model is None:
+                retrieved_images = executors['retrieval'].run(retrieve_for_session, session_id, query)
+                if retrieved_images is None:
                     logger.error(f"RAG model not found for session {session_id}")
                     return jsonify({"success": False, "message": "RAG model not found for this session."})
-                
-                retrieved_images = retrieve_documents(rag_model, query, session_id)
-                logger.info(f"Retrieved images: {retrieved_images}")
+                logger.debug(f"Retrieved images: {retrieved_images}")
                 
                 # Generate response with full image paths
                 full_image_paths = [os.path.join(app.static_folder, img) for img in retrieved_images]
-                response = generate_response(full_image_paths, query, session_id, resized_height, resized_width, generation_model)
+                response = executors['generation'].run(generate_response, full_image_paths, query, session_id,
+                                                       resized_height, resized_width, generation_model,
+                                                       visual_token_budget=visual_token_budget, latency_target=latency_target)
                 
                 # Parse markdown in the response
                 parsed_response = Markup(markdown.markdown(response))
 
-                # Update chat history
-                chat_history.append({"role": "user", "content": query})
-                chat_history.append({
-                    "role": "assistant", 
-                    "content": parsed_response, 
-                    "images": retrieved_images  # Keep relative paths for frontend
-                })
-                
-                # Update session name if it's the first message
-                if len(chat_history) == 2:  # First user message and AI response
-                    session_name = query[:50]  # Truncate to 50 characters
-                
-                session_data = {
-                    'session_name': session_name,
-                    'chat_history': chat_history,
-                    'indexed_files': indexed_files
-                }
-                with open(session_file, 'w') as f:
-                    json.dump(session_data, f)
+                # Update chat history; the first exchange also names the session
+                session_store.add_exchange(session_id, [
+                    {"role": "user", "content": query},
+                    {
+                        "role": "assistant",
+                        "content": parsed_response,
+                        "images": retrieved_images  # Keep relative paths for frontend
+                    },
+                ], session_name, first_exchange_name=query[:50])  # Truncate to 50 characters
                 
                 # Render the new messages
                 new_messages_html = render_template('chat_messages.html', messages=[
@@ -207,30 +347,76 @@ def chat():
                     "success": True,
                     "html": new_messages_html
                 })
+            except Overloaded:
+                raise
             except Exception as e:
                 logger.error(f"Error generating response: {e}")
                 return jsonify({"success": False, "message": f"An error occurred while generating the response: {str(e)}"})
 
-    # For GET requests, render the chat page
-    session_files = os.listdir(app.config['SESSION_FOLDER'])
-    chat_sessions = []
-    for file in session_files:
-        if file.endswith('.json'):
-            s_id = file[:-5]
-            with open(os.path.join(app.config['SESSION_FOLDER'], file), 'r') as f:
-                data = json.load(f)
-                name = data.get('session_name', 'Untitled Session')
-                chat_sessions.append({'id': s_id, 'name': name})
+    # For GET requests, render the chat page with the first page of sessions
+    page_size = app.config['SESSION_LIST_PAGE_SIZE']
+    chat_sessions = session_store.list_sessions(limit=page_size)
+    chat_sessions_next_offset = page_size if session_store.count_sessions() > page_size else None
 
     model_choice = session.get('model', 'qwen')
     resized_height = session.get('resized_height', 280)
     resized_width = session.get('resized_width', 280)
 
-    return render_template('chat.html', chat_history=chat_history, chat_sessions=chat_sessions,
+    return render_template('chat.html', chat_history_html=render_chat_messages(chat_history),
+                           has_older_messages=has_older_messages,
+                           oldest_message_id=chat_history[0]['id'] if chat_history else None,
+                           chat_sessions=chat_sessions,
+                           chat_sessions_next_offset=chat_sessions_next_offset,
                            current_session=session_id, model_choice=model_choice,
                            resized_height=resized_height, resized_width=resized_width,
                            session_name=session_name, indexed_files=indexed_files)
 
+@app.route('/chat_stream', methods=['POST'])
+def chat_stream():
+    """
+    Answers a query of the current session like the chat form does, but streams
+    the answer as plain text while it is generated. The retrieved pages are
+    listed in the X-Retrieved-Images header, and the exchange is saved once the
+    answer is complete.
+    """
+    session_id = session['session_id']
+    query = request.form.get('query', '').strip()
+    if not query:
+        return jsonify({"success": False, "message": "No query given."}), 400
+    session_data = session_store.get_session(session_id)
+    session_name = session_data['name'] if session_data is not None else 'Untitled Session'
+
+    retrieved_images = executors['retrieval'].run(retrieve_for_session, session_id, query)
+    if retrieved_images is None:
+        return jsonify({"success": False, "message": "RAG model not found for this session."}), 404
+
+    full_image_paths = [os.path.join(app.static_folder, img) for img in retrieved_images]
+    chunks = executors['generation'].stream(
+        generate_response_stream, full_image_paths, query, session_id,
+        session.get('resized_height', 280), session.get('resized_width', 280), session.get('generation_model', 'qwen'),
+        visual_token_budget=session.get('visual_token_budget') or None,
+        latency_target=session.get('latency_target') or None)
+
+    def body():
+        answer = []
+        # The server closes this generator when the client disconnects, which
+        # stops generation at the next chunk
+        try:
+            for chunk in chunks:
+                answer.append(chunk)
+                yield chunk
+        finally:
+            chunks.close()
+        session_store.add_exchange(session_id, [
+            {"role": "user", "content": query},
+            {"role": "assistant", "content": Markup(markdown.markdown(''.join(answer))), "images": retrieved_images},
+        ], session_name, first_exchange_name=query[:50])
+
+    response = app.response_class(body(), mimetype='text/plain')
+    response.headers['X-Retrieved-Images'] = ','.join(retrieved_images)
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/switch_session/<session_id>')
 def switch_session(session_id):
     session['session_id'] = session_id
@@ -243,17 +429,8 @@ def switch_session(session_id):
 def rename_session():
     session_id = request.form.get('session_id')
     new_session_name = request.form.get('new_session_name', 'Untitled Session')
-    session_file = os.path.join(app.config['SESSION_FOLDER'], f"{session_id}.json")
-
-    if os.path.exists(session_file):
-        with open(session_file, 'r') as f:
-            session_data = json.load(f)
-        
-        session_data['session_name'] = new_session_name
-
-        with open(session_file, 'w') as f:
-            json.dump(session_data, f)
 
+    if session_store.rename_session(session_id, new_session_name):
         return jsonify({"success": True, "message": "Session name updated."})
     else:
         return jsonify({"success": False, "message": "Session not found."})
@@ -261,26 +438,11 @@ def rename_session():
 @app.route('/delete_session/<session_id>', methods=['POST'])
 def delete_session(session_id):
     try:
-        session_file = os.path.join(app.config['SESSION_FOLDER'], f"{session_id}.json")
-        if os.path.exists(session_file):
-            os.remove(session_file)
-        
-        session_folder = os.path.join(app.config['UPLOAD_FOLDER'], session_id)
-        if os.path.exists(session_folder):
-            import shutil
-            shutil.rmtree(session_folder)
-        
-        session_images_folder = os.path.join('static', 'images', session_id)
-        if os.path.exists(session_images_folder):
-            import shutil
-            shutil.rmtree(session_images_folder)
-        
-        RAG_models.pop(session_id, None)
+        remove_session(session_id)
         
         if session.get('session_id') == session_id:
             session['session_id'] = str(uuid.uuid4())
         
-        logger.info(f"Session {session_id} deleted.")
         return jsonify({"success": True, "message": "Session deleted successfully."})
     except Exception as e:
         logger.error(f"Error deleting session {session_id}: {e}")
@@ -293,12 +455,16 @@ def settings():
         generation_model = request.form.get('generation_model', 'qwen')
         resized_height = request.form.get('resized_height', 280)
         resized_width = request.form.get('resized_width', 280)
+        visual_token_budget = request.form.get('visual_token_budget', type=int)
+        latency_target = request.form.get('latency_target', type=float)
         session['indexer_model'] = indexer_model
         session['generation_model'] = generation_model
         session['resized_height'] = resized_height
         session['resized_width'] = resized_width
+        session['visual_token_budget'] = visual_token_budget
+        session['latency_target'] = latency_target
         session.modified = True
-        logger.info(f"Settings updated: indexer_model={indexer_model}, generation_model={generation_model}, resized_height={resized_height}, resized_width={resized_width}")
+        logger.info(f"Settings updated: indexer_model={indexer_model}, generation_model={generation_model}, resized_height={resized_height}, resized_width={resized_width}, visual_token_budget={visual_token_budget}, latency_target={latency_target}")
         flash("Settings updated.", "success")
         return redirect(url_for('chat'))
     else:
@@ -306,40 +472,146 @@ def settings():
         generation_model = session.get('generation_model', 'qwen')
         resized_height = session.get('resized_height', 280)
         resized_width = session.get('resized_width', 280)
+        visual_token_budget = session.get('visual_token_budget')
+        latency_target = session.get('latency_target')
         return render_template('settings.html', 
                                indexer_model=indexer_model,
                                generation_model=generation_model,
                                resized_height=resized_height, 
-                               resized_width=resized_width)
+                               resized_width=resized_width,
+                               visual_token_budget=visual_token_budget,
+                               latency_target=latency_target)
 
 @app.route('/new_session')
 def new_session():
     session_id = str(uuid.uuid4())
     session['session_id'] = session_id
-    session_files = os.listdir(app.config['SESSION_FOLDER'])
-    session_number = len([f for f in session_files if f.endswith('.json')]) + 1
-    session_name = f"Session {session_number}"
-    session_file = os.path.join(app.config['SESSION_FOLDER'], f"{session_id}.json")
-    session_data = {
-        'session_name': session_name,
-        'chat_history': [],
-        'indexed_files': []
-    }
-    with open(session_file, 'w') as f:
-        json.dump(session_data, f)
+    session_number = session_store.count_sessions() + 1
+    session_store.create_session(session_id, f"Session {session_number}")
     flash("New chat session started.", "success")
     return redirect(url_for('chat'))
 
+@app.route('/get_sessions')
+def get_sessions():
+    """
+    Returns a page of sessions sorted by name, as data and as sidebar HTML.
+    """
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(request.args.get('limit', app.config['SESSION_LIST_PAGE_SIZE'], type=int), 500)
+    chat_sessions = session_store.list_sessions(offset=offset, limit=limit)
+    total = session_store.count_sessions()
+    html = render_template('session_list_items.html', chat_sessions=chat_sessions,
+                           current_session=session.get('session_id'))
+    return jsonify({
+        "success": True,
+        "sessions": chat_sessions,
+        "total": total,
+        "next_offset": offset + limit if offset + limit < total else None,
+        "html": html,
+    })
+
+@app.route('/get_chat_history/<session_id>')
+def get_chat_history(session_id):
+    """
+    Returns a page of the session's chat history, oldest first.
+    Pass before_id (the id of the oldest message already shown) to page further back,
+    and render=1 to get the page as rendered HTML instead of message dicts.
+
+    Responses carry an ETag; a request whose If-None-Match still matches is
+    answered with 304 before any message is loaded or rendered.
+    """
+    if session_store.get_session(session_id) is None:
+        return jsonify({"success": False, "message": "Session not found."})
+    limit = max(1, min(request.args.get('limit', app.config['CHAT_HISTORY_PAGE_SIZE'], type=int), 500))
+    before_id = request.args.get('before_id', type=int)
+    render = request.args.get('render', 'false').lower() in ('1', 'true')
+
+    etag = chat_history_etag(session_id, limit, before_id, render)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        messages, has_more = load_history_page(session_id, limit, before_id)
+        body = {"success": True, "has_more": has_more,
+                "oldest_id": messages[0]['id'] if messages else None}
+        if render:
+            body["html"] = render_chat_messages(messages)
+        else:
+            body["messages"] = messages
+        response = jsonify(body)
+    response.set_etag(etag)
+    # Let the browser keep the page but revalidate it on every use
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/page_images/<session_id>/<image_hash>.png')
+@app.route('/page_images/<session_id>/<int:width>/<image_hash>.webp')
+def page_image(session_id, image_hash, width=None):
+    """
+    Serves a retrieved page, or one of its WebP thumbnails, under a content-hash URL.
+
+    The response supports conditional and range requests and is marked
+    immutable: a different page always gets a different URL.
+    """
+    if secure_filename(session_id) != session_id or parse_page_image(f"images/{session_id}/{page_image_filename(image_hash)}") is None:
+        abort(404)
+    if width is not None and width not in PAGE_THUMBNAIL_WIDTHS:
+        abort(404)
+    session_images_folder = os.path.join(app.static_folder, 'images', session_id)
+    filename = page_image_filename(image_hash)
+    if width is not None:
+        # Pages retrieved before thumbnails existed get theirs on first view
+        if not os.path.exists(os.path.join(session_images_folder, thumbnail_filename(image_hash, width))):
+            image_path = os.path.join(session_images_folder, filename)
+            if not os.path.exists(image_path):
+                abort(404)
+            ensure_thumbnails(image_path)
+        filename = thumbnail_filename(image_hash, width)
+
+    response = send_from_directory(session_images_folder, filename, max_age=app.config['PAGE_IMAGE_MAX_AGE'])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/get_indexed_files/<session_id>')
 def get_indexed_files(session_id):
-    session_file = os.path.join(app.config['SESSION_FOLDER'], f"{session_id}.json")
-    if os.path.exists(session_file):
-        with open(session_file, 'r') as f:
-            session_data = json.load(f)
-            indexed_files = session_data.get('indexed_files', [])
-        return jsonify({"success": True, "indexed_files": indexed_files})
+    if session_store.get_session(session_id) is not None:
+        return jsonify({"success": True, "indexed_files": session_store.get_indexed_files(session_id)})
     else:
         return jsonify({"success": False, "message": "Session not found."})
 
+@app.route('/api/models')
+def models_status():
+    return jsonify(model_residency())
+
+@app.route('/metrics')
+def metrics():
+    """
+    Prometheus metrics: stage latency by model_choice and cache outcome, and request latency.
+    """
+    payload = metrics_payload()
+    if payload is None:
+        return jsonify({"success": False, "message": "Install prometheus_client to expose metrics."}), 501
+    body, content_type = payload
+    return app.response_class(body, content_type=content_type)
+
+@app.route('/health')
+def health():
+    return jsonify({"status": "ok", "models": model_states(), "executors": executor_stats(),
+                    "disk": disk_gc.last_report})
+
+@app.route('/ready')
+def ready():
+    models_ready = is_ready()
+    body = {"ready": models_ready, "models": model_states()}
+    return jsonify(body), (200 if models_ready else 503)
+
+# Warm configured models in the background. Under the debug reloader only the
+# child process (WERKZEUG_RUN_MAIN=true) serves requests, so skip the watcher.
+if __name__ != '__main__' or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    start_preloading()
+    disk_gc.start()
+
 if __name__ == '__main__':
-    app.run(port=5050, debug=True)
\ No newline at end of file
+    # Heavy work runs on the bounded executors, so request threads stay free for cheap pages
+    app.run(port=5050, debug=True, threaded=True)
@@ -0,0 +1,73 @@
+# benchmarks/assisted_decoding.py
+
+"""
+Compares standard and assisted decoding of the local Qwen path on tiny random
+models. With greedy decoding both modes must produce the same answer; the
+script exits with an error if they differ or if generation fails.
+
+Usage (from the localgpt-vision directory):
+    python -m benchmarks.assisted_decoding --runs 3
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.tiny_models import PROCESSOR_ID, build_tiny_qwen
+
+
+def make_page(path):
+    from PIL import Image, ImageDraw
+    image = Image.new('RGB', (560, 728), 'white')
+    draw = ImageDraw.Draw(image)
+    for y in range(20, 700, 24):
+        draw.text((20, y), "Requirement 4.2.1 - protect stored account data", fill='black')
+    image.save(path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "localgpt-tiny-models"))
+    parser.add_argument("--processor", default=PROCESSOR_ID, help="Qwen2-VL processor: hub id or local directory")
+    args = parser.parse_args()
+
+    os.environ["QWEN_MODEL_ID"] = build_tiny_qwen(os.path.join(args.workdir, "qwen-main"), num_hidden_layers=4, seed=0,
+                                                  processor_id=args.processor)
+    os.environ["QWEN_DRAFT_MODEL_ID"] = build_tiny_qwen(os.path.join(args.workdir, "qwen-draft"), num_hidden_layers=1,
+                                                        seed=0, processor_id=args.processor)
+    os.environ["QWEN_PREFIX_CACHE_SIZE"] = "0"
+
+    from models import model_loader
+    from models.backends import GenerationOptions, get_backend
+
+    page = make_page(os.path.join(args.workdir, "page.png"))
+    query = "Which requirement covers stored account data?"
+    # The backend raises on failure, where the responder would return an error message as the answer
+    backend = get_backend('qwen')
+    options = GenerationOptions(resized_height=280, resized_width=280)
+    results = {}
+    for assisted in (False, True):
+        model_loader.ASSISTED_DECODING = assisted
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            answer = backend.generate([page], query, options)
+            timings.append(time.perf_counter() - start)
+        if assisted:
+            assert model_loader.load_draft_model('qwen') is not None, "assisted run did not load the draft model"
+        results[assisted] = (answer, min(timings))
+        print(f"{'assisted' if assisted else 'standard':>9}: best of {args.runs} = {min(timings):.3f}s")
+
+    assert results[True][0] == results[False][0], (
+        f"assisted decoding changed the greedy output: {results[True][0]!r} != {results[False][0]!r}")
+    print("Greedy outputs match.")
+
+
+if __name__ == '__main__':
+    main()
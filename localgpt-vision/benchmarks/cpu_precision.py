@@ -0,0 +1,115 @@
+# benchmarks/cpu_precision.py
+
+"""
+Reports load time, resident memory, prefill time and decode tokens/sec of the
+local Qwen path for each CPU precision mode (fp32, bf16, int8) on a tiny random
+model, and checks that each mode actually loads in its precision.
+
+Usage (from the localgpt-vision directory):
+    python -m benchmarks.cpu_precision --modes fp32,bf16,int8 --new-tokens 64
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.tiny_models import PROCESSOR_ID, build_tiny_qwen
+
+
+def resident_bytes():
+    """
+    Current resident set size of this process, from /proc where available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        # ru_maxrss is the peak, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def check_precision(model, mode):
+    """
+    Asserts that the loaded model runs in the requested precision mode.
+    """
+    import torch
+
+    if mode == 'int8':
+        quantized = [module for module in model.modules() if isinstance(module, torch.ao.nn.quantized.dynamic.Linear)]
+        assert quantized, "int8 mode left no quantized linear layers"
+    else:
+        expected = torch.bfloat16 if mode == 'bf16' else torch.float32
+        dtypes = {param.dtype for param in model.parameters() if param.is_floating_point()}
+        assert dtypes == {expected}, f"{mode} mode loaded weights as {dtypes}"
+
+
+def benchmark_mode(mode, new_tokens):
+    import torch
+    from models import model_loader
+    from models.prefix_cache import FirstTokenTimer
+
+    model_loader.CPU_PRECISION['qwen'] = mode
+    model_loader._model_cache.evict('qwen')
+    rss_before = resident_bytes()
+
+    start = time.perf_counter()
+    model, processor, _ = model_loader.load_model('qwen')
+    load_seconds = time.perf_counter() - start
+    rss_after = resident_bytes()
+    check_precision(model, mode)
+
+    inputs = processor(text=["Summarize the stored account data requirements."], return_tensors="pt")
+    # Prefill ends with the first new token; decode speed counts only the tokens after it
+    timer = FirstTokenTimer()
+    with torch.no_grad():
+        start = time.perf_counter()
+        output = model.generate(**inputs, max_new_tokens=new_tokens, min_new_tokens=new_tokens, do_sample=False,
+                                streamer=timer)
+        end = time.perf_counter()
+    generated = output.shape[1] - inputs.input_ids.shape[1]
+    assert generated == new_tokens, f"generated {generated} tokens, expected {new_tokens}"
+
+    return {
+        'mode': mode,
+        'load_seconds': round(load_seconds, 3),
+        'resident_delta_mb': round((rss_after - rss_before) / 2**20, 1),
+        'weights_mb': round(model_loader._model_cache.total_bytes() / 2**20, 1),
+        'prefill_seconds': round(timer.first_token_at - start, 4),
+        'decode_tokens_per_second': round((generated - 1) / (end - timer.first_token_at), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", default="fp32,bf16,int8")
+    parser.add_argument("--new-tokens", type=int, default=64, help="Tokens to generate; at least 2")
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "localgpt-tiny-models"))
+    parser.add_argument("--processor", default=PROCESSOR_ID, help="Qwen2-VL processor: hub id or local directory")
+    args = parser.parse_args()
+    if args.new_tokens < 2:
+        parser.error("--new-tokens must be at least 2 to time decoding apart from prefill")
+
+    model_dir = os.path.join(args.workdir, f"qwen-h{args.hidden_size}-l{args.layers}")
+    os.environ["QWEN_MODEL_ID"] = build_tiny_qwen(model_dir, num_hidden_layers=args.layers, hidden_size=args.hidden_size,
+                                                  processor_id=args.processor)
+
+    from models import model_loader
+    if model_loader.detect_device() != 'cpu':
+        print("A GPU is available; CPU precision modes only apply on CPU. Set CUDA_VISIBLE_DEVICES=''.")
+        sys.exit(1)
+
+    results = [benchmark_mode(mode.strip(), args.new_tokens) for mode in args.modes.split(',')]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
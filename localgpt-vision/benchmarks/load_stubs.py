@@ -0,0 +1,197 @@
+# benchmarks/load_stubs.py
+
+"""
+Stand-ins for the expensive parts of a chat request, for load tests without
+GPUs, model downloads or API keys.
+
+StubRAG replaces RAGMultiModalModel.search and returns real PNG pages, so
+retrieval still decodes and saves images. StubBackend replaces a generation
+backend but keeps its capabilities (image cap, concurrency limit, remote
+hedging), so the responder's request handling is exercised as in production.
+Both take a Latency, which injects a configurable delay and failure rate.
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+from PIL import Image, ImageDraw
+
+
+class StubError(RuntimeError):
+    """Raised by stubs to simulate a failing model or provider."""
+
+
+@dataclass
+class Latency:
+    """
+    Injected delay: uniformly distributed in mean * (1 ± jitter), failing with error_rate.
+    """
+    mean: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+
+    def sample(self):
+        return max(0.0, random.uniform(self.mean * (1 - self.jitter), self.mean * (1 + self.jitter)))
+
+    def maybe_fail(self, what):
+        if self.error_rate and random.random() < self.error_rate:
+            raise StubError(f"Injected {what} failure")
+
+    def wait(self, what):
+        time.sleep(self.sample())
+        self.maybe_fail(what)
+
+
+def parse_latencies(value, default):
+    """
+    Parses "qwen=0.8,gemini=1.5" into {'qwen': 0.8, 'gemini': 1.5}; a bare number sets the default.
+    """
+    latencies = {}
+    for pair in filter(None, (part.strip() for part in value.split(','))):
+        if '=' in pair:
+            name, seconds = pair.split('=', 1)
+            latencies[name.strip()] = float(seconds)
+        else:
+            default = float(pair)
+    return latencies, default
+
+
+_pages = {}
+_pages_lock = threading.Lock()
+
+
+def page_base64(page_num, size=(640, 828)):
+    """
+    Returns a distinct, base64-encoded PNG page, rendered once per page number.
+    """
+    with _pages_lock:
+        if page_num not in _pages:
+            image = Image.new('RGB', size, (255, 255, 255))
+            draw = ImageDraw.Draw(image)
+            shade = (page_num * 37) % 200
+            for row in range(40, size[1] - 40, 24):
+                draw.rectangle([40, row, size[0] - 40 - (row * page_num) % 200, row + 10], fill=(shade, shade, shade))
+            draw.text((40, 10), f"Stub page {page_num}", fill=(0, 0, 0))
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG')
+            _pages[page_num] = base64.b64encode(buffer.getvalue()).decode()
+        return _pages[page_num]
+
+
+@dataclass
+class StubResult:
+    doc_id: int
+    page_num: int
+    score: float
+    base64: str
+    metadata: dict = None
+
+
+class StubRAG:
+    """
+    Replaces RAGMultiModalModel.search: picks k of `pages` pages from the query hash.
+    """
+
+    def __init__(self, latency, pages=20):
+        self.latency = latency
+        self.pages = pages
+
+    def search(self, query, k=3):
+        self.latency.wait('search')
+        seed = int(hashlib.md5(query.encode()).hexdigest(), 16)
+        page_nums = [(seed + i * 7) % self.pages + 1 for i in range(k)]
+        return [StubResult(doc_id=0, page_num=num, score=1.0 - i * 0.1, base64=page_base64(num))
+                for i, num in enumerate(page_nums)]
+
+
+class StubRAGModels(dict):
+    """
+    Stands in for the apps' RAG_models dict: every session has the stub index.
+    """
+
+    def __init__(self, rag):
+        super().__init__()
+        self.rag = rag
+
+    def __contains__(self, session_id):
+        return True
+
+    def __getitem__(self, session_id):
+        return self.rag
+
+    def get(self, session_id, default=None):
+        return self.rag
+
+
+def _stub_answer(query, images):
+    return f"Stub answer to '{query[:40]}' from {len(images)} page(s)."
+
+
+def stub_backend(real_backend, latency):
+    """
+    Returns a localgpt-vision backend that sleeps instead of generating but keeps
+    the real backend's name and capabilities.
+    """
+    from models.backends import GenerationBackend
+
+    class StubBackend(GenerationBackend):
+        name = real_backend.name
+        capabilities = real_backend.capabilities
+
+        def generate(self, images, query, options):
+            latency.wait(f"{self.name} generation")
+            return _stub_answer(query, images)
+
+        def stream(self, images, query, options):
+            words = _stub_answer(query, images).split()
+            for word in words:
+                time.sleep(latency.sample() / len(words))
+                yield word + ' '
+            latency.maybe_fail(f"{self.name} generation")
+
+    return StubBackend()
+
+
+def install_localgpt_stubs(app_module, search_latency, generate_latencies, default_latency):
+    """
+    Swaps the Flask app's session indexes and every generation backend for stubs.
+
+    Args:
+        app_module (module): The imported localgpt-vision app module.
+        search_latency (Latency): Delay of each search.
+        generate_latencies (dict): Latency per model_choice.
+        default_latency (Latency): Latency of backends not in generate_latencies.
+    """
+    from models.backends import BACKENDS
+
+    app_module.RAG_models = StubRAGModels(StubRAG(search_latency))
+    for name, backend in list(BACKENDS.items()):
+        BACKENDS[name] = stub_backend(backend, generate_latencies.get(name, default_latency))
+
+
+def install_vision_rag_stubs(app_module, search_latency, generate_latencies, default_latency, blocking=False):
+    """
+    Swaps the FastAPI app's session indexes and generate_response for stubs.
+
+    With blocking=True the stub sleeps on the event loop, as in-process local
+    inference does; otherwise it sleeps in a worker thread, like a remote call.
+    """
+    app_module.RAG_models = StubRAGModels(StubRAG(search_latency))
+
+    async def generate_response(images, query, session_id, resized_height=280, resized_width=280,
+                                model_choice='qwen'):
+        latency = generate_latencies.get(model_choice, default_latency)
+        if blocking:
+            time.sleep(latency.sample())
+        else:
+            await asyncio.sleep(latency.sample())
+        latency.maybe_fail(f"{model_choice} generation")
+        return _stub_answer(query, images)
+
+    app_module.generate_response = generate_response
@@ -0,0 +1,391 @@
+# benchmarks/load_test.py
+
+"""
+Drives concurrent chat sessions against the Flask app (POST /chat) or the
+FastAPI app (POST /api/chat/{session_id}/query) and reports p50/p95/p99
+latency, throughput and error rates per endpoint.
+
+By default the app is served in-process with stubbed retrieval and generation
+(see benchmarks/load_stubs.py), so no GPU, model download or API key is
+needed; the injected latencies stand in for the real models. Every other part
+of a request (admission control, page image decoding and saving, session
+store, templates) runs as in production.
+
+Each simulated user creates its own session, selects --model, then sends
+queries back to back (with --think-time between them). --read-mix makes a
+share of requests cheap reads (history, session list) instead of queries.
+
+Usage (from the localgpt-vision directory):
+    python -m benchmarks.load_test --users 1,8,32 --requests 20
+    python -m benchmarks.load_test --target fastapi --users 16 --duration 60 \\
+        --search-latency 0.05 --generate-latency qwen=0.8,gemini=1.5 --jitter 0.3
+    # Serve the stubbed app for another load generator, then drive it by URL
+    python -m benchmarks.load_test --serve --port 5051
+    python -m benchmarks.load_test --url http://localhost:5051 --users 16
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from benchmarks.load_stubs import Latency, parse_latencies, install_localgpt_stubs, install_vision_rag_stubs
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VISION_RAG_DIR = os.path.join(os.path.dirname(APP_DIR), 'vision-rag')
+
+QUERIES = [
+    "What is the total revenue reported in the document?",
+    "Summarize the key findings on this page.",
+    "Which figure shows the experimental setup?",
+    "List the authors and their affiliations.",
+    "What are the limitations mentioned by the authors?",
+]
+
+# Answers the apps return with HTTP 200 when generation failed
+_ERROR_MARKERS = ("An error occurred", "Please try again later", "No images could be loaded")
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _isolate_state(workdir):
+    """
+    Points the app at a throwaway session database and turns off background
+    work that would compete with the measured requests.
+
+    Uploads, indexes, page images and the log go to workdir, not the app's folders.
+    """
+    os.chdir(workdir)
+    os.environ['SESSION_DB_PATH'] = os.path.join(workdir, 'sessions.db')
+    os.environ['LOG_FILE'] = os.path.join(workdir, 'app.log')
+    os.environ['DISK_GC_INTERVAL'] = '0'
+    os.environ['MODEL_WORKER_ADDRESS'] = ''
+    os.environ['PRELOAD_GENERATION_MODELS'] = ''
+    os.environ['PRELOAD_INDEXER_MODELS'] = ''
+
+
+def start_flask(args, port):
+    """
+    Imports app.py with stubs installed and serves it on a threaded werkzeug server.
+
+    Returns:
+        callable: Stops the server.
+    """
+    from werkzeug.serving import make_server
+
+    import app as flask_app
+    # Flask resolves static files from the module's folder; serve them from the working directory
+    flask_app.app.static_folder = os.path.abspath(flask_app.app.config['STATIC_FOLDER'])
+    install_localgpt_stubs(flask_app, *_latencies(args))
+    server = make_server('127.0.0.1', port, flask_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='load-test-server', daemon=True).start()
+    return server.shutdown
+
+
+def start_fastapi(args, port):
+    """
+    Imports the vision-rag app with stubs installed and serves it with uvicorn.
+
+    Returns:
+        callable: Stops the server.
+    """
+    import uvicorn
+
+    # localgpt-vision's app.py would shadow the vision-rag 'app' package
+    sys.path.insert(0, VISION_RAG_DIR)
+    sys.modules.pop('app', None)
+    from app import app as vision_app
+    install_vision_rag_stubs(vision_app, *_latencies(args), blocking=args.blocking_generate)
+    server = uvicorn.Server(uvicorn.Config(vision_app.app, host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=server.run, name='load-test-server', daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("uvicorn failed to start")
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+    return stop
+
+
+def _latencies(args):
+    generate, default = parse_latencies(args.generate_latency, 1.0)
+    jitter, error_rate = args.jitter, args.error_rate
+    return (
+        Latency(args.search_latency, jitter, error_rate),
+        {name: Latency(seconds, jitter, error_rate) for name, seconds in generate.items()},
+        Latency(default, jitter, error_rate),
+    )
+
+
+class FlaskUser:
+    """
+    One browser: a cookie session bound to a chat session, as chat.html uses it.
+    """
+
+    def __init__(self, base_url, model):
+        self.base_url = base_url
+        self.http = requests.Session()
+        # /new_session redirects to the chat page, which carries the session id for its scripts
+        page = self.http.get(f"{base_url}/new_session")
+        page.raise_for_status()
+        self.session_id = re.search(r"var sessionId = '([^']+)'", page.text).group(1)
+        self.http.post(f"{base_url}/settings", data={'generation_model': model},
+                       allow_redirects=False).raise_for_status()
+
+    def query(self, text):
+        return self.http.post(f"{self.base_url}/chat", data={'query': text, 'send_query': 'true'})
+
+    def read(self, rng):
+        """
+        Returns (endpoint, send) for a cheap request a browser makes between queries.
+        """
+        if rng.random() < 0.5:
+            return 'GET /get_sessions', lambda: self.http.get(f"{self.base_url}/get_sessions")
+        return 'GET /get_chat_history', lambda: self.http.get(
+            f"{self.base_url}/get_chat_history/{self.session_id}", params={'render': 1})
+
+    def answer_failed(self, response):
+        body = response.json()
+        return not body.get('success') or any(marker in body.get('html', '') for marker in _ERROR_MARKERS)
+
+    def close(self):
+        self.http.post(f"{self.base_url}/delete_session/{self.session_id}", allow_redirects=False)
+
+
+class FastAPIUser:
+    def __init__(self, base_url, model):
+        self.base_url = base_url
+        self.model = model
+        self.http = requests.Session()
+        response = self.http.post(f"{base_url}/api/sessions/create", json={'name': 'Load test'})
+        response.raise_for_status()
+        self.session_id = response.json()['session_id']
+
+    def query(self, text):
+        return self.http.post(f"{self.base_url}/api/chat/{self.session_id}/query",
+                              json={'query': text, 'model_choice': self.model})
+
+    def read(self, rng):
+        return 'GET /api/chat/{session_id}/history', lambda: self.http.get(
+            f"{self.base_url}/api/chat/{self.session_id}/history")
+
+    def answer_failed(self, response):
+        return any(marker in response.json().get('response', '') for marker in _ERROR_MARKERS)
+
+    def close(self):
+        self.http.delete(f"{self.base_url}/api/sessions/{self.session_id}")
+
+
+QUERY_ENDPOINTS = {'flask': 'POST /chat', 'fastapi': 'POST /api/chat/{session_id}/query'}
+USER_CLASSES = {'flask': FlaskUser, 'fastapi': FastAPIUser}
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an ascending list.
+    """
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def summarize(samples, elapsed):
+    """
+    Groups (endpoint, seconds, outcome) samples into per-endpoint statistics.
+
+    Outcomes are 'ok', 'error' (HTTP error or a failed answer) and 'shed'
+    (503 from admission control).
+    """
+    endpoints = {}
+    for endpoint, seconds, outcome in samples:
+        endpoints.setdefault(endpoint, []).append((seconds, outcome))
+    report = {}
+    for endpoint, results in sorted(endpoints.items()):
+        latencies = sorted(seconds for seconds, outcome in results if outcome == 'ok')
+        count = len(results)
+        errors = sum(outcome == 'error' for _, outcome in results)
+        shed = sum(outcome == 'shed' for _, outcome in results)
+        report[endpoint] = {
+            'requests': count,
+            'ok': len(latencies),
+            'errors': errors,
+            'shed': shed,
+            'error_rate': round((errors + shed) / count, 4),
+            'throughput_rps': round(len(latencies) / elapsed, 2),
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None,
+        }
+    return report
+
+
+def run_level(target, base_url, users, args):
+    """
+    Runs one load level: `users` concurrent sessions until each has sent
+    --requests requests or --duration seconds have passed.
+    """
+    samples = []
+    samples_lock = threading.Lock()
+    failures = []
+    timing = {}
+
+    def begin():
+        # Runs once every user has its session, before any of them sends a query
+        timing['start'] = time.perf_counter()
+        timing['deadline'] = timing['start'] + (args.duration or 0)
+
+    start_barrier = threading.Barrier(users + 1, action=begin)
+
+    def record(endpoint, seconds, outcome):
+        with samples_lock:
+            samples.append((endpoint, seconds, outcome))
+
+    def simulate(user_index):
+        rng = random.Random(args.seed + user_index)
+        try:
+            user = USER_CLASSES[target](base_url, args.model)
+        except Exception as e:
+            failures.append(f"session setup failed: {e}")
+            start_barrier.abort()
+            return
+        try:
+            start_barrier.wait()
+            sent = 0
+            while (args.duration and time.perf_counter() < timing['deadline']) or (not args.duration and sent < args.requests):
+                is_read = rng.random() < args.read_mix
+                if is_read:
+                    endpoint, send = user.read(rng)
+                else:
+                    query = rng.choice(QUERIES)
+                    endpoint, send = QUERY_ENDPOINTS[target], lambda: user.query(query)
+                started = time.perf_counter()
+                try:
+                    response = send()
+                    seconds = time.perf_counter() - started
+                    if response.status_code == 503:
+                        outcome = 'shed'
+                    elif response.status_code >= 400 or (not is_read and user.answer_failed(response)):
+                        outcome = 'error'
+                    else:
+                        outcome = 'ok'
+                except (requests.RequestException, ValueError):
+                    seconds, outcome = time.perf_counter() - started, 'error'
+                record(endpoint, seconds, outcome)
+                sent += 1
+                if args.think_time:
+                    time.sleep(rng.expovariate(1 / args.think_time))
+        except threading.BrokenBarrierError:
+            pass
+        finally:
+            if not args.keep_sessions:
+                try:
+                    user.close()
+                except requests.RequestException:
+                    pass
+
+    threads = [threading.Thread(target=simulate, args=(i,), name=f"user-{i}") for i in range(users)]
+    for thread in threads:
+        thread.start()
+    try:
+        start_barrier.wait()
+    except threading.BrokenBarrierError:
+        for thread in threads:
+            thread.join()
+        raise RuntimeError(failures[0] if failures else "session setup failed")
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - timing['start']
+    return {'users': users, 'elapsed': round(elapsed, 3), 'endpoints': summarize(samples, elapsed)}
+
+
+def _ms(seconds):
+    return '-' if seconds is None else f"{seconds * 1000:.0f}"
+
+
+def print_level(level):
+    print(f"\n{level['users']} users, {level['elapsed']:.1f}s")
+    print(f"{'endpoint':<38} {'reqs':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'err %':>7} {'shed':>5}")
+    for endpoint, stats in level['endpoints'].items():
+        print(f"{endpoint:<38} {stats['requests']:>6} {stats['throughput_rps']:>7.2f} {_ms(stats['p50']):>8} "
+              f"{_ms(stats['p95']):>8} {_ms(stats['p99']):>8} {stats['error_rate']:>7.1%} {stats['shed']:>5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=sorted(USER_CLASSES), default='flask')
+    parser.add_argument('--url', help="Drive an already running server instead of an in-process stubbed one")
+    parser.add_argument('--serve', action='store_true', help="Only serve the stubbed app on --port until interrupted")
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--users', default='8', help="Concurrent sessions; a comma-separated list runs one level each")
+    parser.add_argument('--requests', type=int, default=20, help="Requests per user")
+    parser.add_argument('--duration', type=float, default=0, help="Seconds per level; overrides --requests")
+    parser.add_argument('--think-time', type=float, default=0, help="Mean pause between a user's requests")
+    parser.add_argument('--read-mix', type=float, default=0.0, help="Share of requests that are cheap reads")
+    parser.add_argument('--model', default='qwen', help="Generation model every user selects")
+    parser.add_argument('--search-latency', type=float, default=0.05)
+    parser.add_argument('--generate-latency', default='1.0',
+                        help="Seconds per generation: a default and/or model=seconds pairs, e.g. 0.5,gemini=1.5")
+    parser.add_argument('--jitter', type=float, default=0.2, help="Relative spread of injected latencies")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of stub calls that fail")
+    parser.add_argument('--blocking-generate', action='store_true',
+                        help="fastapi: sleep on the event loop in generation, like in-process inference")
+    parser.add_argument('--keep-sessions', action='store_true', help="Don't delete the sessions created")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="Also write the results to this file")
+    args = parser.parse_args()
+    if args.serve and args.url:
+        parser.error("--serve starts its own server; it can't be combined with --url")
+
+    stop = None
+    base_url = args.url
+    if base_url is None:
+        workdir = tempfile.mkdtemp(prefix='load-test-')
+        _isolate_state(workdir)
+        port = args.port or _free_port()
+        stop = (start_flask if args.target == 'flask' else start_fastapi)(args, port)
+        base_url = f"http://127.0.0.1:{port}"
+        print(f"Serving stubbed {args.target} app at {base_url} (state in {workdir})")
+    if args.serve:
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            stop()
+        return
+
+    results = {'target': args.target, 'url': base_url, 'model': args.model, 'stubbed': args.url is None,
+               'config': {key: value for key, value in vars(args).items() if key not in ('json', 'url', 'serve')},
+               'levels': []}
+    try:
+        for users in (int(level) for level in args.users.split(',')):
+            level = run_level(args.target, base_url.rstrip('/'), users, args)
+            results['levels'].append(level)
+            print_level(level)
+    finally:
+        if stop is not None:
+            stop()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
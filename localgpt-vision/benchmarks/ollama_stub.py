@@ -0,0 +1,128 @@
+# benchmarks/ollama_stub.py
+
+"""
+Minimal stand-in for the Ollama HTTP API, for exercising the 'ollama'
+backend without a GPU or a real model.
+
+Implements /api/chat (streaming and not), /api/generate (load/unload via
+keep_alive), /api/ps and /api/tags. Answers echo the query, one word per
+streamed chunk, with a configurable delay per token.
+
+Usage (from the localgpt-vision directory):
+    python -m benchmarks.ollama_stub --port 11434 --token-delay 0.02
+    OLLAMA_HOST=http://localhost:11434 python app.py
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def _answer_tokens(payload):
+    message = payload.get('messages', [{}])[-1]
+    words = f"Stub answer to: {message.get('content', '')}".split()
+    words.append(f"({len(message.get('images') or [])} image(s))")
+    return [word + ' ' for word in words][:payload.get('options', {}).get('num_predict', 512)]
+
+
+class OllamaStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    token_delay = 0.0
+    load_delay = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _touch(self, payload):
+        model = payload.get('model', '')
+        with _loaded_lock:
+            if payload.get('keep_alive') in (0, '0'):
+                _loaded.pop(model, None)
+                return
+            if model not in _loaded:
+                time.sleep(self.load_delay)
+            _loaded[model] = {'name': model, 'keep_alive': payload.get('keep_alive')}
+
+    def do_GET(self):
+        if self.path == '/api/ps':
+            with _loaded_lock:
+                self._send_json({'models': list(_loaded.values())})
+        elif self.path == '/api/tags':
+            self._send_json({'models': [{'name': 'llama3.2-vision:latest'}]})
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path == '/api/generate':
+            self._touch(payload)
+            self._send_json({'model': payload.get('model'), 'response': '', 'done': True})
+        elif self.path == '/api/chat':
+            self._touch(payload)
+            self._chat(payload)
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def _chat(self, payload):
+        tokens = _answer_tokens(payload)
+        if not payload.get('stream', True):
+            time.sleep(self.token_delay * len(tokens))
+            self._send_json({'model': payload.get('model'), 'done': True,
+                             'message': {'role': 'assistant', 'content': ''.join(tokens)}})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        chunks = [{'message': {'role': 'assistant', 'content': token}, 'done': False} for token in tokens]
+        chunks.append({'message': {'role': 'assistant', 'content': ''}, 'done': True, 'eval_count': len(tokens)})
+        for chunk in chunks:
+            time.sleep(self.token_delay)
+            line = (json.dumps(chunk) + '\n').encode()
+            self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def serve(port=11434, token_delay=0.0, load_delay=0.0):
+    """
+    Starts the stub server in a background thread and returns it; call shutdown() to stop.
+    """
+    handler = type('Handler', (OllamaStubHandler,), {'token_delay': token_delay, 'load_delay': load_delay})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds per generated token")
+    parser.add_argument("--load-delay", type=float, default=0.0, help="Seconds to 'load' a model on first use")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.token_delay, args.load_delay)
+    print(f"Ollama stub listening on http://127.0.0.1:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
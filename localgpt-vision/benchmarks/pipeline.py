@@ -0,0 +1,278 @@
+# benchmarks/pipeline.py
+
+"""
+Runs the full upload -> convert -> index -> retrieve -> generate pipeline of
+models/ offline on generated PDFs, and reports time, peak memory and pages/sec
+per stage for each document count.
+
+Indexing uses TinyRAGModel (real PDF rasterization, tiny random encoder) in
+place of byaldi/ColPali, and generation the real Qwen backend with a tiny
+random checkpoint (see benchmarks/tiny_models.py), so no GPU or API key is
+needed. Stages are measured through the tracing spans the app already has.
+
+Results can be saved as a JSON baseline and compared against a later build.
+
+Usage (from the localgpt-vision directory):
+    python -m benchmarks.pipeline --docs 1,4,16 --pages 8 --save baseline.json
+    python -m benchmarks.pipeline --docs 1,4,16 --pages 8 --compare baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import uuid
+from contextlib import contextmanager
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+# Stages in pipeline order; the others (search, decode_image, ...) run inside them
+STAGES = ['upload', 'convert', 'load_indexer', 'index', 'retrieve', 'load_generator', 'generate']
+
+QUERIES = [
+    "What is the total revenue reported in the document?",
+    "Which section describes the retention policy?",
+    "Summarize the key findings on this page.",
+    "List the action items and their owners.",
+]
+
+_MB = 1024 * 1024
+
+
+def make_pdf(path, pages, doc_num):
+    """
+    Writes a PDF of text-like pages, different for every document and page.
+    """
+    from PIL import Image, ImageDraw
+
+    images = []
+    for page_num in range(1, pages + 1):
+        image = Image.new('RGB', (1275, 1650), 'white')
+        draw = ImageDraw.Draw(image)
+        draw.text((100, 80), f"Document {doc_num}, page {page_num}", fill='black')
+        for line, y in enumerate(range(160, 1550, 28)):
+            width = 400 + (doc_num * 131 + page_num * 71 + line * 37) % 700
+            draw.rectangle([100, y, 100 + width, y + 12], fill=(60, 60, 60))
+        images.append(image)
+    images[0].save(path, 'PDF', resolution=150, save_all=True, append_images=images[1:])
+    return path
+
+
+def _peak_rss():
+    """
+    Returns the process's peak resident set size in bytes since the last reset.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _reset_peak_rss():
+    # Linux only; elsewhere peaks are the process-wide maximum so far
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+class StageRecorder:
+    """
+    Span listener that accumulates time, calls and peak RSS per stage.
+
+    Nested spans reset the peak counter, so a span passes the peak seen so far
+    to its parent before resetting it.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._open = []
+
+    @contextmanager
+    def __call__(self, stage, labels):
+        if self._open:
+            self._open[-1][1] = max(self._open[-1][1], _peak_rss())
+        _reset_peak_rss()
+        frame = [stage, 0]
+        self._open.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._open.pop()
+            peak = max(frame[1], _peak_rss())
+            if self._open:
+                self._open[-1][1] = max(self._open[-1][1], peak)
+            stats = self.stages.setdefault(stage, {'seconds': 0.0, 'calls': 0, 'peak_rss_mb': 0.0})
+            stats['seconds'] += elapsed
+            stats['calls'] += 1
+            stats['peak_rss_mb'] = max(stats['peak_rss_mb'], round(peak / _MB, 1))
+
+
+def run_level(docs, args, workdir, recorder):
+    """
+    Uploads, indexes and queries `docs` documents in a new session.
+    """
+    from models.indexer import index_documents
+    from models.retriever import retrieve_documents
+    from models.responder import generate_response
+    from models.model_loader import load_model
+    from models.tracing import span
+
+    session_id = f"benchmark-{uuid.uuid4().hex[:8]}"
+    source_folder = os.path.join(workdir, 'generated', str(docs))
+    os.makedirs(source_folder, exist_ok=True)
+    sources = [make_pdf(os.path.join(source_folder, f"doc_{i}.pdf"), args.pages, i) for i in range(docs)]
+
+    recorder.stages.clear()
+    start = time.perf_counter()
+    session_folder = os.path.join('uploaded_documents', session_id)
+    with span('upload'):
+        os.makedirs(session_folder, exist_ok=True)
+        for source in sources:
+            shutil.copyfile(source, os.path.join(session_folder, os.path.basename(source)))
+
+    RAG = index_documents(session_folder, index_name=session_id,
+                          index_path=os.path.join('.byaldi', session_id), indexer_model='tiny')
+    if not args.skip_generate:
+        with span('load_generator', model_choice='qwen'):
+            load_model('qwen')
+
+    for query in QUERIES[:args.queries]:
+        with span('retrieve'):
+            images = retrieve_documents(RAG, query, session_id, k=args.top_k)
+        if not images:
+            raise RuntimeError(f"Nothing retrieved for '{query}'")
+        if args.skip_generate:
+            continue
+        answer = generate_response([os.path.join('static', image) for image in images], query, session_id,
+                                   280, 280, 'qwen')
+        if answer.startswith(("An error occurred", "No images could be loaded")):
+            raise RuntimeError(answer)
+    elapsed = time.perf_counter() - start
+
+    pages = docs * args.pages
+    stages = {name: dict(stats, seconds=round(stats['seconds'], 4)) for name, stats in recorder.stages.items()}
+    ingest = sum(stages.get(name, {}).get('seconds', 0) for name in ('upload', 'convert', 'load_indexer', 'index'))
+    top_level = {name: stages[name]['seconds'] for name in STAGES if name in stages}
+    return {
+        'docs': docs,
+        'pages': pages,
+        'seconds': round(elapsed, 3),
+        'ingest_pages_per_second': round(pages / ingest, 2) if ingest else None,
+        'index_pages_per_second': round(pages / stages['index']['seconds'], 2),
+        'dominant_stage': max(top_level, key=top_level.get),
+        'stages': stages,
+    }
+
+
+def build_info():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import torch
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def print_level(level, baseline_level=None):
+    print(f"\n{level['docs']} docs, {level['pages']} pages: {level['seconds']:.2f}s, "
+          f"ingest {level['ingest_pages_per_second']} pages/s, index {level['index_pages_per_second']} pages/s, "
+          f"dominant stage: {level['dominant_stage']}")
+    header = f"{'stage':<16} {'calls':>6} {'seconds':>9} {'share':>7} {'peak MB':>9}"
+    if baseline_level:
+        header += f" {'baseline':>9} {'change':>8}"
+    print(header)
+    stages = level['stages']
+    total = sum(stages[name]['seconds'] for name in STAGES if name in stages)
+    # Pipeline stages in order, then the finer stages that run inside them
+    for name in [name for name in STAGES if name in stages] + [name for name in stages if name not in STAGES]:
+        stats = stages[name]
+        share = f"{stats['seconds'] / total:.0%}" if name in STAGES and total else ''
+        label = name if name in STAGES else f"  {name}"
+        row = f"{label:<16} {stats['calls']:>6} {stats['seconds']:>9.3f} {share:>7} {stats['peak_rss_mb']:>9.1f}"
+        base = (baseline_level or {}).get('stages', {}).get(name)
+        if base:
+            change = stats['seconds'] / base['seconds'] - 1 if base['seconds'] else 0
+            row += f" {base['seconds']:>9.3f} {change:>+8.0%}"
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', default='1,4,16', help="Comma-separated document counts, one run each")
+    parser.add_argument('--pages', type=int, default=8, help="Pages per document")
+    parser.add_argument('--queries', type=int, default=len(QUERIES))
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--skip-generate', action='store_true', help="Stop after retrieval")
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'localgpt-pipeline-benchmark'))
+    parser.add_argument('--save', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="A JSON file from an earlier --save to compare against")
+    args = parser.parse_args()
+    args.save = args.save and os.path.abspath(args.save)
+    args.compare = args.compare and os.path.abspath(args.compare)
+    os.makedirs(args.workdir, exist_ok=True)
+
+    from benchmarks.tiny_models import TinyRAGModel, build_tiny_qwen
+
+    if not args.skip_generate:
+        os.environ['QWEN_MODEL_ID'] = build_tiny_qwen(os.path.join(args.workdir, 'qwen-tiny'))
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ['MODEL_WORKER_ADDRESS'] = ''
+    # The indexer imports byaldi when it runs; serve it the tiny model instead
+    sys.modules['byaldi'] = types.SimpleNamespace(RAGMultiModalModel=TinyRAGModel)
+
+    # Uploads, indexes and page images go to a scratch folder, not the app's
+    run_folder = tempfile.mkdtemp(prefix='run-', dir=args.workdir)
+    os.chdir(run_folder)
+
+    from models.tracing import add_span_listener
+    recorder = StageRecorder()
+    add_span_listener(recorder)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {level['docs']: level for level in json.load(f)['levels']}
+
+    results = {'build': build_info(), 'config': vars(args), 'levels': []}
+    try:
+        for docs in (int(value) for value in args.docs.split(',')):
+            level = run_level(docs, args, args.workdir, recorder)
+            results['levels'].append(level)
+            print_level(level, (baseline or {}).get(docs))
+    finally:
+        os.chdir(APP_DIR)
+        shutil.rmtree(run_folder, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline written to {args.save}")
+
+
+if __name__ == '__main__':
+    main()
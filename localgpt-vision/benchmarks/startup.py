@@ -0,0 +1,102 @@
+# benchmarks/startup.py
+
+"""
+Measures server startup: import time of app.py (with the slowest modules from
+-X importtime), time to the first /health response, and time until /ready
+reports every preloaded model as ready.
+
+Each scenario runs in a fresh interpreter so nothing is already imported.
+
+Usage (from the localgpt-vision directory):
+    python -m benchmarks.startup
+    python -m benchmarks.startup --preload qwen --tiny --runs 3
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+# Runs inside the child interpreter and prints one JSON line of timings
+_CHILD = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+client.get('/health')
+first_response = time.perf_counter()
+ready = None
+deadline = first_response + {ready_timeout}
+while time.perf_counter() < deadline:
+    if client.get('/ready').status_code == 200:
+        ready = time.perf_counter()
+        break
+    time.sleep(0.05)
+print(json.dumps({{
+    'import_seconds': imported - start,
+    'first_response_seconds': first_response - start,
+    'ready_seconds': None if ready is None else ready - start,
+}}))
+"""
+
+
+def slowest_imports(env, top):
+    """
+    Returns the modules with the largest cumulative import time when importing app.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                            cwd=APP_DIR, env=env, capture_output=True, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        # Format: "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.strip() != "app":
+            modules.append((int(cumulative), name.strip()))
+    modules.sort(reverse=True)
+    return [{'module': name, 'seconds': round(us / 1e6, 3)} for us, name in modules[:top]]
+
+
+def run_scenario(env, ready_timeout):
+    result = subprocess.run([sys.executable, "-c", _CHILD.format(ready_timeout=ready_timeout)],
+                            cwd=APP_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else "startup failed")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    return {key: None if value is None else round(value, 3) for key, value in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--preload", default="", help="Models for the second scenario, e.g. 'qwen'")
+    parser.add_argument("--tiny", action="store_true", help="Preload a tiny random Qwen model instead of the real one")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--ready-timeout", type=float, default=600.0)
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "localgpt-tiny-models"))
+    args = parser.parse_args()
+
+    env = dict(os.environ, PRELOAD_GENERATION_MODELS="", PRELOAD_INDEXER_MODELS="")
+    scenarios = {'no_models': env}
+    if args.preload:
+        preload_env = dict(env, PRELOAD_GENERATION_MODELS=args.preload)
+        if args.tiny:
+            from benchmarks.tiny_models import build_tiny_qwen
+            preload_env["QWEN_MODEL_ID"] = build_tiny_qwen(os.path.join(args.workdir, "qwen-startup"))
+        scenarios['preloaded'] = preload_env
+
+    report = {'slowest_imports': slowest_imports(env, args.top)}
+    for name, scenario_env in scenarios.items():
+        report[name] = [run_scenario(scenario_env, args.ready_timeout) for _ in range(args.runs)]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
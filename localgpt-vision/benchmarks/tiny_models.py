@@ -0,0 +1,196 @@
+# benchmarks/tiny_models.py
+
+"""
+Builds tiny randomly initialized Qwen2-VL checkpoints for validating local
+generation code paths (assisted decoding, CPU precision modes) without a GPU.
+
+The checkpoints reuse the real Qwen2-VL processor, so prompts, special tokens
+and image preprocessing match production; only the weights are tiny and random.
+The processor comes from TINY_PROCESSOR_ID (a hub id or a local directory) and
+is taken from the local Hugging Face cache when it is there, so runs after the
+first need no network.
+
+TinyRAGModel does the same for indexing: it has byaldi's RAGMultiModalModel
+interface and rasterizes PDFs like byaldi, but encodes pages with a tiny
+random multi-vector encoder instead of ColPali.
+"""
+
+import base64
+import hashlib
+import io
+import os
+import re
+from dataclasses import dataclass
+
+import torch
+from transformers import AutoProcessor, Qwen2VLConfig, Qwen2VLForConditionalGeneration
+
+PROCESSOR_ID = os.getenv("TINY_PROCESSOR_ID", "Qwen/Qwen2-VL-2B-Instruct")
+
+
+def tiny_qwen_config(num_hidden_layers=2, hidden_size=64):
+    """
+    Returns a Qwen2-VL config with the production vocabulary and tiny layers.
+    """
+    num_attention_heads = 4
+    head_dim = hidden_size // num_attention_heads
+    # mrope sections split the rotary half-dimension over (temporal, height, width)
+    half = head_dim // 2
+    mrope_section = [half // 2, half // 4, half - half // 2 - half // 4]
+    return Qwen2VLConfig(
+        vocab_size=151936,
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_hidden_layers,
+        num_attention_heads=num_attention_heads,
+        num_key_value_heads=2,
+        max_position_embeddings=4096,
+        rope_scaling={"type": "mrope", "mrope_section": mrope_section},
+        vision_config={
+            "depth": 1,
+            "embed_dim": 32,
+            "hidden_size": hidden_size,
+            "num_heads": 2,
+            "mlp_ratio": 2,
+            "patch_size": 14,
+            "spatial_merge_size": 2,
+            "temporal_patch_size": 2,
+        },
+    )
+
+
+def load_processor(processor_id=PROCESSOR_ID):
+    """
+    Loads the Qwen2-VL processor, from the local cache if possible.
+    """
+    try:
+        return AutoProcessor.from_pretrained(processor_id, local_files_only=True)
+    except OSError:
+        return AutoProcessor.from_pretrained(processor_id)
+
+
+def build_tiny_qwen(output_dir, num_hidden_layers=2, hidden_size=64, seed=0, processor_id=PROCESSOR_ID):
+    """
+    Saves a tiny random Qwen2-VL model and the real processor to output_dir.
+
+    Returns:
+        str: output_dir, usable as QWEN_MODEL_ID or QWEN_DRAFT_MODEL_ID.
+    """
+    if os.path.exists(os.path.join(output_dir, "config.json")):
+        return output_dir
+    torch.manual_seed(seed)
+    model = Qwen2VLForConditionalGeneration(tiny_qwen_config(num_hidden_layers, hidden_size))
+    model.save_pretrained(output_dir)
+    load_processor(processor_id).save_pretrained(output_dir)
+    return output_dir
+
+
+class TinyColEncoder(torch.nn.Module):
+    """
+    A ColPali-shaped encoder with random weights: one normalized vector per
+    image patch and per query word, scored by late interaction (MaxSim).
+    """
+
+    def __init__(self, dim=128, image_size=224, patch_size=14, vocab_size=32768):
+        super().__init__()
+        self.image_size = image_size
+        self.patch_size = patch_size
+        self.vocab_size = vocab_size
+        self.patch_projection = torch.nn.Linear(3 * patch_size * patch_size, dim)
+        self.token_embedding = torch.nn.Embedding(vocab_size, dim)
+
+    @torch.no_grad()
+    def encode_images(self, images):
+        """
+        Returns a (pages, patches, dim) tensor for a list of PIL images.
+        """
+        from torchvision.transforms.functional import pil_to_tensor
+
+        size, patch = self.image_size, self.patch_size
+        pixels = torch.stack([pil_to_tensor(image.convert('RGB').resize((size, size))) for image in images])
+        pixels = pixels.float() / 255
+        patches = pixels.unfold(2, patch, patch).unfold(3, patch, patch)
+        patches = patches.permute(0, 2, 3, 1, 4, 5).reshape(len(images), -1, 3 * patch * patch)
+        return torch.nn.functional.normalize(self.patch_projection(patches), dim=-1)
+
+    @torch.no_grad()
+    def encode_query(self, query):
+        words = re.findall(r'\w+', query.lower()) or ['']
+        ids = torch.tensor([int(hashlib.md5(word.encode()).hexdigest(), 16) % self.vocab_size for word in words])
+        return torch.nn.functional.normalize(self.token_embedding(ids), dim=-1)
+
+    @staticmethod
+    def score(query_embeddings, page_embeddings):
+        # Sum over query vectors of the best-matching patch of each page
+        return torch.einsum('qd,npd->nqp', query_embeddings, page_embeddings).max(dim=-1).values.sum(dim=-1)
+
+
+@dataclass
+class TinySearchResult:
+    doc_id: int
+    page_num: int
+    score: float
+    metadata: dict
+    base64: str
+
+
+class TinyRAGModel:
+    """
+    Stands in for byaldi's RAGMultiModalModel in indexing benchmarks.
+
+    index() rasterizes PDFs with pdf2image as byaldi does, encodes the pages
+    with a TinyColEncoder and writes the index to index_root/index_name;
+    search() returns results with the same fields as byaldi's.
+    """
+
+    def __init__(self, encoder, index_root='.byaldi'):
+        self.encoder = encoder
+        self.index_root = index_root
+        self.embeddings = None
+        self.pages = []
+        self.collection = {}
+
+    @classmethod
+    def from_pretrained(cls, pretrained_model_name_or_path, index_root='.byaldi', seed=0, **kwargs):
+        torch.manual_seed(seed)
+        return cls(TinyColEncoder().eval(), index_root)
+
+    def index(self, input_path, index_name, store_collection_with_index=False, overwrite=False, batch_size=4,
+              **kwargs):
+        from pdf2image import convert_from_path
+        from PIL import Image
+
+        if os.path.isdir(input_path):
+            paths = [os.path.join(input_path, name) for name in sorted(os.listdir(input_path))]
+        else:
+            paths = [input_path]
+        embeddings = []
+        for doc_id, path in enumerate(paths):
+            if path.lower().endswith('.pdf'):
+                images = convert_from_path(path)
+            elif path.lower().endswith(('.png', '.jpg', '.jpeg')):
+                images = [Image.open(path)]
+            else:
+                continue
+            for start in range(0, len(images), batch_size):
+                embeddings.append(self.encoder.encode_images(images[start:start + batch_size]))
+            for page_num, image in enumerate(images, start=1):
+                if store_collection_with_index:
+                    buffer = io.BytesIO()
+                    image.save(buffer, format='PNG')
+                    self.collection[len(self.pages)] = base64.b64encode(buffer.getvalue()).decode()
+                self.pages.append((doc_id, page_num))
+        self.embeddings = torch.cat(embeddings)
+
+        index_path = os.path.join(self.index_root, index_name)
+        os.makedirs(index_path, exist_ok=True)
+        torch.save({'embeddings': self.embeddings, 'pages': self.pages, 'collection': self.collection},
+                   os.path.join(index_path, 'index.pt'))
+        return self
+
+    def search(self, query, k=3):
+        scores = self.encoder.score(self.encoder.encode_query(query), self.embeddings)
+        top = torch.topk(scores, min(k, len(self.pages)))
+        return [TinySearchResult(doc_id=self.pages[i][0], page_num=self.pages[i][1], score=float(score),
+                                 metadata={}, base64=self.collection.get(i))
+                for score, i in zip(top.values.tolist(), top.indices.tolist())]
@@ -1,11 +1,159 @@
 # logger.py
 
+import atexit
+import copy
+import json
 import logging
+import os
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Console and file output; the file rotates at LOG_FILE_MAX_BYTES
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.getenv("LOG_FILE", "app.log")
+LOG_FILE_LEVEL = os.getenv("LOG_FILE_LEVEL", "DEBUG").upper()
+LOG_FILE_MAX_BYTES = int(os.getenv("LOG_FILE_MAX_BYTES", 50 * 1024 * 1024))
+LOG_FILE_BACKUPS = int(os.getenv("LOG_FILE_BACKUPS", 5))
+# 'text' or 'json' (one JSON object per line)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+
+def _parse_module_settings(value, convert):
+    # "models.retriever=WARNING,models=INFO" -> {'models.retriever': ..., 'models': ...}
+    settings = {}
+    for pair in value.split(','):
+        if '=' in pair:
+            module, setting = pair.split('=', 1)
+            settings[module.strip()] = convert(setting.strip())
+    return settings
+
+
+# Per-module levels, e.g. LOG_LEVELS="models.retriever=WARNING,models.tracing=DEBUG"
+LOG_LEVELS = _parse_module_settings(os.getenv("LOG_LEVELS", ""), str.upper)
+# Fraction of INFO/DEBUG records kept per module, e.g. LOG_SAMPLING="models.retriever=0.1";
+# warnings and errors are never dropped
+LOG_SAMPLING = _parse_module_settings(os.getenv("LOG_SAMPLING", ""), float)
+
+_TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+
+_queue_handler = None
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def _module_setting(name, settings):
+    """
+    Returns the setting for the most specific module prefix of a logger name, or None.
+    """
+    while name:
+        if name in settings:
+            return settings[name]
+        name = name.rpartition('.')[0]
+    return None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as single-line JSON objects.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _RecordQueueHandler(QueueHandler):
+    """
+    Queues records with the message and traceback rendered to text, leaving
+    the final formatting (text or JSON) to the listener's handlers.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a configured fraction of INFO and DEBUG records per module.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self._cache = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        if record.name not in self._cache:
+            self._cache[record.name] = _module_setting(record.name, self.rates)
+        rate = self._cache[record.name]
+        return rate is None or random.random() < rate
+
+
+def _setup():
+    """
+    Starts the background listener that owns the console and file handlers.
+
+    Loggers only get a QueueHandler, so a log call costs an enqueue in the
+    calling thread and all formatting and disk I/O happens on the listener.
+    """
+    global _queue_handler, _listener
+    with _setup_lock:
+        if _queue_handler is not None:
+            return _queue_handler
+
+        formatter = JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(_TEXT_FORMAT)
+
+        # Console handler
+        c_handler = logging.StreamHandler()
+        c_handler.setLevel(LOG_LEVEL)
+        c_handler.setFormatter(formatter)
+
+        # File handler
+        f_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS)
+        f_handler.setLevel(LOG_FILE_LEVEL)
+        f_handler.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        _listener = QueueListener(log_queue, c_handler, f_handler, respect_handler_level=True)
+        _listener.start()
+        # Drain the queue before the interpreter exits
+        atexit.register(_listener.stop)
+
+        _queue_handler = _RecordQueueHandler(log_queue)
+        _queue_handler.addFilter(SamplingFilter(LOG_SAMPLING))
+        return _queue_handler
+
 
 def get_logger(name):
     """
     Creates a logger with the specified name.
 
+    Records go through a queue to a background listener thread. The level
+    comes from LOG_LEVELS for the module, else the lowest handler level, so
+    records no handler would write are dropped before they are queued.
+
     Args:
         name (str): The name of the logger.
 
@@ -13,25 +161,12 @@ def get_logger(name):
         Logger: Configured logger instance.
     """
     logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
 
     if not logger.handlers:
-        # Console handler
-        c_handler = logging.StreamHandler()
-        c_handler.setLevel(logging.INFO)
-
-        # File handler
-        f_handler = logging.FileHandler('app.log')
-        f_handler.setLevel(logging.DEBUG)
-
-        # Create formatters and add them to handlers
-        c_format = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
-        f_format = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
-        c_handler.setFormatter(c_format)
-        f_handler.setFormatter(f_format)
-
-        # Add handlers to the logger
-        logger.addHandler(c_handler)
-        logger.addHandler(f_handler)
+        level = _module_setting(name, LOG_LEVELS)
+        if level is None:
+            level = min(logging.getLevelName(LOG_LEVEL), logging.getLevelName(LOG_FILE_LEVEL))
+        logger.setLevel(level)
+        logger.addHandler(_setup())
 
     return logger
@@ -0,0 +1,252 @@
+# model_worker.py
+
+"""
+Local model-serving process shared by all web workers.
+
+The worker owns the loaded local models and a bounded request queue. Web
+workers started with the same MODEL_WORKER_ADDRESS send generation requests
+over a Unix socket and pass page images through shared memory, so HTTP
+workers can be scaled without loading a copy of each model per worker.
+Requests queued for a backend that supports batching run as one batch.
+
+Usage:
+    export MODEL_WORKER_ADDRESS=/tmp/localgpt-model-worker.sock
+    export MODEL_WORKER_AUTHKEY=<shared secret>
+    python model_worker.py
+"""
+
+import os
+import queue
+from collections import deque
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Listener
+from models import worker_client
+from models.backends import get_backend, GenerationOptions
+from models.model_loader import model_residency
+from models.preloader import start_preloading
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+ADDRESS = worker_client.MODEL_WORKER_ADDRESS or os.path.join(tempfile.gettempdir(), "localgpt-model-worker.sock")
+QUEUE_SIZE = int(os.getenv("MODEL_WORKER_QUEUE_SIZE", 32))
+THREADS = int(os.getenv("MODEL_WORKER_THREADS", 1))
+# Queued requests for one batch-capable backend (Qwen) run as a single batch of up to this many prompts
+MAX_BATCH = int(os.getenv("MODEL_WORKER_MAX_BATCH", 4))
+PAGE_DIR = os.getenv("MODEL_WORKER_PAGE_DIR", os.path.join(tempfile.gettempdir(), "localgpt-worker-pages"))
+
+# This process serves the local models itself and must never forward to a worker
+worker_client.MODEL_WORKER_ADDRESS = None
+
+_jobs = queue.Queue(maxsize=QUEUE_SIZE)
+
+# Requests using each materialized page; a page is deleted when its count drops to zero
+_page_refs = {}
+_pages_lock = threading.Lock()
+
+
+def _read_shared_image(descriptor):
+    block = shared_memory.SharedMemory(name=descriptor['shm'])
+    try:
+        # The client owns the block; stop this process's tracker from unlinking it
+        resource_tracker.unregister(block._name, 'shared_memory')
+        return bytes(block.buf[:descriptor['size']])
+    finally:
+        block.close()
+
+
+def _materialize(descriptor):
+    """
+    Returns a local path for a shared page image and takes a reference on it.
+
+    Paths are derived from the content digest, so they stay stable across
+    requests for the same page and the image-prefix KV cache keeps hitting
+    for follow-up questions. Release the paths with _release_pages.
+    """
+    path = os.path.join(PAGE_DIR, descriptor['digest'] + descriptor['suffix'])
+    with _pages_lock:
+        if path not in _page_refs:
+            # Count the reference only once the file exists, so a failed write
+            # leaves no reference behind and the next request writes it again
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(_read_shared_image(descriptor))
+                os.replace(tmp_path, path)
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except FileNotFoundError:
+                    pass
+                raise
+        _page_refs[path] = _page_refs.get(path, 0) + 1
+    return path
+
+
+def _release_pages(paths):
+    """
+    Drops one reference on each page and deletes the pages no request still uses.
+    """
+    with _pages_lock:
+        for path in paths:
+            _page_refs[path] -= 1
+            if _page_refs[path] == 0:
+                del _page_refs[path]
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+def _run_job(job):
+    request = job['request']
+    backend = get_backend(request['model_choice'])
+    if backend is None or backend.capabilities.remote:
+        return {'error': f"Model worker does not serve '{request['model_choice']}'."}
+    images = []
+    try:
+        for descriptor in request['images']:
+            images.append(_materialize(descriptor))
+        options = GenerationOptions(**request['options'])
+        start_time = time.perf_counter()
+        text = backend.run('generate', images, request['query'], options)
+    finally:
+        _release_pages(images)
+    return {
+        'text': text,
+        'seconds': time.perf_counter() - start_time,
+        'queue_seconds': start_time - job['queued_at'],
+    }
+
+
+def _run_batch(jobs):
+    """
+    Runs jobs for one batch-capable backend as a single batched generation.
+    """
+    backend = get_backend(jobs[0]['request']['model_choice'])
+    images = []
+    try:
+        prompts = []
+        for job in jobs:
+            pages = []
+            for descriptor in job['request']['images']:
+                pages.append(_materialize(descriptor))
+                images.append(pages[-1])
+            prompts.append((pages, job['request']['query'], GenerationOptions(**job['request']['options'])))
+        start_time = time.perf_counter()
+        texts = backend.run('generate_batch', prompts)
+    finally:
+        _release_pages(images)
+    seconds = time.perf_counter() - start_time
+    logger.info(f"Batched {len(jobs)} '{backend.name}' requests in {seconds:.2f}s.")
+    return [{'text': text, 'seconds': seconds, 'queue_seconds': start_time - job['queued_at']}
+            for job, text in zip(jobs, texts)]
+
+
+def _take_jobs(deferred):
+    """
+    Takes the next job and, if its backend supports batching, up to MAX_BATCH - 1
+    more queued jobs for the same backend. Other jobs taken meanwhile are
+    deferred to the next round, in order.
+    """
+    jobs = [deferred.popleft() if deferred else _jobs.get()]
+    backend = get_backend(jobs[0]['request']['model_choice'])
+    if backend is None or not backend.capabilities.supports_batching:
+        return jobs
+    for job in list(deferred):
+        if len(jobs) < MAX_BATCH and job['request']['model_choice'] == backend.name:
+            deferred.remove(job)
+            jobs.append(job)
+    while len(jobs) < MAX_BATCH:
+        try:
+            job = _jobs.get_nowait()
+        except queue.Empty:
+            break
+        (jobs if job['request']['model_choice'] == backend.name else deferred).append(job)
+    return jobs
+
+
+def _run_jobs(jobs):
+    if len(jobs) > 1:
+        try:
+            return _run_batch(jobs)
+        except Exception as e:
+            logger.error(f"Error in batched generation, falling back to one request at a time: {e}", exc_info=True)
+    replies = []
+    for job in jobs:
+        try:
+            replies.append(_run_job(job))
+        except Exception as e:
+            logger.error(f"Error in model worker job: {e}", exc_info=True)
+            replies.append({'error': str(e)})
+    return replies
+
+
+def _generation_loop():
+    deferred = deque()
+    while True:
+        jobs = _take_jobs(deferred)
+        try:
+            replies = _run_jobs(jobs)
+        except Exception as e:
+            logger.error(f"Error in model worker jobs: {e}", exc_info=True)
+            replies = [{'error': str(e)}] * len(jobs)
+        for job, reply in zip(jobs, replies):
+            job['reply'] = reply
+            job['done'].set()
+
+
+def _handle_connection(conn):
+    with conn:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request.get('op') == 'status':
+            conn.send({'queue_depth': _jobs.qsize(), 'queue_size': QUEUE_SIZE, **model_residency()})
+            return
+        if request.get('op') != 'generate':
+            conn.send({'error': f"Unknown operation: {request.get('op')}"})
+            return
+
+        job = {'request': request, 'queued_at': time.perf_counter(), 'done': threading.Event()}
+        try:
+            _jobs.put_nowait(job)
+        except queue.Full:
+            conn.send({'error': 'Model worker queue is full.'})
+            return
+        job['done'].wait()
+        conn.send(job['reply'])
+
+
+def main():
+    if not worker_client.MODEL_WORKER_AUTHKEY:
+        raise SystemExit("Set MODEL_WORKER_AUTHKEY to a shared secret before starting the model worker.")
+    os.makedirs(PAGE_DIR, exist_ok=True)
+    # Pages left behind by an earlier run that did not shut down cleanly
+    for name in os.listdir(PAGE_DIR):
+        os.remove(os.path.join(PAGE_DIR, name))
+    if os.path.exists(ADDRESS):
+        os.remove(ADDRESS)
+
+    for index in range(THREADS):
+        threading.Thread(target=_generation_loop, name=f"generation-{index}", daemon=True).start()
+    start_preloading()
+
+    with Listener(ADDRESS, family='AF_UNIX', authkey=worker_client.MODEL_WORKER_AUTHKEY) as listener:
+        logger.info(f"Model worker listening on {ADDRESS} ({THREADS} generation thread(s), queue size {QUEUE_SIZE}).")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                # Failed handshakes (e.g. wrong authkey) must not stop the worker
+                logger.warning(f"Rejected model worker connection: {e}")
+                continue
+            threading.Thread(target=_handle_connection, args=(conn,), daemon=True).start()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+# models/admission.py
+
+import contextvars
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Worker threads and queue depth (tasks waiting for a worker) per kind of work
+EXECUTOR_LIMITS = {
+    'indexing': (int(os.getenv("INDEXING_WORKERS", 1)), int(os.getenv("INDEXING_QUEUE_DEPTH", 2))),
+    'retrieval': (int(os.getenv("RETRIEVAL_WORKERS", 2)), int(os.getenv("RETRIEVAL_QUEUE_DEPTH", 8))),
+    'generation': (int(os.getenv("GENERATION_WORKERS", 2)), int(os.getenv("GENERATION_QUEUE_DEPTH", 8))),
+}
+# Weight of the latest task in the moving average used for Retry-After estimates
+_DURATION_SMOOTHING = 0.2
+
+
+class Overloaded(RuntimeError):
+    """
+    Raised when a kind of work has no queue space left.
+
+    Attributes:
+        kind (str): The executor that rejected the task.
+        retry_after (int): Suggested seconds to wait before retrying.
+    """
+
+    def __init__(self, kind, retry_after):
+        super().__init__(f"The server is busy with other {kind} requests. Please retry in {retry_after} seconds.")
+        self.kind = kind
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """
+    Thread pool that rejects work instead of queueing it without bound.
+
+    At most `max_workers` tasks run at once and `max_queue` more may wait;
+    `submit` raises Overloaded beyond that, so a burst of heavy requests
+    cannot tie up every server thread.
+    """
+
+    def __init__(self, kind, max_workers, max_queue):
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=kind)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+        self._average_duration = None
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedules fn(*args, **kwargs) and returns its Future.
+
+        Raises:
+            Overloaded: If all workers are busy and the queue is full.
+        """
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                retry_after = self._retry_after()
+                logger.warning(f"Rejected {self.kind} task: {self._in_flight} in flight, retry after {retry_after}s.")
+                raise Overloaded(self.kind, retry_after)
+            self._in_flight += 1
+
+        # Run in a copy of the caller's context so the task keeps its request id
+        context = contextvars.copy_context()
+
+        def timed():
+            start = time.monotonic()
+            try:
+                return context.run(fn, *args, **kwargs)
+            finally:
+                self._finished(time.monotonic() - start)
+
+        try:
+            return self._executor.submit(timed)
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+
+    def run(self, fn, *args, **kwargs):
+        """
+        Runs fn on the pool and waits for its result.
+        """
+        return self.submit(fn, *args, **kwargs).result()
+
+    def stream(self, fn, *args, **kwargs):
+        """
+        Runs the generator function fn on the pool and returns a generator of its items.
+
+        Admission happens here, before the first item, so Overloaded can still
+        be answered with a 503. Closing the returned generator (e.g. when the
+        client disconnects) closes fn's generator at its next item, which
+        frees the worker and any backend slot it holds.
+
+        Raises:
+            Overloaded: If all workers are busy and the queue is full.
+        """
+        items = queue.Queue()
+        cancelled = threading.Event()
+
+        def produce():
+            try:
+                generator = fn(*args, **kwargs)
+                try:
+                    for item in generator:
+                        if cancelled.is_set():
+                            return
+                        items.put(('item', item))
+                finally:
+                    if hasattr(generator, 'close'):
+                        generator.close()
+            except Exception as e:
+                items.put(('error', e))
+            finally:
+                items.put(('done', None))
+
+        self.submit(produce)
+
+        def consume():
+            try:
+                while True:
+                    kind, value = items.get()
+                    if kind == 'error':
+                        raise value
+                    if kind == 'done':
+                        return
+                    yield value
+            finally:
+                cancelled.set()
+
+        return consume()
+
+    def _finished(self, duration):
+        with self._lock:
+            self._in_flight -= 1
+            if self._average_duration is None:
+                self._average_duration = duration
+            else:
+                self._average_duration += _DURATION_SMOOTHING * (duration - self._average_duration)
+
+    def _retry_after(self):
+        # Time for the tasks ahead to drain, in rounds of max_workers tasks
+        average = self._average_duration or 1.0
+        rounds = math.ceil(self._in_flight / self.max_workers)
+        return max(1, math.ceil(average * rounds))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'queue_depth': self.max_queue,
+                'in_flight': self._in_flight,
+                'rejected': self._rejected,
+                'average_seconds': round(self._average_duration, 3) if self._average_duration is not None else None,
+            }
+
+
+executors = {kind: BoundedExecutor(kind, workers, queue) for kind, (workers, queue) in EXECUTOR_LIMITS.items()}
+
+
+def executor_stats():
+    """
+    Returns the load of every executor, for the health endpoint.
+    """
+    return {kind: executor.stats() for kind, executor in executors.items()}
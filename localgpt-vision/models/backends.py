@@ -0,0 +1,517 @@
+# models/backends.py
+
+import base64
+import os
+import threading
+import time
+from dataclasses import dataclass
+from models.model_loader import load_model, load_draft_model, record_cache_bytes
+from models.image_encoder import encode_image_payload, image_data_url, image_payload_bytes
+from models.resolution import plan_page_sizes, record_latency, visual_tokens
+from models.prefix_cache import generate_with_prefix_cache, generation_lock, prefix_cache_bytes
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Seconds a local stream waits for the next token (or the first, after prefill) before failing
+STREAM_TOKEN_TIMEOUT = float(os.getenv("STREAM_TOKEN_TIMEOUT", 300))
+
+
+@dataclass(frozen=True)
+class BackendCapabilities:
+    """
+    What a generation backend can do, used by the responder to cap, batch and stream requests.
+
+    Attributes:
+        max_images (int): Maximum number of page images per prompt.
+        supports_batching (bool): Whether several prompts can run in one forward pass.
+        supports_streaming (bool): Whether tokens can be yielded as they are generated.
+        max_concurrency (int): Maximum number of requests running on the backend at once.
+        remote (bool): Whether the backend is a remote API (eligible for hedging).
+    """
+    max_images: int
+    supports_batching: bool = False
+    supports_streaming: bool = False
+    max_concurrency: int = 1
+    remote: bool = False
+
+
+@dataclass
+class GenerationOptions:
+    resized_height: int = None
+    resized_width: int = None
+    visual_token_budget: int = None
+    latency_target: float = None
+
+
+class GenerationBackend:
+    """
+    Base class for generation backends.
+
+    Subclasses declare `name` and `capabilities` and implement `generate`; they
+    raise on failure and leave turning errors into user-facing messages to the
+    responder. `stream` and `generate_batch` fall back to `generate`.
+    """
+
+    name = None
+    capabilities = BackendCapabilities(max_images=1)
+
+    def __init__(self):
+        self._slots = threading.BoundedSemaphore(self.capabilities.max_concurrency)
+
+    def generate(self, images, query, options):
+        raise NotImplementedError
+
+    def stream(self, images, query, options):
+        yield self.generate(images, query, options)
+
+    def generate_batch(self, requests):
+        return [self.generate(images, query, options) for images, query, options in requests]
+
+    def run(self, method, *args):
+        """
+        Calls one of the generation methods while holding a concurrency slot.
+        """
+        with self._slots:
+            return getattr(self, method)(*args)
+
+    def run_stream(self, images, query, options):
+        """
+        Yields from `stream` while holding a concurrency slot.
+
+        The slot is taken on the first chunk and released when the stream ends,
+        fails or is closed early, e.g. because the client disconnected.
+        """
+        self._slots.acquire()
+        try:
+            # Closing this generator closes the backend's stream too
+            yield from self.stream(images, query, options)
+        finally:
+            self._slots.release()
+
+
+def _assisted_generate_kwargs(model_choice):
+    """
+    Returns the extra generate() arguments for assisted decoding, if a draft model is configured.
+    """
+    draft_model = load_draft_model(model_choice)
+    if draft_model is None:
+        return {}
+    return {"assistant_model": draft_model}
+
+
+def _log_decode_speed(model_choice, new_tokens, elapsed, generate_kwargs):
+    mode = "assisted" if "assistant_model" in generate_kwargs else "standard"
+    tokens_per_second = new_tokens / elapsed if elapsed > 0 else 0.0
+    logger.info(f"{model_choice} {mode} decoding: {new_tokens} tokens in {elapsed:.2f}s ({tokens_per_second:.1f} tokens/s).")
+
+
+def _stream_local(processor, generate):
+    """
+    Yields the text of a local generation as it is produced.
+
+    generate(streamer=..., stopping_criteria=...) runs the generation on a
+    separate thread and must pass both arguments on to model.generate().
+    """
+    from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+    # A stalled generation fails the stream instead of blocking the consumer forever
+    streamer = TextIteratorStreamer(processor.tokenizer, skip_prompt=True, skip_special_tokens=True,
+                                    timeout=STREAM_TOKEN_TIMEOUT)
+    cancelled = threading.Event()
+    errors = []
+
+    class StopWhenCancelled(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return cancelled.is_set()
+
+    def run():
+        try:
+            generate(streamer=streamer, stopping_criteria=StoppingCriteriaList([StopWhenCancelled()]))
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            # Ends the consumer's iteration when generate() failed; a second end() is harmless
+            streamer.end()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    try:
+        yield from streamer
+    finally:
+        # A consumer that stops early (e.g. a disconnected client) ends generation at the next token
+        cancelled.set()
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+class QwenBackend(GenerationBackend):
+    name = 'qwen'
+    capabilities = BackendCapabilities(
+        max_images=8,
+        supports_batching=True,
+        supports_streaming=True,
+    )
+
+    def _page_sizes(self, images, options):
+        if options.visual_token_budget:
+            return plan_page_sizes(images, options.visual_token_budget, options.latency_target)
+        # Ensure dimensions are multiples of 28
+        return [((options.resized_height // 28) * 28, (options.resized_width // 28) * 28)] * len(images)
+
+    def _prompt(self, processor, images, query, page_sizes):
+        image_contents = []
+        for image, (page_height, page_width) in zip(images, page_sizes):
+            image_contents.append({
+                "type": "image",
+                "image": image,  # Use the full path
+                "resized_height": page_height,
+                "resized_width": page_width
+            })
+        messages = [
+            {
+                "role": "user",
+                "content": image_contents + [{"type": "text", "text": query}],
+            }
+        ]
+        text = processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return messages, text
+
+    def _inputs(self, processor, device, prompts):
+        from qwen_vl_utils import process_vision_info
+
+        all_messages = [message for messages, _ in prompts for message in messages]
+        image_inputs, video_inputs = process_vision_info(all_messages)
+        inputs = processor(
+            text=[text for _, text in prompts],
+            images=image_inputs,
+            videos=video_inputs,
+            padding=True,
+            return_tensors="pt",
+        )
+        return inputs.to(device)
+
+    def _generate_ids(self, model, processor, inputs, images, page_sizes, **stream_kwargs):
+        """
+        Runs one prompt through the prefix cache and assisted decoding, and records its timings.
+
+        Shared by `generate` and `stream`; stream_kwargs are the streamer and
+        stopping criteria of a streamed generation.
+        """
+        start_time = time.perf_counter()
+        # Follow-up questions on the same pages reuse the image-prefix KV state
+        cache_key = (tuple(images), tuple(page_sizes))
+        generate_kwargs = _assisted_generate_kwargs('qwen')
+        timings = {}
+        generated_ids = generate_with_prefix_cache(model, processor, inputs, cache_key, timings=timings,
+                                                   max_new_tokens=128, **generate_kwargs, **stream_kwargs)
+        elapsed = time.perf_counter() - start_time
+        record_cache_bytes('qwen', prefix_cache_bytes(model))
+        _log_decode_speed('qwen', generated_ids.shape[1] - inputs.input_ids.shape[1], elapsed, generate_kwargs)
+        total_visual_tokens = sum(visual_tokens(h, w) for h, w in page_sizes)
+        # A cached image prefix skips most of the prefill, so it says nothing about the page cost
+        if timings['prefix_cache'] != 'hit':
+            record_latency(total_visual_tokens, timings['prefill_seconds'])
+        logger.info(f"Qwen page sizes {page_sizes} ({total_visual_tokens} visual tokens): "
+                    f"prefill {timings['prefill_seconds']:.2f}s ({timings['prefix_cache']}), total {elapsed:.2f}s.")
+        return generated_ids
+
+    def generate(self, images, query, options):
+        model, processor, device = load_model('qwen')
+        page_sizes = self._page_sizes(images, options)
+        inputs = self._inputs(processor, device, [self._prompt(processor, images, query, page_sizes)])
+        generated_ids = self._generate_ids(model, processor, inputs, images, page_sizes)
+
+        generated_ids_trimmed = [
+            out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
+        ]
+        output_text = processor.batch_decode(
+            generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+        )
+        logger.info("Response generated using Qwen model.")
+        return output_text[0]
+
+    def stream(self, images, query, options):
+        model, processor, device = load_model('qwen')
+        page_sizes = self._page_sizes(images, options)
+        inputs = self._inputs(processor, device, [self._prompt(processor, images, query, page_sizes)])
+
+        def generate(**stream_kwargs):
+            # Streams get the same prefix cache, assisted decoding and timing samples as generate()
+            self._generate_ids(model, processor, inputs, images, page_sizes, **stream_kwargs)
+
+        yield from _stream_local(processor, generate)
+
+    def generate_batch(self, requests):
+        model, processor, device = load_model('qwen')
+        prompts = []
+        for images, query, options in requests:
+            prompts.append(self._prompt(processor, images, query, self._page_sizes(images, options)))
+        # Decoder-only batches must be left-padded so generation continues each prompt
+        padding_side = processor.tokenizer.padding_side
+        processor.tokenizer.padding_side = 'left'
+        try:
+            inputs = self._inputs(processor, device, prompts)
+        finally:
+            processor.tokenizer.padding_side = padding_side
+        with generation_lock(model):
+            generated_ids = model.generate(**inputs, max_new_tokens=128)
+        generated_ids_trimmed = generated_ids[:, inputs.input_ids.shape[1]:]
+        logger.info(f"Batched Qwen generation for {len(requests)} prompts.")
+        return processor.batch_decode(
+            generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+        )
+
+
+class LlamaVisionBackend(GenerationBackend):
+    name = 'llama-vision'
+    capabilities = BackendCapabilities(max_images=1, supports_streaming=True)
+
+    def _inputs(self, images, query):
+        from PIL import Image
+
+        model, processor, device = load_model('llama-vision')
+        image = Image.open(images[0]).convert('RGB')
+        messages = [
+            {"role": "user", "content": [
+                {"type": "image"},
+                {"type": "text", "text": query}
+            ]}
+        ]
+        input_text = processor.apply_chat_template(messages, add_generation_prompt=True)
+        inputs = processor(image, input_text, return_tensors="pt").to(device)
+        return model, processor, inputs
+
+    def generate(self, images, query, options):
+        model, processor, inputs = self._inputs(images, query)
+        generate_kwargs = _assisted_generate_kwargs('llama-vision')
+        start_time = time.perf_counter()
+        output = model.generate(**inputs, max_new_tokens=512, **generate_kwargs)
+        _log_decode_speed('llama-vision', output.shape[1] - inputs['input_ids'].shape[1],
+                          time.perf_counter() - start_time, generate_kwargs)
+        return processor.decode(output[0], skip_special_tokens=True)
+
+    def stream(self, images, query, options):
+        model, processor, inputs = self._inputs(images, query)
+        generate_kwargs = _assisted_generate_kwargs('llama-vision')
+
+        def generate(**stream_kwargs):
+            with generation_lock(model):
+                model.generate(**inputs, max_new_tokens=512, **generate_kwargs, **stream_kwargs)
+
+        yield from _stream_local(processor, generate)
+
+
+class PixtralBackend(GenerationBackend):
+    name = 'pixtral'
+    capabilities = BackendCapabilities(max_images=4)
+
+    def generate(self, images, query, options):
+        from mistral_common.protocol.instruct.messages import UserMessage, TextChunk, ImageURLChunk
+        from mistral_common.protocol.instruct.request import ChatCompletionRequest
+
+        model, tokenizer, generate_func, device = load_model('pixtral')
+
+        def image_to_data_url(image_path):
+            with open(image_path, "rb") as image_file:
+                encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
+            ext = os.path.splitext(image_path)[1][1:]  # Get the file extension
+            return f"data:image/{ext};base64,{encoded_string}"
+
+        # Prepare the content with text and images
+        content = [TextChunk(text=query)]
+        for img_path in images:
+            content.append(ImageURLChunk(image_url=image_to_data_url(img_path)))
+
+        completion_request = ChatCompletionRequest(messages=[UserMessage(content=content)])
+        encoded = tokenizer.encode_chat_completion(completion_request)
+
+        out_tokens, _ = generate_func([encoded.tokens], model, images=[encoded.images], max_tokens=256, temperature=0.35,
+                                      eos_id=tokenizer.instruct_tokenizer.tokenizer.eos_id)
+        logger.info("Response generated using Pixtral model.")
+        return tokenizer.decode(out_tokens[0])
+
+
+class MolmoBackend(GenerationBackend):
+    name = 'molmo'
+    capabilities = BackendCapabilities(max_images=1)
+
+    def generate(self, images, query, options):
+        import torch
+        from PIL import Image
+        from transformers import GenerationConfig
+
+        model, processor, device = load_model('molmo')
+        pil_images = [Image.open(img_path).convert('RGB') for img_path in images]
+        try:
+            # Process the images and text
+            inputs = processor.process(
+                images=pil_images,
+                text=query
+            )
+
+            # Move inputs to the correct device and make a batch of size 1
+            # Convert float tensors to the model's dtype, but keep integer tensors as they are
+            inputs = {k: (v.to(device).unsqueeze(0).to(model.dtype) if v.dtype in [torch.float32, torch.float64] else
+                          v.to(device).unsqueeze(0))
+                      if isinstance(v, torch.Tensor) else v
+                      for k, v in inputs.items()}
+
+            # Generate output
+            with torch.no_grad():  # Disable gradient calculation
+                output = model.generate_from_batch(
+                    inputs,
+                    GenerationConfig(max_new_tokens=200, stop_strings="<|endoftext|>"),
+                    tokenizer=processor.tokenizer
+                )
+
+            # Only get generated tokens; decode them to text
+            generated_tokens = output[0, inputs['input_ids'].size(1):]
+            return processor.tokenizer.decode(generated_tokens, skip_special_tokens=True)
+        finally:
+            # Close the opened images to free up resources
+            for img in pil_images:
+                img.close()
+
+
+class GeminiBackend(GenerationBackend):
+    name = 'gemini'
+    capabilities = BackendCapabilities(max_images=16, supports_streaming=True, max_concurrency=8, remote=True)
+
+    def _content(self, images, query):
+        content = [query]  # Add the text query first
+        for img_path in images:
+            # The SDK takes raw bytes, so skip the base64 round trip
+            mime_type, data = image_payload_bytes(img_path, 'gemini')
+            content.append({"mime_type": mime_type, "data": data})
+        return content
+
+    def generate(self, images, query, options):
+        model, _ = load_model('gemini')
+        response = model.generate_content(self._content(images, query))
+        if response.text:
+            logger.info("Response generated using Gemini model.")
+            return response.text
+        # Raised rather than returned, so the circuit breaker counts it as a failure
+        raise RuntimeError("The Gemini model did not generate any text response.")
+
+    def stream(self, images, query, options):
+        model, _ = load_model('gemini')
+        for chunk in model.generate_content(self._content(images, query), stream=True):
+            if chunk.text:
+                yield chunk.text
+
+
+class _OpenAICompatibleBackend(GenerationBackend):
+    """
+    Shared request building for providers with the OpenAI chat completions API.
+    """
+
+    model_name = None
+    extra_request_args = {}
+
+    def _client(self):
+        raise NotImplementedError
+
+    def _request(self, images, query, **kwargs):
+        content = [{"type": "text", "text": query}]
+        for img_path in images:
+            logger.info(f"Processing image: {img_path}")
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": image_data_url(img_path, self.name)
+                }
+            })
+        return self._client().chat.completions.create(
+            model=self.model_name,
+            messages=[
+                {
+                    "role": "user",
+                    "content": content
+                }
+            ],
+            **self.extra_request_args,
+            **kwargs
+        )
+
+    def generate(self, images, query, options):
+        response = self._request(images, query)
+        logger.info(f"Response generated using {self.name} model.")
+        return response.choices[0].message.content
+
+    def stream(self, images, query, options):
+        # Closing the stream early also closes the HTTP response
+        with self._request(images, query, stream=True) as response:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+
+class GPT4Backend(_OpenAICompatibleBackend):
+    name = 'gpt4'
+    capabilities = BackendCapabilities(max_images=10, supports_streaming=True, max_concurrency=8, remote=True)
+    model_name = "gpt-4o"
+    extra_request_args = {"max_tokens": 1024}
+
+    def _client(self):
+        from openai import OpenAI
+        return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+class GroqBackend(_OpenAICompatibleBackend):
+    name = 'groq-llama-vision'
+    capabilities = BackendCapabilities(max_images=1, supports_streaming=True, max_concurrency=4, remote=True)
+    model_name = "llava-v1.5-7b-4096-preview"
+
+    def _client(self):
+        return load_model('groq-llama-vision')
+
+
+class OllamaBackend(GenerationBackend):
+    name = 'ollama'
+    # Served over HTTP by a shared Ollama daemon, so it is treated like the
+    # remote providers: hedging and the circuit breaker apply, and the model
+    # worker never loads it.
+    capabilities = BackendCapabilities(
+        max_images=int(os.getenv("OLLAMA_MAX_IMAGES", 1)),
+        supports_streaming=True,
+        max_concurrency=int(os.getenv("OLLAMA_MAX_CONCURRENCY", 2)),
+        remote=True,
+    )
+
+    def _images(self, images):
+        return [encode_image_payload(img_path, 'ollama')[1] for img_path in images]
+
+    def generate(self, images, query, options):
+        client = load_model('ollama')
+        response = client.chat(query, self._images(images))
+        logger.info("Response generated using Ollama model.")
+        return response
+
+    def stream(self, images, query, options):
+        client = load_model('ollama')
+        yield from client.chat_stream(query, self._images(images))
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (
+        QwenBackend(),
+        LlamaVisionBackend(),
+        PixtralBackend(),
+        MolmoBackend(),
+        GeminiBackend(),
+        GPT4Backend(),
+        GroqBackend(),
+        OllamaBackend(),
+    )
+}
+
+
+def get_backend(model_choice):
+    """
+    Returns the backend adapter registered for model_choice, or None.
+    """
+    return BACKENDS.get(model_choice)
@@ -1,7 +1,6 @@
 # models/converters.py
 
 import os
-from docx2pdf import convert
 from logger import get_logger
 
 logger = get_logger(__name__)
@@ -18,6 +17,7 @@ def convert_docs_to_pdfs(folder_path):
             if filename.lower().endswith(('.doc', '.docx')):
                 doc_path = os.path.join(folder_path, filename)
                 pdf_path = os.path.splitext(doc_path)[0] + '.pdf'
+                from docx2pdf import convert
                 convert(doc_path, pdf_path)
                 logger.info(f"Converted '{filename}' to PDF.")
     except Exception as e:
@@ -0,0 +1,280 @@
+# models/disk_gc.py
+
+import os
+import re
+import shutil
+import threading
+import time
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Disk quotas in MB; 0 disables a quota
+DISK_QUOTA_SESSION_MB = float(os.getenv("DISK_QUOTA_SESSION_MB", 2048))
+DISK_QUOTA_TOTAL_MB = float(os.getenv("DISK_QUOTA_TOTAL_MB", 20480))
+# Seconds between collections; 0 disables the background task
+DISK_GC_INTERVAL = float(os.getenv("DISK_GC_INTERVAL", 3600))
+# Files modified or retrieved more recently than this are never collected, so
+# uploads that are still being indexed and pages about to be answered from are
+# left alone
+DISK_GC_GRACE = float(os.getenv("DISK_GC_GRACE", 3600))
+# Whether the global quota may delete whole sessions (least recently used
+# first) once no retrieved pages are left to evict
+DISK_GC_EVICT_SESSIONS = os.getenv("DISK_GC_EVICT_SESSIONS", "false").lower() == "true"
+
+_MB = 1024 * 1024
+_PAGE_IMAGE = re.compile(r'^retrieved_([0-9a-f]{32})\.png$')
+
+# Last retrieval time of each page image by absolute path. Kept here rather
+# than in the file's mtime, which keys the image payload cache.
+_last_used = {}
+_last_used_lock = threading.Lock()
+
+
+def mark_page_used(path):
+    """
+    Records that a retrieved page image was just used, for LRU eviction.
+    """
+    with _last_used_lock:
+        _last_used[os.path.abspath(path)] = time.time()
+
+
+def _page_last_used(path, mtime):
+    with _last_used_lock:
+        return max(mtime, _last_used.get(os.path.abspath(path), 0.0))
+
+
+def tree_usage(path):
+    """
+    Returns (bytes, newest modification time) of everything under path.
+    """
+    total, newest = 0, 0.0
+    try:
+        entries = list(os.scandir(path))
+    except (FileNotFoundError, NotADirectoryError):
+        return 0, 0.0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                size, mtime = tree_usage(entry.path)
+            else:
+                stat = entry.stat(follow_symlinks=False)
+                size, mtime = stat.st_size, stat.st_mtime
+        except FileNotFoundError:
+            continue
+        total += size
+        newest = max(newest, mtime)
+    return total, newest
+
+
+def remove_tree(path):
+    """
+    Deletes a folder and returns the number of bytes it held.
+    """
+    size, _ = tree_usage(path)
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    return size
+
+
+def _page_image_groups(folder):
+    """
+    Lists the retrieved pages in a folder with their thumbnails.
+
+    Returns:
+        list: (last used time, bytes, paths) per page.
+    """
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        return []
+    thumbnails = {}
+    thumbs_folder = os.path.join(folder, 'thumbs')
+    if os.path.isdir(thumbs_folder):
+        for name in os.listdir(thumbs_folder):
+            thumbnails.setdefault(name.split('_w')[0], []).append(os.path.join(thumbs_folder, name))
+    groups = []
+    for name in names:
+        if not _PAGE_IMAGE.match(name):
+            continue
+        paths = [os.path.join(folder, name)] + thumbnails.get(name[:-len('.png')], [])
+        size, last_used = 0, 0.0
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            size += stat.st_size
+            last_used = max(last_used, stat.st_mtime)
+        groups.append((_page_last_used(paths[0], last_used), size, paths))
+    return groups
+
+
+class DiskGC:
+    """
+    Keeps uploads, retrieved page images and indexes within disk quotas.
+
+    Every session owns one folder under each of `session_roots`. A collection:
+
+    1. removes folders whose session no longer exists (orphans);
+    2. evicts a session's least recently used retrieved pages, with their
+       thumbnails, while the session is over its quota;
+    3. does the same across all sessions while the total is over the global
+       quota, then deletes idle sessions if DISK_GC_EVICT_SESSIONS is set.
+
+    Retrieved pages are a cache: retrieval writes them again when needed.
+    Uploads and indexes are only removed together with their session.
+    """
+
+    def __init__(self, session_roots, image_folder, list_sessions, delete_session, is_active=None,
+                 session_quota_mb=DISK_QUOTA_SESSION_MB, total_quota_mb=DISK_QUOTA_TOTAL_MB,
+                 grace=DISK_GC_GRACE, evict_sessions=DISK_GC_EVICT_SESSIONS):
+        """
+        Args:
+            session_roots (list): Folders holding one subfolder per session.
+            image_folder (callable): Returns the folder of a session's retrieved pages.
+            list_sessions (callable): Returns existing session ids, least recently used first.
+            delete_session (callable): Deletes a session and its files.
+            is_active (callable): Returns True for sessions that must not be evicted.
+        """
+        self.session_roots = session_roots
+        self.image_folder = image_folder
+        self.list_sessions = list_sessions
+        self.delete_session = delete_session
+        self.is_active = is_active or (lambda session_id: False)
+        self.session_quota = session_quota_mb * _MB
+        self.total_quota = total_quota_mb * _MB
+        self.grace = grace
+        self.evict_sessions = evict_sessions
+        self.last_report = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def session_usage(self, session_id):
+        return sum(tree_usage(os.path.join(root, session_id))[0] for root in self.session_roots)
+
+    def would_exceed_quota(self, session_id, incoming_bytes):
+        """
+        Returns True if adding incoming_bytes would take the session over its quota.
+        """
+        return bool(self.session_quota) and self.session_usage(session_id) + incoming_bytes > self.session_quota
+
+    def remove_session_files(self, session_id):
+        """
+        Deletes a session's uploads, page images and index; returns the bytes reclaimed.
+        """
+        return sum(remove_tree(os.path.join(root, session_id)) for root in self.session_roots)
+
+    def _evict_pages(self, groups, bytes_to_free):
+        freed = 0
+        cutoff = time.time() - self.grace
+        for last_used, size, paths in sorted(groups, key=lambda group: group[0]):
+            if freed >= bytes_to_free or last_used > cutoff:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            with _last_used_lock:
+                _last_used.pop(os.path.abspath(paths[0]), None)
+            freed += size
+        return freed
+
+    def run_once(self):
+        """
+        Runs one collection and returns its report.
+
+        Returns:
+            dict: Bytes reclaimed per step, disk usage after collecting and the duration.
+        """
+        with self._lock:
+            start = time.perf_counter()
+            reclaimed = {'orphans': 0, 'session_quota': 0, 'total_quota': 0, 'sessions': 0}
+            sessions = self.list_sessions()
+            known = set(sessions)
+            cutoff = time.time() - self.grace
+
+            for root in self.session_roots:
+                try:
+                    children = [entry for entry in os.scandir(root) if entry.is_dir(follow_symlinks=False)]
+                except FileNotFoundError:
+                    continue
+                for entry in children:
+                    if entry.name in known or self.is_active(entry.name):
+                        continue
+                    size, newest = tree_usage(entry.path)
+                    if newest <= cutoff:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                        reclaimed['orphans'] += size
+                        logger.info(f"Removed orphaned folder {entry.path} ({size / _MB:.1f} MB).")
+
+            usage = {session_id: self.session_usage(session_id) for session_id in sessions}
+            if self.session_quota:
+                for session_id, used in usage.items():
+                    if used > self.session_quota:
+                        freed = self._evict_pages(_page_image_groups(self.image_folder(session_id)),
+                                                  used - self.session_quota)
+                        usage[session_id] -= freed
+                        reclaimed['session_quota'] += freed
+
+            total = sum(usage.values())
+            if self.total_quota and total > self.total_quota:
+                groups = [group for session_id in sessions
+                          for group in _page_image_groups(self.image_folder(session_id))]
+                freed = self._evict_pages(groups, total - self.total_quota)
+                total -= freed
+                reclaimed['total_quota'] += freed
+                if total > self.total_quota and self.evict_sessions:
+                    for session_id in sessions:
+                        if total <= self.total_quota:
+                            break
+                        if self.is_active(session_id):
+                            continue
+                        used = self.session_usage(session_id)
+                        self.delete_session(session_id)
+                        total -= used
+                        reclaimed['sessions'] += used
+                        logger.warning(f"Deleted session {session_id} to stay within the disk quota.")
+                if total > self.total_quota:
+                    logger.warning(f"Disk usage {total / _MB:.0f} MB is over the {self.total_quota / _MB:.0f} MB quota.")
+
+            # Forget pages deleted with their session
+            with _last_used_lock:
+                tracked = list(_last_used)
+            gone = [path for path in tracked if not os.path.exists(path)]
+            with _last_used_lock:
+                for path in gone:
+                    _last_used.pop(path, None)
+
+            self.last_report = {
+                'reclaimed_bytes': reclaimed,
+                'usage_bytes': total,
+                'sessions': len(sessions),
+                'duration': round(time.perf_counter() - start, 3),
+                'finished_at': time.time(),
+            }
+            logger.info(f"Disk GC reclaimed {sum(reclaimed.values()) / _MB:.1f} MB {reclaimed}; "
+                        f"{total / _MB:.1f} MB in use by {len(sessions)} sessions.")
+            return self.last_report
+
+    def start(self, interval=DISK_GC_INTERVAL):
+        """
+        Collects in a daemon thread now and then every `interval` seconds.
+        """
+        if interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name="disk-gc", daemon=True)
+        self._thread.start()
+
+    def _loop(self, interval):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Disk GC failed: {e}", exc_info=True)
+            self._stop.wait(interval)
+
+    def stop(self):
+        self._stop.set()
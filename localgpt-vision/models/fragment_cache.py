@@ -0,0 +1,54 @@
+# models/fragment_cache.py
+
+import os
+import threading
+from collections import OrderedDict
+
+# Number of rendered chat messages kept in memory
+CHAT_FRAGMENT_CACHE_SIZE = int(os.getenv("CHAT_FRAGMENT_CACHE_SIZE", 2000))
+
+
+class FragmentCache:
+    """
+    LRU cache of rendered HTML fragments keyed by message id.
+
+    Stored messages never change once written, so a fragment rendered for a
+    message id stays valid until it is evicted; message ids are never reused.
+    """
+
+    def __init__(self, max_entries=CHAT_FRAGMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, messages, render_one):
+        """
+        Returns the concatenated HTML of the messages, rendering only uncached ones.
+
+        Args:
+            messages (list): Message dicts; those without an id are rendered every time.
+            render_one (callable): Renders a single message dict to an HTML string.
+
+        Returns:
+            str: The fragments in message order.
+        """
+        parts = []
+        for message in messages:
+            message_id = message.get('id')
+            with self._lock:
+                html = self._fragments.get(message_id)
+                if html is not None:
+                    self._fragments.move_to_end(message_id)
+            if html is None:
+                html = render_one(message)
+                if message_id is not None and self.max_entries > 0:
+                    with self._lock:
+                        self._fragments[message_id] = html
+                        while len(self._fragments) > self.max_entries:
+                            self._fragments.popitem(last=False)
+            parts.append(html)
+        return ''.join(parts)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._fragments)
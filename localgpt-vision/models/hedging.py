@@ -0,0 +1,237 @@
+# models/hedging.py
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Hedging configuration, e.g. HEDGE_BACKUPS="gemini=gpt4,gpt4=gemini"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 95))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", 10.0))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 3))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30.0))
+
+
+def _parse_backups(value):
+    backups = {}
+    for pair in value.split(','):
+        if '=' in pair:
+            primary, backup = pair.split('=', 1)
+            backups[primary.strip()] = backup.strip()
+    return backups
+
+
+HEDGE_BACKUPS = _parse_backups(os.getenv("HEDGE_BACKUPS", ""))
+
+HEDGE_MAX_WORKERS = int(os.getenv("HEDGE_MAX_WORKERS", 8))
+_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge")
+# Calls submitted to _executor and not finished yet
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker.
+
+    The breaker opens after `failure_threshold` consecutive failures and rejects
+    calls until `reset_timeout` seconds have passed. It then lets a single trial
+    call through (half-open) and closes again if that call succeeds.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._failures >= self.failure_threshold or self._opened_at is not None:
+                self._opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """
+    Keeps a sliding window of successful call latencies for one provider.
+    """
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p, default):
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return default
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+_breakers = {}
+_latencies = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(provider):
+    with _registry_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker()
+        return _breakers[provider]
+
+
+def get_latency_tracker(provider):
+    with _registry_lock:
+        if provider not in _latencies:
+            _latencies[provider] = LatencyTracker()
+        return _latencies[provider]
+
+
+class ProviderUnavailableError(RuntimeError):
+    """Raised when every candidate provider is skipped by its circuit breaker."""
+
+
+def _call(provider, fn, started):
+    started.set()
+    breaker = get_breaker(provider)
+    start = time.perf_counter()
+    try:
+        result = fn()
+    except Exception:
+        breaker.record_failure()
+        logger.warning(f"Provider '{provider}' failed (breaker {breaker.state}).")
+        raise
+    breaker.record_success()
+    get_latency_tracker(provider).record(time.perf_counter() - start)
+    return result
+
+
+def _submit(provider, fn):
+    """
+    Runs a provider call on the hedging pool.
+
+    Returns:
+        tuple: The Future and an Event set once the call starts running.
+    """
+    global _in_flight
+    started = threading.Event()
+    with _in_flight_lock:
+        _in_flight += 1
+    future = _executor.submit(_call, provider, fn, started)
+    future.add_done_callback(_call_finished)
+    return future, started
+
+
+def _call_finished(future):
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight -= 1
+
+
+def _pool_saturated():
+    with _in_flight_lock:
+        return _in_flight >= HEDGE_MAX_WORKERS
+
+
+def hedged_call(primary, generators):
+    """
+    Calls the primary provider and, if it has not answered within its
+    percentile-based deadline, also calls the configured backup.
+
+    The deadline runs from when the primary call starts, not from when it is
+    queued. No hedge is sent while the pool is saturated, since it would only
+    queue behind other calls; a primary that fails still falls back.
+
+    Args:
+        primary (str): The provider chosen by the user.
+        generators (dict): Maps provider names to zero-argument callables.
+
+    Returns:
+        tuple: The name of the provider that answered and its result.
+    """
+    candidates = [primary]
+    backup = HEDGE_BACKUPS.get(primary)
+    if backup in generators and backup != primary:
+        candidates.append(backup)
+
+    def next_allowed(names):
+        for name in names:
+            if get_breaker(name).allow():
+                return name
+        return None
+
+    first = next_allowed(candidates)
+    if first is None:
+        raise ProviderUnavailableError(f"Provider '{primary}' is temporarily unavailable.")
+    if first != primary:
+        logger.info(f"Circuit open for '{primary}', using backup '{first}'.")
+    future, started = _submit(first, generators[first])
+    futures = {future: first}
+
+    remaining = candidates[candidates.index(first) + 1:]
+    if remaining:
+        deadline = get_latency_tracker(first).percentile(HEDGE_PERCENTILE, HEDGE_DEFAULT_DELAY)
+        started.wait()
+        done, _ = wait(futures, timeout=deadline)
+        failed = bool(done) and next(iter(done)).exception() is not None
+        if not done and _pool_saturated():
+            logger.info(f"'{first}' exceeded {deadline:.2f}s, but the hedging pool is saturated; not hedging.")
+            second = None
+        else:
+            second = next_allowed(remaining) if (not done or failed) else None
+        if second is not None:
+            reason = "failed" if failed else f"exceeded {deadline:.2f}s"
+            logger.info(f"'{first}' {reason}, hedging with '{second}'.")
+            futures[_submit(second, generators[second])[0]] = second
+
+    last_error = None
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return futures[future], future.result()
+            last_error = future.exception()
+    raise last_error
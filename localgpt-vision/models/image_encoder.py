@@ -0,0 +1,100 @@
+# models/image_encoder.py
+
+import base64
+import io
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Per-provider payload profiles. max_pixels is the pixel budget a page is
+# downscaled to before encoding; pages already under budget keep their size.
+PAYLOAD_PROFILES = {
+    'gpt4': {'max_pixels': 768 * 1024, 'format': 'JPEG', 'quality': 85},
+    'gemini': {'max_pixels': 1024 * 1344, 'format': 'WEBP', 'quality': 85},
+    'groq-llama-vision': {'max_pixels': 672 * 672, 'format': 'JPEG', 'quality': 80},
+    'ollama': {'max_pixels': 1120 * 1120, 'format': 'JPEG', 'quality': 90},
+}
+
+_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'PNG': 'image/png',
+}
+
+# Cache of encoded payloads keyed by (path, mtime, size, profile)
+_payload_cache = OrderedDict()
+_payload_cache_lock = threading.Lock()
+_PAYLOAD_CACHE_SIZE = int(os.getenv("IMAGE_PAYLOAD_CACHE_SIZE", 256))
+
+
+def _fit_to_budget(image, max_pixels):
+    """
+    Downscales the image, keeping its aspect ratio, so that it fits within max_pixels.
+    """
+    width, height = image.size
+    if width * height <= max_pixels:
+        return image
+    scale = (max_pixels / float(width * height)) ** 0.5
+    new_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    return image.resize(new_size, Image.LANCZOS)
+
+
+def _encode(image_path, profile):
+    with Image.open(image_path) as image:
+        image = _fit_to_budget(image.convert('RGB'), profile['max_pixels'])
+        buffer = io.BytesIO()
+        image.save(buffer, format=profile['format'], quality=profile['quality'])
+    return buffer.getvalue()
+
+
+def image_payload_bytes(image_path, profile_name):
+    """
+    Encodes a page image for upload to a remote provider.
+
+    Args:
+        image_path (str): The path to the page image.
+        profile_name (str): The key of the provider profile in PAYLOAD_PROFILES.
+
+    Returns:
+        tuple: The MIME type and the encoded image bytes.
+    """
+    profile = PAYLOAD_PROFILES[profile_name]
+    stat = os.stat(image_path)
+    key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, profile_name)
+
+    with _payload_cache_lock:
+        if key in _payload_cache:
+            _payload_cache.move_to_end(key)
+            return _payload_cache[key]
+
+    data = _encode(image_path, profile)
+    payload = (_MIME_TYPES[profile['format']], data)
+    logger.debug(f"Encoded {image_path} for '{profile_name}' ({len(data)} bytes).")
+
+    with _payload_cache_lock:
+        _payload_cache[key] = payload
+        _payload_cache.move_to_end(key)
+        while len(_payload_cache) > _PAYLOAD_CACHE_SIZE:
+            _payload_cache.popitem(last=False)
+    return payload
+
+
+def encode_image_payload(image_path, profile_name):
+    """
+    Returns the MIME type and the base64-encoded bytes of image_payload_bytes,
+    for providers that take images as base64 text.
+    """
+    mime_type, data = image_payload_bytes(image_path, profile_name)
+    return mime_type, base64.b64encode(data).decode('utf-8')
+
+
+def image_data_url(image_path, profile_name):
+    """
+    Returns the page image as a data URL encoded with the given provider profile.
+    """
+    mime_type, data = encode_image_payload(image_path, profile_name)
+    return f"data:{mime_type};base64,{data}"
@@ -1,8 +1,8 @@
 # models/indexer.py
 
 import os
-from byaldi import RAGMultiModalModel
 from models.converters import convert_docs_to_pdfs
+from models.tracing import span
 from logger import get_logger
 
 logger = get_logger(__name__)
@@ -23,22 +23,27 @@ def index_documents(folder_path, index_name='document_index', index_path=None, i
     try:
         logger.info(f"Starting document indexing in folder: {folder_path}")
         # Convert non-PDF documents to PDFs
-        convert_docs_to_pdfs(folder_path)
+        with span('convert'):
+            convert_docs_to_pdfs(folder_path)
         logger.info("Conversion of non-PDF documents to PDFs completed.")
 
         # Initialize RAG model
-        RAG = RAGMultiModalModel.from_pretrained(indexer_model)
+        from byaldi import RAGMultiModalModel
+
+        with span('load_indexer', model_choice=indexer_model):
+            RAG = RAGMultiModalModel.from_pretrained(indexer_model)
         if RAG is None:
             raise ValueError(f"Failed to initialize RAGMultiModalModel with model {indexer_model}")
         logger.info(f"RAG model initialized with {indexer_model}.")
 
         # Index the documents in the folder
-        RAG.index(
-            input_path=folder_path,
-            index_name=index_name,
-            store_collection_with_index=True,
-            overwrite=True
-        )
+        with span('index', model_choice=indexer_model):
+            RAG.index(
+                input_path=folder_path,
+                index_name=index_name,
+                store_collection_with_index=True,
+                overwrite=True
+            )
 
         logger.info(f"Indexing completed. Index saved at '{index_path}'.")
 
@@ -1,42 +1,77 @@
 # models/model_loader.py
 
+import importlib.util
 import os
-import torch
-from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
-from transformers import MllamaForConditionalGeneration
-import google.generativeai as genai
+import time
+import threading
+from concurrent.futures import Future
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
 from logger import get_logger
+from models.model_registry import ModelRegistry, estimate_checkpoint_bytes
+from models.prefix_cache import drop_prefix_cache
 
 logger = get_logger(__name__)
 
-# Optional imports with error handling
-try:
-    from vllm import LLM
-    from vllm.sampling_params import SamplingParams
-    VLLM_AVAILABLE = True
-except ImportError:
+# Heavy dependencies (torch, transformers, google.generativeai, groq) are imported
+# when the backend that needs them is first loaded, so importing this module is cheap.
+# Optional packages are only probed here, without importing them.
+VLLM_AVAILABLE = importlib.util.find_spec("vllm") is not None
+if not VLLM_AVAILABLE:
     logger.warning("VLLM not available. Some GPU functions will be limited.")
-    VLLM_AVAILABLE = False
 
-try:
-    from groq import Groq
-    GROQ_AVAILABLE = True
-except ImportError:
+GROQ_AVAILABLE = importlib.util.find_spec("groq") is not None
+if not GROQ_AVAILABLE:
     logger.warning("Groq not available.")
-    GROQ_AVAILABLE = False
 
-# Cache for loaded models
-_model_cache = {}
+# Hugging Face ids (or local paths) of the local vision models
+LOCAL_MODEL_IDS = {
+    'qwen': os.getenv("QWEN_MODEL_ID", "Qwen/Qwen2-VL-7B-Instruct"),
+    'llama-vision': os.getenv("LLAMA_VISION_MODEL_ID", "alpindale/Llama-3.2-11B-Vision-Instruct"),
+    'pixtral': os.getenv("PIXTRAL_MODEL_ID", "mistralai/Pixtral-12B-2409"),
+    'molmo': os.getenv("MOLMO_MODEL_ID", "allenai/Molmo-7B-O-0924"),
+}
+
+# Pixtral is downloaded in mistral-inference's own layout
+PIXTRAL_PATH = os.path.join(os.path.expanduser("~"), "mistral_models", "Pixtral")
+
+# Models served by an API or another process; they hold no weights here
+REMOTE_MODELS = {'gemini', 'gpt4', 'groq-llama-vision', 'ollama'}
+
+# Optional smaller draft models for assisted (speculative) decoding. A draft
+# must share the main model's tokenizer, e.g. Qwen/Qwen2-VL-2B-Instruct for Qwen.
+DRAFT_MODEL_IDS = {
+    'qwen': os.getenv("QWEN_DRAFT_MODEL_ID"),
+    'llama-vision': os.getenv("LLAMA_VISION_DRAFT_MODEL_ID"),
+}
+ASSISTED_DECODING = os.getenv("ASSISTED_DECODING", "false").lower() == "true"
+
+# Weight precision used when a local model runs on CPU: fp32, bf16 or int8
+CPU_PRECISION = {
+    'qwen': os.getenv("QWEN_CPU_PRECISION", "fp32"),
+    'llama-vision': os.getenv("LLAMA_VISION_CPU_PRECISION", "fp32"),
+}
+
+# Cache for loaded models, bounded by MODEL_MEMORY_BUDGET_GB (0 means unlimited)
+MODEL_MEMORY_BUDGET_GB = float(os.getenv("MODEL_MEMORY_BUDGET_GB", 0))
+_model_cache = ModelRegistry(budget_bytes=int(MODEL_MEMORY_BUDGET_GB * 2**30))
+# Local models are cached as (model, processor, device); their prefix KV states go with them
+_model_cache.add_eviction_listener(
+    lambda name, value: drop_prefix_cache(value[0]) if isinstance(value, tuple) else None)
+
+# Loads currently in progress, so concurrent requests share one load
+_inflight_loads = {}
+_inflight_lock = threading.Lock()
 
 def detect_device():
     """
     Detects the best available device (CUDA, MPS, or CPU).
     """
+    import torch
+
     if torch.cuda.is_available():
         return 'cuda'
     elif torch.backends.mps.is_available():
@@ -44,63 +79,240 @@ def detect_device():
     else:
         return 'cpu'
 
+def _model_class(model_choice):
+    """
+    Returns the transformers class of a local vision model, importing transformers on first use.
+    """
+    if model_choice == 'qwen':
+        from transformers import Qwen2VLForConditionalGeneration
+        return Qwen2VLForConditionalGeneration
+    from transformers import MllamaForConditionalGeneration
+    return MllamaForConditionalGeneration
+
+def _load_local_model(model_class, model_id, cpu_precision='fp32'):
+    """
+    Loads a local vision model and its processor onto the best available device.
+
+    On CPU, cpu_precision selects float32 ('fp32'), bfloat16 weights ('bf16') or
+    dynamic int8 quantization of the linear layers ('int8').
+    """
+    import torch
+    from transformers import AutoProcessor
+
+    device = detect_device()
+    if device != 'cpu':
+        torch_dtype = torch.float16
+    elif cpu_precision == 'bf16':
+        torch_dtype = torch.bfloat16
+    elif cpu_precision in ('fp32', 'int8'):
+        torch_dtype = torch.float32
+    else:
+        raise ValueError(f"Invalid CPU precision mode: {cpu_precision}")
+
+    model = model_class.from_pretrained(
+        model_id,
+        torch_dtype=torch_dtype,
+        device_map="auto"
+    )
+    processor = AutoProcessor.from_pretrained(model_id)
+    model.to(device)
+    if device == 'cpu' and cpu_precision == 'int8':
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    logger.info(f"Loaded '{model_id}' on {device} ({cpu_precision if device == 'cpu' else 'fp16'}).")
+    return model, processor, device
+
+def expected_footprint(model_choice, model_id=None):
+    """
+    Estimates the memory a model will take once loaded, before loading it.
+
+    Returns:
+        int: Estimated bytes, 0 for remote models, or None if unknown.
+    """
+    if model_choice in REMOTE_MODELS:
+        return 0
+    if model_id is None:
+        model_id = PIXTRAL_PATH if model_choice == 'pixtral' else LOCAL_MODEL_IDS.get(model_choice)
+    if model_id is None:
+        return None
+    if detect_device() != 'cpu':
+        dtype_bytes = 2
+    else:
+        # int8 layers are quantized from an fp32 copy, so the load peaks at fp32
+        dtype_bytes = 2 if CPU_PRECISION.get(model_choice) == 'bf16' else 4
+    return estimate_checkpoint_bytes(model_id, dtype_bytes)
+
+def _reserved_load(name, expected_bytes, load):
+    """
+    Runs load() with its expected footprint reserved in the model cache, and registers the result.
+    """
+    _model_cache.make_room(name, expected_bytes)
+    start_time = time.perf_counter()
+    try:
+        model = load()
+    except BaseException:
+        _model_cache.release(name)
+        raise
+    return _model_cache.put(name, model, time.perf_counter() - start_time)
+
+def load_draft_model(model_choice):
+    """
+    Loads and caches the draft model used for assisted decoding of model_choice.
+
+    Returns:
+        The draft model, or None if assisted decoding is disabled or no draft is configured.
+    """
+    draft_id = DRAFT_MODEL_IDS.get(model_choice)
+    if not ASSISTED_DECODING or not draft_id:
+        return None
+
+    cache_key = f"{model_choice}-draft"
+
+    def load_draft():
+        draft_model, _, _ = _load_local_model(_model_class(model_choice), draft_id, CPU_PRECISION[model_choice])
+        logger.info(f"Draft model '{draft_id}' for '{model_choice}' loaded and cached.")
+        return draft_model
+
+    return _single_flight(cache_key, lambda: _reserved_load(cache_key, expected_footprint(model_choice, draft_id),
+                                                            load_draft))
+
+def _single_flight(name, load):
+    """
+    Returns the cached model `name`, loading it with `load` at most once at a time.
+
+    The first caller runs the load; concurrent callers wait on the same future,
+    receive the same instance and have their wait time recorded.
+    """
+    cached = _model_cache.get(name)
+    if cached is not None:
+        return cached
+
+    with _inflight_lock:
+        cached = _model_cache.get(name)
+        if cached is not None:
+            return cached
+        future = _inflight_loads.get(name)
+        is_loader = future is None
+        if is_loader:
+            future = Future()
+            _inflight_loads[name] = future
+
+    if not is_loader:
+        start_time = time.perf_counter()
+        try:
+            return future.result()
+        finally:
+            waited = time.perf_counter() - start_time
+            _model_cache.record_wait(name, waited)
+            logger.info(f"Waited {waited:.1f}s for in-flight load of '{name}'.")
+
+    try:
+        model = load()
+        future.set_result(model)
+        return model
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight_loads.pop(name, None)
+
 def load_model(model_choice):
     """
     Loads and caches the specified model.
     """
-    global _model_cache
-
     if model_choice in _model_cache:
         logger.info(f"Model '{model_choice}' loaded from cache.")
-        return _model_cache[model_choice]
 
-    if model_choice == 'qwen':
-        device = detect_device()
-        model = Qwen2VLForConditionalGeneration.from_pretrained(
-            "Qwen/Qwen2-VL-7B-Instruct",
-            torch_dtype=torch.float16 if device != 'cpu' else torch.float32,
-            device_map="auto"
-        )
-        processor = AutoProcessor.from_pretrained("Qwen/Qwen2-VL-7B-Instruct")
-        model.to(device)
-        _model_cache[model_choice] = (model, processor, device)
-        logger.info("Qwen model loaded and cached.")
-        return _model_cache[model_choice]
-
-    elif model_choice == 'gemini':
+    if model_choice == 'gemini':
         # Load Gemini model
         api_key = os.getenv("GOOGLE_API_KEY")
         if not api_key:
             raise ValueError("GOOGLE_API_KEY not found in .env file")
+        import google.generativeai as genai
+
         genai.configure(api_key=api_key)
         model = genai.GenerativeModel('gemini-1.5-flash-002')
         return model, None
 
-    elif model_choice == 'llama-vision':
-        device = detect_device()
-        model_id = "alpindale/Llama-3.2-11B-Vision-Instruct"
-        model = MllamaForConditionalGeneration.from_pretrained(
-            model_id,
-            torch_dtype=torch.float16 if device != 'cpu' else torch.float32,
-            device_map="auto"
-        )
-        processor = AutoProcessor.from_pretrained(model_id)
-        model.to(device)
-        _model_cache[model_choice] = (model, processor, device)
-        logger.info("Llama-Vision model loaded and cached.")
-        return _model_cache[model_choice]
-    
-    elif model_choice == 'groq-llama-vision':
-        if not GROQ_AVAILABLE:
-            raise ImportError("Groq package not installed. Please install with 'pip install groq'")
-        api_key = os.getenv("GROQ_API_KEY")
-        if not api_key:
-            raise ValueError("GROQ_API_KEY not found in .env file")
-        client = Groq(api_key=api_key)
-        _model_cache[model_choice] = client
-        logger.info("Groq Llama Vision model loaded and cached.")
-        return _model_cache[model_choice]
-    
-    else:
-        logger.error(f"Invalid model choice: {model_choice}")
-        raise ValueError("Invalid model choice.")
+    def load():
+        if model_choice == 'qwen':
+            model = _load_local_model(_model_class('qwen'), LOCAL_MODEL_IDS['qwen'], CPU_PRECISION['qwen'])
+            logger.info("Qwen model loaded and cached.")
+
+        elif model_choice == 'llama-vision':
+            model = _load_local_model(_model_class('llama-vision'), LOCAL_MODEL_IDS['llama-vision'],
+                                      CPU_PRECISION['llama-vision'])
+            logger.info("Llama-Vision model loaded and cached.")
+
+        elif model_choice == 'pixtral':
+            from huggingface_hub import snapshot_download
+            from mistral_common.tokens.tokenizers.mistral import MistralTokenizer
+            from mistral_inference.generate import generate
+            from mistral_inference.transformer import Transformer
+
+            device = detect_device()
+            model_path = PIXTRAL_PATH
+            snapshot_download(repo_id=LOCAL_MODEL_IDS['pixtral'],
+                              allow_patterns=["params.json", "consolidated.safetensors", "tekken.json"],
+                              local_dir=model_path)
+            tokenizer = MistralTokenizer.from_file(os.path.join(model_path, "tekken.json"))
+            model = (Transformer.from_folder(model_path, device=device), tokenizer, generate, device)
+            logger.info("Pixtral model loaded and cached.")
+
+        elif model_choice == 'molmo':
+            import torch
+            from transformers import AutoModelForCausalLM, AutoProcessor
+
+            device = detect_device()
+            processor = AutoProcessor.from_pretrained(LOCAL_MODEL_IDS['molmo'], trust_remote_code=True,
+                                                      torch_dtype='auto', device_map='auto')
+            molmo = AutoModelForCausalLM.from_pretrained(
+                LOCAL_MODEL_IDS['molmo'],
+                trust_remote_code=True,
+                torch_dtype=torch.float16 if device != 'cpu' else torch.float32,
+                device_map='auto'
+            )
+            model = (molmo, processor, molmo.device)
+            logger.info("Molmo model loaded and cached.")
+
+        elif model_choice == 'groq-llama-vision':
+            if not GROQ_AVAILABLE:
+                raise ImportError("Groq package not installed. Please install with 'pip install groq'")
+            api_key = os.getenv("GROQ_API_KEY")
+            if not api_key:
+                raise ValueError("GROQ_API_KEY not found in .env file")
+            from groq import Groq
+
+            model = Groq(api_key=api_key)
+            logger.info("Groq Llama Vision model loaded and cached.")
+
+        elif model_choice == 'ollama':
+            from models.ollama_client import OllamaClient
+
+            # The daemon holds the weights; loading here only warms it and keeps it alive
+            model = OllamaClient()
+            model.load()
+
+        else:
+            logger.error(f"Invalid model choice: {model_choice}")
+            raise ValueError("Invalid model choice.")
+
+        return model
+
+    return _single_flight(model_choice, lambda: _reserved_load(model_choice, expected_footprint(model_choice), load))
+
+def record_cache_bytes(model_choice, nbytes):
+    """
+    Counts memory held by caches of a loaded model (e.g. prefix KV states) against the budget.
+    """
+    _model_cache.set_cache_bytes(model_choice, nbytes)
+
+def model_residency():
+    """
+    Returns the memory budget, current usage and per-model residency of the model cache.
+    """
+    return {
+        'budget_bytes': _model_cache.budget_bytes,
+        'resident_bytes': _model_cache.total_bytes(),
+        'models': _model_cache.stats(),
+    }
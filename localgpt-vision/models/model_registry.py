@@ -0,0 +1,279 @@
+# models/model_registry.py
+
+import gc
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def _tensor_bytes(value, seen):
+    import torch
+
+    if isinstance(value, torch.Tensor):
+        # Tied weights share storage and are only counted once
+        key = (value.device, value.data_ptr()) if not value.is_quantized else id(value)
+        if key in seen:
+            return 0
+        seen.add(key)
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_tensor_bytes(item, seen) for item in value)
+    return 0
+
+
+def _module_bytes(module):
+    # state_dict also covers the packed weights of dynamically quantized layers
+    seen = set()
+    return sum(_tensor_bytes(value, seen) for value in module.state_dict().values())
+
+
+def estimate_footprint(value):
+    """
+    Returns the bytes held by the torch modules in a cached value.
+    API clients and processors are counted as zero.
+    """
+    import torch
+
+    if isinstance(value, torch.nn.Module):
+        return _module_bytes(value)
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_footprint(item) for item in value)
+    return 0
+
+
+_DTYPE_BYTES = {'float32': 4, 'float16': 2, 'bfloat16': 2, 'int8': 1}
+
+
+def _checkpoint_files(model_id):
+    """
+    Returns {filename: bytes} of a checkpoint in a local folder or the Hugging Face cache,
+    falling back to the Hub's file listing; None if neither is reachable.
+    """
+    folder = model_id if os.path.isdir(model_id) else None
+    if folder is None:
+        try:
+            from huggingface_hub import snapshot_download
+            folder = snapshot_download(model_id, local_files_only=True)
+        except Exception:
+            folder = None
+    if folder is not None:
+        return {name: os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder)
+                if os.path.isfile(os.path.join(folder, name))}, folder
+    try:
+        from huggingface_hub import HfApi
+        info = HfApi().model_info(model_id, files_metadata=True, timeout=10)
+        return {sibling.rfilename: sibling.size or 0 for sibling in info.siblings}, None
+    except Exception:
+        return None, None
+
+
+def estimate_checkpoint_bytes(model_id, dtype_bytes=None):
+    """
+    Estimates the memory a checkpoint will take once loaded, before loading it.
+
+    Sums the safetensors (or else .bin) weight files and rescales them from the
+    dtype they are stored in (config.json torch_dtype) to dtype_bytes per parameter.
+
+    Returns:
+        int: Estimated bytes, or None if the checkpoint files can't be found.
+    """
+    files, folder = _checkpoint_files(model_id)
+    if not files:
+        return None
+    weights = [size for name, size in files.items() if name.endswith('.safetensors')]
+    if not weights:
+        weights = [size for name, size in files.items() if name.endswith('.bin') and 'training_args' not in name]
+    if not weights:
+        return None
+    total = sum(weights)
+    if dtype_bytes and folder is not None and os.path.exists(os.path.join(folder, 'config.json')):
+        with open(os.path.join(folder, 'config.json')) as f:
+            config = json.load(f)
+        stored = config.get('torch_dtype') or config.get('text_config', {}).get('torch_dtype')
+        if stored in _DTYPE_BYTES:
+            total = total * dtype_bytes // _DTYPE_BYTES[stored]
+    return total
+
+
+class ModelRegistry:
+    """
+    LRU registry of loaded models with a total memory budget.
+
+    Each entry records its footprint, the memory of caches derived from it
+    (e.g. prefix KV states), load time and usage. Before a model is
+    loaded, make_room reserves its expected footprint and evicts
+    least-recently-used models until it fits, so the new model is never loaded
+    next to models it would not fit beside.
+    """
+
+    def __init__(self, budget_bytes=0):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()
+        self._known_footprints = {}
+        # Expected bytes of loads in progress, counted against the budget until put() or release()
+        self._reserved = {}
+        self._eviction_listeners = []
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._entries
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            self._entries.move_to_end(name)
+            entry['last_used'] = time.time()
+            entry['hits'] += 1
+            return entry['value']
+
+    def make_room(self, name, expected_bytes=None):
+        """
+        Reserves memory for loading `name`, evicting least recently used models first.
+
+        The footprint measured by an earlier load of `name` takes precedence over
+        expected_bytes. With a budget and no estimate at all, every other model is
+        evicted. While loads of other models hold the memory this one needs, waits
+        for them to finish. Call put() or release() once the load ends.
+
+        Args:
+            name (str): The model about to be loaded.
+            expected_bytes (int): Its estimated footprint, or None if unknown.
+        """
+        with self._changed:
+            expected = self._known_footprints.get(name, expected_bytes)
+            if not self.budget_bytes:
+                return
+            if expected is None:
+                logger.info(f"Footprint of '{name}' is unknown; evicting the other models before loading it.")
+                expected = self.budget_bytes
+            while True:
+                self._evict_until(expected, keep=name)
+                others_reserved = self._reserved_bytes(exclude=name)
+                if not others_reserved or self.total_bytes() + others_reserved + expected <= self.budget_bytes:
+                    break
+                logger.info(f"Waiting for other model loads to finish before loading '{name}'.")
+                self._changed.wait()
+            self._reserved[name] = expected
+
+    def release(self, name):
+        """
+        Drops the reservation of a load that failed.
+        """
+        with self._changed:
+            self._reserved.pop(name, None)
+            self._changed.notify_all()
+
+    def put(self, name, value, load_seconds):
+        footprint = estimate_footprint(value)
+        with self._changed:
+            self._reserved.pop(name, None)
+            self._changed.notify_all()
+            self._known_footprints[name] = footprint
+            self._entries[name] = {
+                'value': value,
+                'footprint_bytes': footprint,
+                'cache_bytes': 0,
+                'load_seconds': load_seconds,
+                'loaded_at': time.time(),
+                'last_used': time.time(),
+                'hits': 0,
+                'waiters': 0,
+                'wait_seconds': 0.0,
+            }
+            self._entries.move_to_end(name)
+            self._evict_until(0, keep=name)
+        logger.info(f"Registered model '{name}' ({footprint / 2**30:.2f} GiB, loaded in {load_seconds:.1f}s).")
+        return value
+
+    def record_wait(self, name, seconds):
+        """
+        Records time a caller spent waiting for another caller's in-flight load of `name`.
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                entry['waiters'] += 1
+                entry['wait_seconds'] += seconds
+
+    def set_cache_bytes(self, name, nbytes):
+        """
+        Records the memory held by caches built on top of model `name`, which
+        counts against the budget like its weights.
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return
+            entry['cache_bytes'] = nbytes
+            self._evict_until(0, keep=name)
+
+    def add_eviction_listener(self, callback):
+        """
+        Registers callback(name, value), called when a model is evicted so that
+        caches derived from it can be freed along with it.
+        """
+        self._eviction_listeners.append(callback)
+
+    def evict(self, name):
+        with self._lock:
+            entry = self._entries.pop(name, None)
+        if entry is None:
+            return False
+        for callback in self._eviction_listeners:
+            callback(name, entry['value'])
+        del entry
+        gc.collect()
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        logger.info(f"Evicted model '{name}'.")
+        return True
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(entry['footprint_bytes'] + entry['cache_bytes'] for entry in self._entries.values())
+
+    def _reserved_bytes(self, exclude=None):
+        return sum(size for name, size in self._reserved.items() if name != exclude)
+
+    def _evict_until(self, incoming_bytes, keep):
+        if not self.budget_bytes:
+            return
+        while self.total_bytes() + self._reserved_bytes(exclude=keep) + incoming_bytes > self.budget_bytes:
+            # API clients hold no weights; evicting them frees nothing
+            victims = [name for name, entry in self._entries.items()
+                       if name != keep and entry['footprint_bytes'] + entry['cache_bytes']]
+            if not victims:
+                if not self._reserved_bytes(exclude=keep):
+                    logger.warning(f"Model '{keep}' alone exceeds the memory budget.")
+                return
+            self.evict(victims[0])
+
+    def stats(self):
+        """
+        Returns residency information for every loaded model, least recently used first.
+        """
+        with self._lock:
+            return [
+                {
+                    'name': name,
+                    'footprint_bytes': entry['footprint_bytes'],
+                    'cache_bytes': entry['cache_bytes'],
+                    'load_seconds': round(entry['load_seconds'], 3),
+                    'loaded_at': entry['loaded_at'],
+                    'last_used': entry['last_used'],
+                    'hits': entry['hits'],
+                    'waiters': entry['waiters'],
+                    'wait_seconds': round(entry['wait_seconds'], 3),
+                }
+                for name, entry in self._entries.items()
+            ]
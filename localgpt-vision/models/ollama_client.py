@@ -0,0 +1,124 @@
+# models/ollama_client.py
+
+import json
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Local Ollama daemon used by the 'ollama' backend
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434").rstrip('/')
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2-vision")
+# How long the daemon keeps the model in memory after a request, e.g. "30m", "-1" (forever)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", 300))
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", 8))
+OLLAMA_MAX_TOKENS = int(os.getenv("OLLAMA_MAX_TOKENS", 512))
+
+
+class OllamaError(RuntimeError):
+    """Raised when the Ollama daemon reports an error."""
+
+
+def _keep_alive(value):
+    # Ollama takes durations as strings and plain seconds as numbers
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+class OllamaClient:
+    """
+    Client for the Ollama HTTP API with a pooled session.
+
+    Connections to the daemon are reused across requests and threads, and
+    every request carries keep_alive so the model stays loaded between
+    questions instead of being reloaded after Ollama's default idle timeout.
+    """
+
+    def __init__(self, host=OLLAMA_HOST, model=OLLAMA_MODEL, keep_alive=OLLAMA_KEEP_ALIVE,
+                 timeout=OLLAMA_TIMEOUT, pool_size=OLLAMA_POOL_SIZE):
+        self.host = host
+        self.model = model
+        self.keep_alive = _keep_alive(keep_alive)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _post(self, path, payload, stream=False):
+        response = self.session.post(f"{self.host}{path}", json=payload, stream=stream, timeout=self.timeout)
+        if response.status_code >= 400:
+            try:
+                message = response.json().get('error', response.text)
+            except ValueError:
+                message = response.text
+            response.close()
+            raise OllamaError(f"Ollama returned {response.status_code}: {message}")
+        return response
+
+    def load(self):
+        """
+        Loads the model into the daemon's memory without generating.
+        """
+        self._post('/api/generate', {'model': self.model, 'keep_alive': self.keep_alive}).close()
+        logger.info(f"Ollama model '{self.model}' loaded (keep_alive={self.keep_alive}).")
+
+    def unload(self):
+        """
+        Asks the daemon to release the model's memory now.
+        """
+        self._post('/api/generate', {'model': self.model, 'keep_alive': 0}).close()
+        logger.info(f"Ollama model '{self.model}' unloaded.")
+
+    def running_models(self):
+        """
+        Returns the models the daemon currently holds in memory.
+        """
+        response = self.session.get(f"{self.host}/api/ps", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json().get('models', [])
+
+    def _chat_payload(self, query, images, stream):
+        return {
+            'model': self.model,
+            'messages': [{'role': 'user', 'content': query, 'images': images}],
+            'stream': stream,
+            'keep_alive': self.keep_alive,
+            'options': {'num_predict': OLLAMA_MAX_TOKENS},
+        }
+
+    def chat(self, query, images):
+        """
+        Generates a complete answer.
+
+        Args:
+            query (str): The user's query.
+            images (list): Base64-encoded page images.
+
+        Returns:
+            str: The generated text.
+        """
+        with self._post('/api/chat', self._chat_payload(query, images, stream=False)) as response:
+            return response.json()['message']['content']
+
+    def chat_stream(self, query, images):
+        """
+        Yields the answer in chunks as the daemon generates it.
+        """
+        with self._post('/api/chat', self._chat_payload(query, images, stream=True), stream=True) as response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if 'error' in chunk:
+                    raise OllamaError(chunk['error'])
+                content = chunk.get('message', {}).get('content')
+                if content:
+                    yield content
+                if chunk.get('done'):
+                    return
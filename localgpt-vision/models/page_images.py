@@ -0,0 +1,73 @@
+# models/page_images.py
+
+import os
+import re
+import threading
+from PIL import Image
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Widths of the WebP thumbnails generated for every retrieved page
+PAGE_THUMBNAIL_WIDTHS = sorted(int(width) for width in os.getenv("PAGE_THUMBNAIL_WIDTHS", "160,320,640").split(',') if width.strip())
+PAGE_THUMBNAIL_QUALITY = int(os.getenv("PAGE_THUMBNAIL_QUALITY", 80))
+
+# Retrieved pages are stored as images/<session_id>/retrieved_<md5 of the page>.png
+# under the static folder, so the file name already identifies the content
+_PAGE_IMAGE_PATTERN = re.compile(r'^images/(?P<session_id>[^/]+)/retrieved_(?P<image_hash>[0-9a-f]{32})\.png$')
+
+
+def parse_page_image(relative_path):
+    """
+    Splits a stored page image path into (session_id, image_hash).
+
+    Args:
+        relative_path (str): Path relative to the static folder, as kept in chat history.
+
+    Returns:
+        tuple: (session_id, image_hash), or None for paths that are not retrieved pages.
+    """
+    match = _PAGE_IMAGE_PATTERN.match(relative_path.replace(os.sep, '/'))
+    if match is None:
+        return None
+    return match.group('session_id'), match.group('image_hash')
+
+
+def page_image_filename(image_hash):
+    return f"retrieved_{image_hash}.png"
+
+
+def thumbnail_filename(image_hash, width):
+    return os.path.join('thumbs', f"retrieved_{image_hash}_w{width}.webp")
+
+
+def ensure_thumbnails(image_path, image=None):
+    """
+    Writes the WebP thumbnails of a page image that do not exist yet.
+
+    Thumbnails go to a thumbs/ folder next to the image. Each is written to a
+    temporary file and renamed into place, so concurrent requests never see a
+    partial file and a page is only encoded once per width.
+
+    Args:
+        image_path (str): Path of the full-size PNG.
+        image (PIL.Image.Image): The decoded page, if the caller already has it.
+    """
+    folder, filename = os.path.split(image_path)
+    image_hash = filename[len('retrieved_'):-len('.png')]
+    missing = [width for width in PAGE_THUMBNAIL_WIDTHS
+               if not os.path.exists(os.path.join(folder, thumbnail_filename(image_hash, width)))]
+    if not missing:
+        return
+    os.makedirs(os.path.join(folder, 'thumbs'), exist_ok=True)
+    if image is None:
+        image = Image.open(image_path)
+    image = image.convert('RGB')
+    for width in missing:
+        thumbnail = image if image.width <= width else image.resize(
+            (width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        thumbnail_path = os.path.join(folder, thumbnail_filename(image_hash, width))
+        temp_path = f"{thumbnail_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        thumbnail.save(temp_path, format='WEBP', quality=PAGE_THUMBNAIL_QUALITY, method=4)
+        os.replace(temp_path, thumbnail_path)
+    logger.debug(f"Generated thumbnails {missing} for {image_path}")
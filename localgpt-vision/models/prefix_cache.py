@@ -0,0 +1,233 @@
+# models/prefix_cache.py
+
+import copy
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Number of image-prefix KV states kept per loaded model; 0 disables reuse
+PREFIX_CACHE_SIZE = int(os.getenv("QWEN_PREFIX_CACHE_SIZE", 4))
+
+VISION_END_TOKEN = "<|vision_end|>"
+
+
+class PrefixKVCache:
+    """
+    LRU cache of the KV state computed over the image prefix of a prompt.
+
+    Each loaded model instance has its own cache. Entries are keyed by the page
+    images and their resolution, and hold the prefix token ids so that a hit is
+    only used when the new prompt starts with exactly the same tokens.
+    """
+
+    def __init__(self, max_entries=PREFIX_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def nbytes(self):
+        with self._lock:
+            return sum(entry['nbytes'] for entry in self._entries.values())
+
+    def get(self, key, prefix_ids):
+        import torch
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not torch.equal(entry['prefix_ids'], prefix_ids):
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        if self.max_entries <= 0:
+            return
+        entry['nbytes'] = _tensor_bytes(entry['past_key_values'])
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Per model instance, so a reloaded or different model never sees another's KV state
+_caches = weakref.WeakKeyDictionary()
+_generation_locks = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+def _cache_for(model):
+    with _caches_lock:
+        cache = _caches.get(model)
+        if cache is None:
+            cache = _caches[model] = PrefixKVCache()
+        return cache
+
+
+def generation_lock(model):
+    """
+    Returns the lock that serializes generate() calls on a model instance.
+
+    Qwen2-VL keeps the rope offsets of the running prompt on the model itself,
+    so two generations on one instance must not overlap.
+    """
+    with _caches_lock:
+        lock = _generation_locks.get(model)
+        if lock is None:
+            lock = _generation_locks[model] = threading.Lock()
+        return lock
+
+
+def prefix_cache_bytes(model):
+    """
+    Returns the memory held by the cached prefix KV states of a model.
+    """
+    with _caches_lock:
+        cache = _caches.get(model)
+    return cache.nbytes() if cache is not None else 0
+
+
+def drop_prefix_cache(model):
+    """
+    Frees the cached prefix KV states of a model, e.g. when it is evicted.
+    """
+    with _caches_lock:
+        cache = _caches.pop(model, None)
+    if cache is not None:
+        cache.clear()
+
+
+def _tensor_bytes(value):
+    import torch
+
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if hasattr(value, 'to_legacy_cache'):
+        value = value.to_legacy_cache()
+    if isinstance(value, (list, tuple)):
+        return sum(_tensor_bytes(item) for item in value)
+    return 0
+
+
+def _rope_owner(model):
+    # Newer transformers keep rope_deltas on the inner model
+    inner = getattr(model, 'model', None)
+    if inner is not None and hasattr(inner, 'rope_deltas'):
+        return inner
+    return model
+
+
+class FirstTokenTimer:
+    """
+    generate() streamer that notes when the first new token is produced, i.e.
+    when prefill ends. generate() first passes the prompt, then each new token.
+    Tokens are passed on to `streamer`, if given.
+    """
+
+    def __init__(self, streamer=None):
+        self._calls = 0
+        self.first_token_at = None
+        self.streamer = streamer
+
+    def put(self, value):
+        self._calls += 1
+        if self._calls == 2:
+            self.first_token_at = time.perf_counter()
+        if self.streamer is not None:
+            self.streamer.put(value)
+
+    def end(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        if self.streamer is not None:
+            self.streamer.end()
+
+
+def image_prefix_length(input_ids, tokenizer):
+    """
+    Returns the number of tokens up to and including the last vision-end token,
+    or 0 if the prompt contains no images.
+    """
+    vision_end_id = tokenizer.convert_tokens_to_ids(VISION_END_TOKEN)
+    positions = (input_ids[0] == vision_end_id).nonzero()
+    if positions.numel() == 0:
+        return 0
+    return int(positions[-1].item()) + 1
+
+
+def generate_with_prefix_cache(model, processor, inputs, cache_key, timings=None, streamer=None, **generate_kwargs):
+    """
+    Runs model.generate, reusing the cached KV state of the image prefix.
+
+    On a miss the image prefix is prefilled once and stored; on a hit only the
+    text tokens after the prefix are prefilled.
+
+    Args:
+        model: The loaded Qwen2-VL model.
+        processor: Its processor.
+        inputs (BatchFeature): Processor output for a single prompt.
+        cache_key (tuple): Identifies the page images and their resolution
+            within the model's own cache.
+        timings (dict): If given, receives 'prefix_cache' ('hit', 'miss' or 'off')
+            and 'prefill_seconds', the time until the first new token.
+        streamer: If given, receives the tokens as they are generated.
+
+    Returns:
+        torch.Tensor: The generated ids, including the prompt.
+    """
+    import torch
+
+    timer = FirstTokenTimer(streamer)
+    start = time.perf_counter()
+
+    def finish(generated_ids, status):
+        if timings is not None:
+            timings['prefix_cache'] = status
+            timings['prefill_seconds'] = (timer.first_token_at or time.perf_counter()) - start
+        return generated_ids
+
+    prefix_len = image_prefix_length(inputs.input_ids, processor.tokenizer)
+    cache = _cache_for(model)
+    with generation_lock(model):
+        if cache.max_entries <= 0 or prefix_len == 0 or prefix_len >= inputs.input_ids.shape[1]:
+            return finish(model.generate(**inputs, streamer=timer, **generate_kwargs), 'off')
+
+        prefix_ids = inputs.input_ids[:, :prefix_len]
+        entry = cache.get(cache_key, prefix_ids)
+        status = 'hit' if entry is not None else 'miss'
+        if entry is None:
+            with torch.no_grad():
+                outputs = model(
+                    input_ids=prefix_ids,
+                    attention_mask=inputs.attention_mask[:, :prefix_len],
+                    pixel_values=inputs.pixel_values,
+                    image_grid_thw=inputs.image_grid_thw,
+                    use_cache=True,
+                )
+            entry = {
+                'prefix_ids': prefix_ids,
+                'past_key_values': outputs.past_key_values,
+                'rope_deltas': _rope_owner(model).rope_deltas,
+            }
+            cache.put(cache_key, entry)
+            logger.info(f"Cached image prefix of {prefix_len} tokens.")
+        else:
+            logger.info(f"Reusing cached image prefix of {prefix_len} tokens.")
+
+        # generate() extends the cache in place, so each call works on a copy
+        _rope_owner(model).rope_deltas = entry['rope_deltas']
+        return finish(model.generate(
+            **inputs,
+            past_key_values=copy.deepcopy(entry['past_key_values']),
+            streamer=timer,
+            **generate_kwargs,
+        ), status)
@@ -0,0 +1,109 @@
+# models/preloader.py
+
+import os
+import tempfile
+import threading
+import time
+from PIL import Image
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Comma-separated models to load at startup, e.g. PRELOAD_GENERATION_MODELS="qwen"
+PRELOAD_GENERATION_MODELS = [m.strip() for m in os.getenv("PRELOAD_GENERATION_MODELS", "").split(',') if m.strip()]
+PRELOAD_INDEXER_MODELS = [m.strip() for m in os.getenv("PRELOAD_INDEXER_MODELS", "").split(',') if m.strip()]
+PRELOAD_WARMUP = os.getenv("PRELOAD_WARMUP", "true").lower() == "true"
+
+_model_states = {}
+_states_lock = threading.Lock()
+_preload_thread = None
+
+
+def _set_state(name, **fields):
+    with _states_lock:
+        _model_states.setdefault(name, {}).update(fields)
+
+
+def _warmup_page():
+    path = os.path.join(tempfile.gettempdir(), "localgpt-warmup.png")
+    if not os.path.exists(path):
+        Image.new('RGB', (280, 280), 'white').save(path)
+    return path
+
+
+def _preload_generation_model(model_choice):
+    from models.backends import get_backend, GenerationOptions
+    from models.model_loader import load_model
+    from models.worker_client import worker_enabled, call_worker
+
+    backend = get_backend(model_choice)
+    if worker_enabled() and backend is not None and not backend.capabilities.remote:
+        # The model worker process owns local models; only check that it answers
+        _set_state(model_choice, state='loading', served_by='model-worker')
+        call_worker({'op': 'status'})
+        return
+
+    _set_state(model_choice, state='loading')
+    load_model(model_choice)
+    # Only backends running in-process benefit from a warm-up forward pass
+    if PRELOAD_WARMUP and backend is not None and not backend.capabilities.remote:
+        _set_state(model_choice, state='warming')
+        # Called on the backend directly: it raises on failure, where the responder
+        # would turn the error into an answer string
+        backend.run('generate', [_warmup_page()], "Describe this page.", GenerationOptions(280, 280))
+
+
+def _preload_indexer_model(indexer_model):
+    from byaldi import RAGMultiModalModel
+
+    # Indexes are built with a fresh RAG model per upload; loading once here
+    # downloads the weights and warms the disk cache for the first upload.
+    _set_state(indexer_model, state='loading')
+    RAGMultiModalModel.from_pretrained(indexer_model)
+
+
+def _preload_all():
+    jobs = [(name, 'generation', _preload_generation_model) for name in PRELOAD_GENERATION_MODELS]
+    jobs += [(name, 'indexer', _preload_indexer_model) for name in PRELOAD_INDEXER_MODELS]
+    for name, _, preload in jobs:
+        start_time = time.perf_counter()
+        try:
+            preload(name)
+            _set_state(name, state='ready', seconds=round(time.perf_counter() - start_time, 2))
+            logger.info(f"Preloaded '{name}' in {time.perf_counter() - start_time:.1f}s.")
+        except Exception as e:
+            _set_state(name, state='failed', error=str(e))
+            logger.error(f"Error preloading '{name}': {e}")
+
+
+def start_preloading():
+    """
+    Starts loading and warming the configured models in a background thread.
+    """
+    global _preload_thread
+    if _preload_thread is not None:
+        return
+    for name in PRELOAD_GENERATION_MODELS:
+        _set_state(name, kind='generation', state='pending')
+    for name in PRELOAD_INDEXER_MODELS:
+        _set_state(name, kind='indexer', state='pending')
+    if not _model_states:
+        return
+    _preload_thread = threading.Thread(target=_preload_all, name="model-preloader", daemon=True)
+    _preload_thread.start()
+    logger.info(f"Preloading models in background: {list(_model_states)}")
+
+
+def model_states():
+    """
+    Returns the preload state of every configured model.
+    """
+    with _states_lock:
+        return {name: dict(state) for name, state in _model_states.items()}
+
+
+def is_ready():
+    """
+    True once every configured model has been loaded and warmed.
+    """
+    return all(state.get('state') == 'ready' for state in model_states().values())
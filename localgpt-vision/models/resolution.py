@@ -0,0 +1,154 @@
+# models/resolution.py
+
+import math
+import os
+import threading
+from PIL import Image, ImageStat
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Qwen2-VL merges 2x2 patches of 14px, so one visual token covers 28x28 pixels
+PATCH_SIZE = 28
+MIN_SIDE = int(os.getenv("ADAPTIVE_MIN_SIDE", 224))
+MAX_SIDE = int(os.getenv("ADAPTIVE_MAX_SIDE", 1344))
+RANK_DECAY = float(os.getenv("ADAPTIVE_RANK_DECAY", 0.6))
+
+# Weight kept by older prefill samples each time a new one arrives
+_LATENCY_DECAY = 0.9
+
+
+def visual_tokens(height, width):
+    """
+    Returns the number of visual tokens a height x width image costs.
+    """
+    return (height // PATCH_SIZE) * (width // PATCH_SIZE)
+
+
+class PrefillLatencyModel:
+    """
+    Prefill time as intercept + slope * visual tokens, fitted by least squares
+    over recent samples (older ones decay), so fixed costs such as the text
+    prompt are not charged to the pages.
+
+    Until the samples span a range of token counts, the fit falls back to a line
+    through the origin, which overestimates the per-token cost.
+    """
+
+    def __init__(self, decay=_LATENCY_DECAY):
+        self.decay = decay
+        # Decayed sums of 1, x, y, x*x and x*y
+        self._sums = [0.0] * 5
+        self._lock = threading.Lock()
+
+    def add(self, tokens, seconds):
+        with self._lock:
+            self._sums = [self.decay * total for total in self._sums]
+            for i, value in enumerate((1.0, tokens, seconds, tokens * tokens, tokens * seconds)):
+                self._sums[i] += value
+
+    def fit(self):
+        """
+        Returns (intercept seconds, seconds per visual token), or None without samples.
+        """
+        with self._lock:
+            weight, x, y, xx, xy = self._sums
+        if not weight or not x:
+            return None
+        mean_x, mean_y = x / weight, y / weight
+        variance = xx / weight - mean_x * mean_x
+        if variance > (0.1 * mean_x) ** 2:
+            slope = (xy / weight - mean_x * mean_y) / variance
+            intercept = mean_y - slope * mean_x
+            if slope > 0 and intercept >= 0:
+                return intercept, slope
+        return 0.0, y / x
+
+    def reset(self):
+        with self._lock:
+            self._sums = [0.0] * 5
+
+
+_prefill_latency = PrefillLatencyModel()
+
+
+def record_latency(total_tokens, prefill_seconds):
+    """
+    Adds an observed prefill (time to first token) over total_tokens visual tokens.
+    Samples whose image prefix came from the KV cache must not be recorded.
+    """
+    if total_tokens > 0 and prefill_seconds > 0:
+        _prefill_latency.add(total_tokens, prefill_seconds)
+
+
+def _page_density(image):
+    """
+    Estimates how much of the page is covered with ink (0.0 blank, 1.0 full).
+    """
+    thumb = image.convert('L')
+    thumb.thumbnail((64, 64))
+    dark = sum(count for level, count in enumerate(thumb.histogram()) if level < 200)
+    return dark / float(thumb.size[0] * thumb.size[1])
+
+
+def _fit_page(height, width, max_tokens):
+    """
+    Scales a page, keeping its aspect ratio, to at most max_tokens visual tokens.
+
+    The page is never enlarged or made longer than MAX_SIDE, and its shorter
+    side is raised to MIN_SIDE only where the token share allows it.
+    """
+    token_scale = math.sqrt(max(max_tokens, 1) * PATCH_SIZE * PATCH_SIZE / float(height * width))
+    upper = min(token_scale, MAX_SIDE / float(max(height, width)))
+    scale = max(min(1.0, upper), min(MIN_SIDE / float(min(height, width)), upper))
+    new_height = max(PATCH_SIZE, int(height * scale // PATCH_SIZE) * PATCH_SIZE)
+    new_width = max(PATCH_SIZE, int(width * scale // PATCH_SIZE) * PATCH_SIZE)
+    # Very elongated pages can gain a token from the one-patch minimum; trim the longer side
+    while visual_tokens(new_height, new_width) > max(max_tokens, 1):
+        if new_height >= new_width:
+            new_height -= PATCH_SIZE
+        else:
+            new_width -= PATCH_SIZE
+    return new_height, new_width
+
+
+def plan_page_sizes(image_paths, token_budget, latency_target=None):
+    """
+    Chooses a resolution for each retrieved page under a visual-token budget.
+
+    Pages are given a share of the budget that decays with retrieval rank and
+    grows with ink density, and keep their aspect ratio. The budget is a hard
+    ceiling (apart from a minimum of one token per page). When a latency target
+    is set, the budget is further capped to what the fitted prefill latency
+    allows; decoding time does not depend on page resolution and is not counted.
+
+    Args:
+        image_paths (list): Page images ordered by retrieval rank.
+        token_budget (int): Maximum number of visual tokens for all pages.
+        latency_target (float): Optional target prefill time (time to first token) in seconds.
+
+    Returns:
+        list: A (height, width) tuple per page, both multiples of 28.
+    """
+    budget = int(token_budget)
+    fit = _prefill_latency.fit()
+    if latency_target and fit:
+        intercept, slope = fit
+        affordable = int((float(latency_target) - intercept) / slope)
+        if affordable < budget:
+            logger.info(f"Latency target {latency_target}s allows {max(affordable, 0)} visual tokens "
+                        f"(prefill {intercept:.3f}s + {slope * 1000:.3f}ms/token).")
+        budget = min(budget, max(affordable, len(image_paths)))
+
+    pages = []
+    for rank, path in enumerate(image_paths):
+        with Image.open(path) as image:
+            width, height = image.size
+            density = _page_density(image)
+        pages.append((height, width, (RANK_DECAY ** rank) * (0.5 + density)))
+
+    total_weight = sum(weight for _, _, weight in pages) or 1.0
+    sizes = []
+    for height, width, weight in pages:
+        sizes.append(_fit_page(height, width, int(budget * weight / total_weight)))
+    return sizes
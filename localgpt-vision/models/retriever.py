@@ -5,6 +5,9 @@ import os
 from PIL import Image
 from io import BytesIO
 from logger import get_logger
+from models.disk_gc import mark_page_used
+from models.page_images import page_image_filename, ensure_thumbnails
+from models.tracing import span
 import time
 import hashlib
 
@@ -25,35 +28,48 @@ def retrieve_documents(RAG, query, session_id, k=3):
     """
     try:
         logger.info(f"Retrieving documents for query: {query}")
-        results = RAG.search(query, k=k)
+        with span('search'):
+            results = RAG.search(query, k=k)
         images = []
         session_images_folder = os.path.join('static', 'images', session_id)
         os.makedirs(session_images_folder, exist_ok=True)
         
         for i, result in enumerate(results):
             if result.base64:
-                image_data = base64.b64decode(result.base64)
-                image = Image.open(BytesIO(image_data))
+                with span('decode_image'):
+                    image_data = base64.b64decode(result.base64)
+                    image = Image.open(BytesIO(image_data))
                 
                 # Generate a unique filename based on the image content
                 image_hash = hashlib.md5(image_data).hexdigest()
-                image_filename = f"retrieved_{image_hash}.png"
+                image_filename = page_image_filename(image_hash)
                 image_path = os.path.join(session_images_folder, image_filename)
                 
-                if not os.path.exists(image_path):
-                    image.save(image_path, format='PNG')
-                    logger.debug(f"Retrieved and saved image: {image_path}")
-                else:
-                    logger.debug(f"Image already exists: {image_path}")
+                with span('save_image', cache='hit' if os.path.exists(image_path) else 'miss'):
+                    if not os.path.exists(image_path):
+                        image.save(image_path, format='PNG')
+                        logger.debug(f"Retrieved and saved image: {image_path}")
+                    else:
+                        # Mark the page as recently used for the disk GC; touching the
+                        # file instead would invalidate its cached remote payloads
+                        mark_page_used(image_path)
+                        logger.debug(f"Image already exists: {image_path}")
+
+                    # Thumbnails are made once per page, here rather than on first view
+                    try:
+                        ensure_thumbnails(image_path, image)
+                    except Exception as e:
+                        logger.warning(f"Could not generate thumbnails for {image_path}: {e}")
                 
                 # Store the relative path from the static folder
                 relative_path = os.path.join('images', session_id, image_filename)
                 images.append(relative_path)
-                logger.info(f"Added image to list: {relative_path}")
+                logger.debug(f"Added image to list: {relative_path}")
             else:
                 logger.warning(f"No base64 data for document {result.doc_id}, page {result.page_num}")
         
-        logger.info(f"Total {len(images)} documents retrieved. Image paths: {images}")
+        logger.info(f"Total {len(images)} documents retrieved.")
+        logger.debug(f"Image paths: {images}")
         return images
     except Exception as e:
         logger.error(f"Error retrieving documents: {e}")
@@ -0,0 +1,153 @@
+# models/tracing.py
+
+import contextvars
+import importlib.util
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager, ExitStack
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# prometheus_client is optional; without it spans are only logged
+PROMETHEUS_AVAILABLE = importlib.util.find_spec("prometheus_client") is not None
+
+# Pipeline stages take from milliseconds (session reads) to minutes (indexing)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 900.0)
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+_metrics = None
+_metrics_lock = threading.Lock()
+_span_listeners = []
+
+
+_base_record_factory = logging.getLogRecordFactory()
+
+
+def _record_factory(*args, **kwargs):
+    # Tags every log record with the request being handled (shown in JSON logs)
+    record = _base_record_factory(*args, **kwargs)
+    record.request_id = _request_id.get()
+    return record
+
+
+logging.setLogRecordFactory(_record_factory)
+
+
+def start_request(request_id=None):
+    """
+    Sets the id of the request being handled in this context.
+
+    Args:
+        request_id (str): An id passed in by the client (X-Request-ID); a new one is made if empty.
+
+    Returns:
+        tuple: (request_id, token); pass the token to end_request.
+    """
+    request_id = request_id or uuid.uuid4().hex
+    return request_id, _request_id.set(request_id)
+
+
+def end_request(token):
+    _request_id.reset(token)
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+def add_span_listener(listener):
+    """
+    Registers a profiler that runs around every span, e.g. to measure memory per stage.
+
+    Args:
+        listener (callable): Called with (stage, labels) as a span starts; returns
+            a context manager that is exited when the span ends.
+    """
+    _span_listeners.append(listener)
+
+
+def remove_span_listener(listener):
+    _span_listeners.remove(listener)
+
+
+# Values allowed in the model_choice metric label. Model names come from user
+# settings, so anything else is reported as 'other' to bound label cardinality.
+METRIC_MODEL_CHOICES = {
+    'qwen', 'llama-vision', 'pixtral', 'molmo', 'gemini', 'gpt4', 'groq-llama-vision', 'ollama',
+    'vidore/colpali', 'vidore/colpali-v1.2', 'vidore/colqwen2-v0.1',
+}
+
+
+def _metric_model_choice(model_choice):
+    if not model_choice or model_choice in METRIC_MODEL_CHOICES:
+        return model_choice
+    return 'other'
+
+
+def _get_metrics():
+    global _metrics
+    if _metrics is None and PROMETHEUS_AVAILABLE:
+        with _metrics_lock:
+            if _metrics is None:
+                from prometheus_client import Histogram
+                _metrics = {
+                    'stage': Histogram('localgpt_stage_duration_seconds', 'Time spent in each pipeline stage',
+                                       ['stage', 'model_choice', 'cache'], buckets=STAGE_BUCKETS),
+                    'request': Histogram('localgpt_request_duration_seconds', 'HTTP request latency',
+                                         ['endpoint', 'method', 'status'], buckets=STAGE_BUCKETS),
+                }
+    return _metrics
+
+
+@contextmanager
+def span(stage, model_choice='', cache=''):
+    """
+    Times a pipeline stage and records it under the current request id.
+
+    Yields a dict of the span's labels; set 'cache' (e.g. 'hit' or 'miss') or
+    'model_choice' on it once they are known inside the block.
+
+    Args:
+        stage (str): The stage name, e.g. 'search' or 'generate'.
+        model_choice (str): The model the stage runs, if any.
+        cache (str): The outcome of a cache lookup, if the stage has one.
+    """
+    labels = {'model_choice': model_choice or '', 'cache': cache or ''}
+    with ExitStack() as listeners:
+        for listener in list(_span_listeners):
+            listeners.enter_context(listener(stage, labels))
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield labels
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics = _get_metrics()
+            if metrics is not None:
+                metrics['stage'].labels(stage, _metric_model_choice(labels['model_choice']),
+                                        labels['cache']).observe(elapsed)
+            details = ''.join(f" {name}={value}" for name, value in labels.items() if value)
+            logger.debug(f"[{current_request_id() or '-'}] {stage}{details} {'failed' if failed else 'took'} {elapsed:.3f}s")
+
+
+def observe_request(endpoint, method, status, seconds):
+    metrics = _get_metrics()
+    if metrics is not None:
+        metrics['request'].labels(endpoint or 'unknown', method, str(status)).observe(seconds)
+
+
+def metrics_payload():
+    """
+    Returns (body, content_type) in the Prometheus text format, or None without prometheus_client.
+    """
+    if not PROMETHEUS_AVAILABLE:
+        return None
+    from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+    _get_metrics()
+    return generate_latest(), CONTENT_TYPE_LATEST
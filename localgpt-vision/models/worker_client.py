@@ -0,0 +1,102 @@
+# models/worker_client.py
+
+import hashlib
+import os
+from dataclasses import asdict
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# When set, local backends run in the shared model worker (see model_worker.py)
+MODEL_WORKER_ADDRESS = os.getenv("MODEL_WORKER_ADDRESS")
+# Shared secret for the worker socket; there is no default, anyone could guess it
+MODEL_WORKER_AUTHKEY = os.getenv("MODEL_WORKER_AUTHKEY", "").encode()
+
+
+class ModelWorkerError(RuntimeError):
+    """Raised when the model worker rejects or fails a request."""
+
+
+def worker_enabled():
+    return bool(MODEL_WORKER_ADDRESS)
+
+
+def require_authkey():
+    """
+    Raises if the worker socket would be used without an explicit shared secret.
+    """
+    if not MODEL_WORKER_AUTHKEY:
+        raise ModelWorkerError("MODEL_WORKER_AUTHKEY must be set to use the model worker.")
+
+
+if worker_enabled():
+    require_authkey()
+
+
+def _share_image(image_path):
+    """
+    Copies an image into a new shared memory block.
+
+    Returns:
+        tuple: The SharedMemory block and the descriptor sent to the worker.
+    """
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    block = shared_memory.SharedMemory(create=True, size=len(data))
+    block.buf[:len(data)] = data
+    descriptor = {
+        'shm': block.name,
+        'size': len(data),
+        'digest': hashlib.md5(data).hexdigest(),
+        'suffix': os.path.splitext(image_path)[1] or '.png',
+    }
+    return block, descriptor
+
+
+def call_worker(message):
+    """
+    Sends one request to the model worker and returns its reply.
+    """
+    with Client(MODEL_WORKER_ADDRESS, family='AF_UNIX', authkey=MODEL_WORKER_AUTHKEY) as conn:
+        conn.send(message)
+        reply = conn.recv()
+    if 'error' in reply:
+        raise ModelWorkerError(reply['error'])
+    return reply
+
+
+def generate_via_worker(images, query, model_choice, options):
+    """
+    Generates a response in the model worker, passing page images through shared memory.
+
+    Args:
+        images (list): Paths of the page images.
+        query (str): The user's query.
+        model_choice (str): A local backend name.
+        options (GenerationOptions): Resolution settings for the backend.
+
+    Returns:
+        str: The generated response.
+    """
+    blocks = []
+    try:
+        descriptors = []
+        for image_path in images:
+            block, descriptor = _share_image(image_path)
+            blocks.append(block)
+            descriptors.append(descriptor)
+        reply = call_worker({
+            'op': 'generate',
+            'model_choice': model_choice,
+            'query': query,
+            'images': descriptors,
+            'options': asdict(options),
+        })
+        logger.info(f"Model worker answered in {reply['seconds']:.2f}s (queued {reply['queue_seconds']:.2f}s).")
+        return reply['text']
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
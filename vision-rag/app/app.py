@@ -1,8 +1,11 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
+import asyncio
+import hashlib
+import time
 import os
 import uuid
 import json
@@ -10,8 +13,12 @@ from datetime import datetime
 
 from .indexer import index_documents
 from .retriever import retrieve_documents
-from .responder import generate_response
+from .responder import generate_response, generate_response_stream
 from .logger import get_logger
+from .preloader import start_preloading, model_states, is_ready
+from .session_store import SessionStore
+from .tracing import span, start_request, end_request, observe_request, metrics_payload
+from .disk_gc import DiskGC
 
 # Initialize FastAPI app
 app = FastAPI(title="briefcase-vision-rag-engine")
@@ -26,6 +33,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Tags the request's timing spans with an id (the client's X-Request-ID if sent)."""
+    started = time.perf_counter()
+    request_id, token = start_request(request.headers.get("x-request-id"))
+    try:
+        response = await call_next(request)
+    finally:
+        end_request(token)
+    response.headers["X-Request-ID"] = request_id
+    route = request.scope.get("route")
+    observe_request(getattr(route, "path", None), request.method, response.status_code, time.perf_counter() - started)
+    return response
+
 # Configure folders
 UPLOAD_FOLDER = 'uploaded_documents'
 SESSION_FOLDER = 'sessions'
@@ -36,9 +57,32 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(SESSION_FOLDER, exist_ok=True)
 os.makedirs(INDEX_FOLDER, exist_ok=True)
 
+# Session metadata, chat history and indexed files live in one SQLite database
+session_store = SessionStore(os.getenv("SESSION_DB_PATH", os.path.join(SESSION_FOLDER, "sessions.db")))
+# With several web workers, set SESSION_MIGRATE_ON_START=false and run
+# `python -m app.session_store` once before starting them
+if os.getenv("SESSION_MIGRATE_ON_START", "true").lower() == "true":
+    session_store.migrate_json_sessions(SESSION_FOLDER)
+
 # Global RAG models dictionary
 RAG_models = {}
 
+def remove_session(session_id: str):
+    """Deletes a session with its uploads, retrieved pages and index."""
+    session_store.delete_session(session_id)
+    reclaimed = disk_gc.remove_session_files(session_id)
+    RAG_models.pop(session_id, None)
+    logger.info(f"Session {session_id} deleted ({reclaimed / (1024 * 1024):.1f} MB reclaimed)")
+
+# Uploads, retrieved pages and indexes are kept within disk quotas in the background
+disk_gc = DiskGC(
+    session_roots=[UPLOAD_FOLDER, INDEX_FOLDER],
+    image_folder=lambda session_id: os.path.join(UPLOAD_FOLDER, session_id, "images"),
+    list_sessions=session_store.session_ids_by_activity,
+    delete_session=remove_session,
+    is_active=lambda session_id: session_id in RAG_models,
+)
+
 # Pydantic models for request/response
 class SessionCreate(BaseModel):
     name: Optional[str] = "Untitled Session"
@@ -60,30 +104,50 @@ class Settings(BaseModel):
 
 # Helper functions
 def get_session_data(session_id: str) -> dict:
-    session_file = os.path.join(SESSION_FOLDER, f"{session_id}.json")
-    if os.path.exists(session_file):
-        with open(session_file, 'r') as f:
-            return json.load(f)
-    return {"chat_history": [], "session_name": "Untitled Session", "indexed_files": []}
+    metadata = session_store.get_session(session_id)
+    if metadata is None:
+        return {"chat_history": [], "session_name": "Untitled Session", "indexed_files": []}
+    return {
+        "session_name": metadata["name"],
+        "chat_history": session_store.get_messages(session_id),
+        "indexed_files": session_store.get_indexed_files(session_id),
+        "created_at": metadata["created_at"],
+    }
 
-def save_session_data(session_id: str, data: dict):
-    session_file = os.path.join(SESSION_FOLDER, f"{session_id}.json")
-    with open(session_file, 'w') as f:
-        json.dump(data, f)
+def append_exchange(session_id: str, query: str, response: str, images: list[str]):
+    session_store.add_exchange(session_id, [
+        {
+            "role": "user",
+            "content": query,
+            "timestamp": datetime.now().isoformat()
+        },
+        {
+            "role": "assistant",
+            "content": response,
+            "images": images,
+            "timestamp": datetime.now().isoformat()
+        },
+    ], "Untitled Session")
 
 # Endpoints
 @app.post("/api/sessions/create")
 async def create_session(session_data: SessionCreate):
     session_id = str(uuid.uuid4())
-    session_data_dict = {
-        "session_name": session_data.name,
-        "chat_history": [],
-        "indexed_files": [],
-        "created_at": datetime.now().isoformat()
-    }
-    save_session_data(session_id, session_data_dict)
+    session_store.create_session(session_id, session_data.name)
+    session_data_dict = get_session_data(session_id)
     return {"session_id": session_id, "data": session_data_dict}
 
+@app.get("/api/sessions")
+async def list_sessions(offset: int = 0, limit: int = 50):
+    """Returns a page of sessions sorted by name."""
+    offset, limit = max(offset, 0), min(max(limit, 1), 500)
+    total = session_store.count_sessions()
+    return {
+        "sessions": session_store.list_sessions(offset=offset, limit=limit),
+        "total": total,
+        "next_offset": offset + limit if offset + limit < total else None,
+    }
+
 @app.get("/api/sessions/{session_id}")
 async def get_session(session_id: str):
     data = get_session_data(session_id)
@@ -94,19 +158,8 @@ async def get_session(session_id: str):
 @app.delete("/api/sessions/{session_id}")
 async def delete_session(session_id: str):
     try:
-        # Remove session file
-        session_file = os.path.join(SESSION_FOLDER, f"{session_id}.json")
-        if os.path.exists(session_file):
-            os.remove(session_file)
-
-        # Remove uploaded documents
-        session_uploads = os.path.join(UPLOAD_FOLDER, session_id)
-        if os.path.exists(session_uploads):
-            import shutil
-            shutil.rmtree(session_uploads)
-
-        # Remove from RAG models
-        RAG_models.pop(session_id, None)
+        # Remove session data, uploaded documents, retrieved pages and the index
+        await asyncio.to_thread(remove_session, session_id)
 
         return {"message": "Session deleted successfully"}
     except Exception as e:
@@ -114,12 +167,8 @@ async def delete_session(session_id: str):
 
 @app.put("/api/sessions/{session_id}/rename")
 async def rename_session(session_id: str, rename_data: SessionRename):
-    data = get_session_data(session_id)
-    if not data:
+    if not session_store.rename_session(session_id, rename_data.new_name):
         raise HTTPException(status_code=404, detail="Session not found")
-    
-    data["session_name"] = rename_data.new_name
-    save_session_data(session_id, data)
     return {"message": "Session renamed successfully"}
 
 @app.post("/api/documents/upload")
@@ -128,6 +177,9 @@ async def upload_documents(
     files: List[UploadFile] = File(...),
     indexer_model: str = "vidore/colpali"
 ):
+    incoming_bytes = sum(file.size or 0 for file in files)
+    if await asyncio.to_thread(disk_gc.would_exceed_quota, session_id, incoming_bytes):
+        raise HTTPException(status_code=413, detail="This session has reached its disk quota")
     try:
         folder_path = os.path.join(UPLOAD_FOLDER, session_id)
         index_path = os.path.join(INDEX_FOLDER, session_id)
@@ -143,14 +195,13 @@ async def upload_documents(
         RAG_models[session_id] = RAG
         
         # Update session data
-        session_data = get_session_data(session_id)
-        session_data["indexed_files"].extend([file.filename for file in files])
-        save_session_data(session_id, session_data)
+        session_store.create_session(session_id, "Untitled Session")
+        session_store.add_indexed_files(session_id, [file.filename for file in files])
         
         return {
             "success": True,
             "message": "Files indexed successfully",
-            "indexed_files": session_data["indexed_files"]
+            "indexed_files": session_store.get_indexed_files(session_id)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -159,7 +210,8 @@ async def upload_documents(
 async def chat_query(session_id: str, query_data: ChatQuery):
     try:
         # Get RAG model
-        rag_model = RAG_models.get(session_id)
+        with span("session_cache", cache="hit" if session_id in RAG_models else "miss"):
+            rag_model = RAG_models.get(session_id)
         if not rag_model:
             raise HTTPException(status_code=404, detail="Session not initialized")
         
@@ -181,19 +233,8 @@ async def chat_query(session_id: str, query_data: ChatQuery):
         )
         
         # Update chat history
-        session_data = get_session_data(session_id)
-        session_data["chat_history"].append({
-            "role": "user",
-            "content": query_data.query,
-            "timestamp": datetime.now().isoformat()
-        })
-        session_data["chat_history"].append({
-            "role": "assistant",
-            "content": response,
-            "images": retrieved_images,
-            "timestamp": datetime.now().isoformat()
-        })
-        save_session_data(session_id, session_data)
+        # Off the event loop: in the write-through durability modes this commits to disk
+        await asyncio.to_thread(append_exchange, session_id, query_data.query, response, retrieved_images)
         
         return {
             "response": response,
@@ -202,10 +243,69 @@ async def chat_query(session_id: str, query_data: ChatQuery):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/chat/{session_id}/query/stream")
+async def chat_query_stream(session_id: str, query_data: ChatQuery):
+    """
+    Streams the response as plain text; the retrieved page images are sent in
+    the X-Retrieved-Images header and the exchange is saved once it completes.
+    The session, pages and model are checked before the response starts.
+    """
+    with span("session_cache", cache="hit" if session_id in RAG_models else "miss"):
+        rag_model = RAG_models.get(session_id)
+    if not rag_model:
+        raise HTTPException(status_code=404, detail="Session not initialized")
+    retrieved_images = await retrieve_documents(
+        RAG=rag_model,
+        query=query_data.query,
+        session_id=session_id
+    )
+
+    # Errors before the first chunk still become an error status, not a broken body
+    response_chunks = await generate_response_stream(
+        images=retrieved_images,
+        query=query_data.query,
+        session_id=session_id,
+        resized_height=query_data.resized_height,
+        resized_width=query_data.resized_width,
+        model_choice=query_data.model_choice
+    )
+
+    async def stream():
+        chunks = []
+        try:
+            async for chunk in response_chunks:
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            # On a client disconnect this closes the upstream model stream
+            await response_chunks.aclose()
+        await asyncio.to_thread(append_exchange, session_id, query_data.query, "".join(chunks), retrieved_images)
+
+    return StreamingResponse(stream(), media_type="text/plain",
+                             headers={"X-Retrieved-Images": json.dumps(retrieved_images)})
+
 @app.get("/api/chat/{session_id}/history")
-async def get_chat_history(session_id: str):
-    data = get_session_data(session_id)
-    return {"chat_history": data["chat_history"]}
+async def get_chat_history(request: Request, session_id: str, limit: Optional[int] = None,
+                           before_id: Optional[int] = None):
+    """
+    Returns the chat history, or with limit only the most recent messages;
+    pass the oldest loaded message id as before_id to page further back.
+    Answers 304 when If-None-Match still matches the page's ETag.
+    """
+    # Messages are append-only, so the newest id in range identifies the page
+    latest_id = session_store.latest_message_id(session_id, before_id=before_id)
+    etag = '"' + hashlib.sha1(f"{session_id}:{limit}:{before_id}:{latest_id}".encode()).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    if limit is None:
+        body = {"chat_history": session_store.get_messages(session_id, before_id=before_id)}
+    else:
+        # One extra row tells whether older messages remain
+        messages = session_store.get_messages(session_id, limit=limit + 1, before_id=before_id)
+        body = {"chat_history": messages[-limit:], "has_more": len(messages) > limit}
+    return JSONResponse(content=body, headers=headers)
 
 @app.get("/api/settings")
 async def get_settings():
@@ -217,20 +317,39 @@ async def update_settings(settings: Settings):
     # Update settings (implement storage mechanism as needed)
     return settings
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage latency by model_choice and cache outcome, and request latency."""
+    payload = metrics_payload()
+    if payload is None:
+        return JSONResponse(content={"detail": "Install prometheus_client to expose metrics."}, status_code=501)
+    body, content_type = payload
+    return Response(content=body, media_type=content_type)
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "models": model_states, "disk": disk_gc.last_report}
+
+@app.get("/ready")
+async def ready():
+    body = {"ready": is_ready(), "models": model_states}
+    return JSONResponse(content=body, status_code=200 if body["ready"] else 503)
+
 @app.get("/api/documents/{session_id}")
 async def get_indexed_files(session_id: str):
-    data = get_session_data(session_id)
-    return {"indexed_files": data["indexed_files"]}
+    return {"indexed_files": session_store.get_indexed_files(session_id)}
 
 # Startup event
 @app.on_event("startup")
 async def startup_event():
     logger.info("Starting up FastAPI application")
-    # Load existing indexes if needed
-    # Initialize any required resources
+    # Warm configured generation and indexer models without blocking startup
+    app.state.preload_task = start_preloading()
+    disk_gc.start()
 
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down FastAPI application")
+    disk_gc.stop()
     # Cleanup resources if needed
@@ -1,5 +1,4 @@
 from fastapi import UploadFile
-from docx2pdf import convert
 import os
 from .logger import get_logger
 
@@ -21,6 +20,7 @@ async def convert_docs_to_pdfs(files: list[UploadFile], folder_path: str):
                     f.write(content)
                 
                 # Convert to PDF
+                from docx2pdf import convert
                 convert(file_path, pdf_path)
                 logger.info(f"Converted '{file.filename}' to PDF.")
                 
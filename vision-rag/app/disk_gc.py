@@ -0,0 +1,234 @@
+from typing import Callable, Optional
+import os
+import re
+import shutil
+import threading
+import time
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# Disk quotas in MB; 0 disables a quota
+DISK_QUOTA_SESSION_MB = float(os.getenv("DISK_QUOTA_SESSION_MB", 2048))
+DISK_QUOTA_TOTAL_MB = float(os.getenv("DISK_QUOTA_TOTAL_MB", 20480))
+# Seconds between collections; 0 disables the background task
+DISK_GC_INTERVAL = float(os.getenv("DISK_GC_INTERVAL", 3600))
+# Files modified or retrieved more recently than this are never collected, so
+# uploads that are still being indexed and pages about to be answered from are
+# left alone
+DISK_GC_GRACE = float(os.getenv("DISK_GC_GRACE", 3600))
+# Whether the global quota may delete whole sessions (least recently used
+# first) once no retrieved pages are left to evict
+DISK_GC_EVICT_SESSIONS = os.getenv("DISK_GC_EVICT_SESSIONS", "false").lower() == "true"
+
+_MB = 1024 * 1024
+_PAGE_IMAGE = re.compile(r"^retrieved_([0-9a-f]{32})\.png$")
+
+# Last retrieval time of each page image by absolute path. Kept here rather
+# than in the file's mtime, which keys the image payload cache.
+_last_used = {}
+_last_used_lock = threading.Lock()
+
+def mark_page_used(path: str):
+    """Records that a retrieved page image was just used, for LRU eviction."""
+    with _last_used_lock:
+        _last_used[os.path.abspath(path)] = time.time()
+
+def _page_last_used(path: str, mtime: float) -> float:
+    with _last_used_lock:
+        return max(mtime, _last_used.get(os.path.abspath(path), 0.0))
+
+def tree_usage(path: str) -> tuple[int, float]:
+    """Returns (bytes, newest modification time) of everything under path."""
+    total, newest = 0, 0.0
+    try:
+        entries = list(os.scandir(path))
+    except (FileNotFoundError, NotADirectoryError):
+        return 0, 0.0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                size, mtime = tree_usage(entry.path)
+            else:
+                stat = entry.stat(follow_symlinks=False)
+                size, mtime = stat.st_size, stat.st_mtime
+        except FileNotFoundError:
+            continue
+        total += size
+        newest = max(newest, mtime)
+    return total, newest
+
+def remove_tree(path: str) -> int:
+    """Deletes a folder and returns the number of bytes it held."""
+    size, _ = tree_usage(path)
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    return size
+
+def _page_image_groups(folder: str) -> list[tuple[float, int, list[str]]]:
+    """Lists (last used time, bytes, paths) for each retrieved page in a folder."""
+    try:
+        entries = list(os.scandir(folder))
+    except FileNotFoundError:
+        return []
+    groups = []
+    for entry in entries:
+        if not _PAGE_IMAGE.match(entry.name):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        groups.append((_page_last_used(entry.path, stat.st_mtime), stat.st_size, [entry.path]))
+    return groups
+
+class DiskGC:
+    """
+    Keeps uploads, retrieved page images and indexes within disk quotas.
+
+    Every session owns one folder under each of `session_roots`. A collection
+    removes folders of sessions that no longer exist, evicts least recently used
+    retrieved page images while a session or the total is over quota, and finally
+    deletes idle sessions if DISK_GC_EVICT_SESSIONS is set. Retrieved pages are
+    a cache that retrieval rewrites; uploads and indexes go only with their session.
+    """
+
+    def __init__(self, session_roots: list[str], image_folder: Callable[[str], str],
+                 list_sessions: Callable[[], list[str]], delete_session: Callable[[str], None],
+                 is_active: Optional[Callable[[str], bool]] = None,
+                 session_quota_mb: float = DISK_QUOTA_SESSION_MB, total_quota_mb: float = DISK_QUOTA_TOTAL_MB,
+                 grace: float = DISK_GC_GRACE, evict_sessions: bool = DISK_GC_EVICT_SESSIONS):
+        """
+        list_sessions returns existing session ids least recently used first;
+        is_active marks sessions that must not be evicted.
+        """
+        self.session_roots = session_roots
+        self.image_folder = image_folder
+        self.list_sessions = list_sessions
+        self.delete_session = delete_session
+        self.is_active = is_active or (lambda session_id: False)
+        self.session_quota = session_quota_mb * _MB
+        self.total_quota = total_quota_mb * _MB
+        self.grace = grace
+        self.evict_sessions = evict_sessions
+        self.last_report = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def session_usage(self, session_id: str) -> int:
+        return sum(tree_usage(os.path.join(root, session_id))[0] for root in self.session_roots)
+
+    def would_exceed_quota(self, session_id: str, incoming_bytes: int) -> bool:
+        """Returns True if adding incoming_bytes would take the session over its quota."""
+        return bool(self.session_quota) and self.session_usage(session_id) + incoming_bytes > self.session_quota
+
+    def remove_session_files(self, session_id: str) -> int:
+        """Deletes a session's uploads, page images and index; returns the bytes reclaimed."""
+        return sum(remove_tree(os.path.join(root, session_id)) for root in self.session_roots)
+
+    def _evict_pages(self, groups: list, bytes_to_free: int) -> int:
+        freed = 0
+        cutoff = time.time() - self.grace
+        for last_used, size, paths in sorted(groups, key=lambda group: group[0]):
+            if freed >= bytes_to_free or last_used > cutoff:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            with _last_used_lock:
+                _last_used.pop(os.path.abspath(paths[0]), None)
+            freed += size
+        return freed
+
+    def run_once(self) -> dict:
+        """Runs one collection; reports bytes reclaimed per step, usage afterwards and the duration."""
+        with self._lock:
+            start = time.perf_counter()
+            reclaimed = {"orphans": 0, "session_quota": 0, "total_quota": 0, "sessions": 0}
+            sessions = self.list_sessions()
+            known = set(sessions)
+            cutoff = time.time() - self.grace
+
+            for root in self.session_roots:
+                try:
+                    children = [entry for entry in os.scandir(root) if entry.is_dir(follow_symlinks=False)]
+                except FileNotFoundError:
+                    continue
+                for entry in children:
+                    if entry.name in known or self.is_active(entry.name):
+                        continue
+                    size, newest = tree_usage(entry.path)
+                    if newest <= cutoff:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                        reclaimed["orphans"] += size
+                        logger.info(f"Removed orphaned folder {entry.path} ({size / _MB:.1f} MB).")
+
+            usage = {session_id: self.session_usage(session_id) for session_id in sessions}
+            if self.session_quota:
+                for session_id, used in usage.items():
+                    if used > self.session_quota:
+                        freed = self._evict_pages(_page_image_groups(self.image_folder(session_id)),
+                                                  used - self.session_quota)
+                        usage[session_id] -= freed
+                        reclaimed["session_quota"] += freed
+
+            total = sum(usage.values())
+            if self.total_quota and total > self.total_quota:
+                groups = [group for session_id in sessions
+                          for group in _page_image_groups(self.image_folder(session_id))]
+                freed = self._evict_pages(groups, total - self.total_quota)
+                total -= freed
+                reclaimed["total_quota"] += freed
+                if total > self.total_quota and self.evict_sessions:
+                    for session_id in sessions:
+                        if total <= self.total_quota:
+                            break
+                        if self.is_active(session_id):
+                            continue
+                        used = self.session_usage(session_id)
+                        self.delete_session(session_id)
+                        total -= used
+                        reclaimed["sessions"] += used
+                        logger.warning(f"Deleted session {session_id} to stay within the disk quota.")
+                if total > self.total_quota:
+                    logger.warning(f"Disk usage {total / _MB:.0f} MB is over the {self.total_quota / _MB:.0f} MB quota.")
+
+            # Forget pages deleted with their session
+            with _last_used_lock:
+                tracked = list(_last_used)
+            gone = [path for path in tracked if not os.path.exists(path)]
+            with _last_used_lock:
+                for path in gone:
+                    _last_used.pop(path, None)
+
+            self.last_report = {
+                "reclaimed_bytes": reclaimed,
+                "usage_bytes": total,
+                "sessions": len(sessions),
+                "duration": round(time.perf_counter() - start, 3),
+                "finished_at": time.time(),
+            }
+            logger.info(f"Disk GC reclaimed {sum(reclaimed.values()) / _MB:.1f} MB {reclaimed}; "
+                        f"{total / _MB:.1f} MB in use by {len(sessions)} sessions.")
+            return self.last_report
+
+    def start(self, interval: float = DISK_GC_INTERVAL):
+        """Collects in a daemon thread now and then every `interval` seconds."""
+        if interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name="disk-gc", daemon=True)
+        self._thread.start()
+
+    def _loop(self, interval: float):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Disk GC failed: {e}", exc_info=True)
+            self._stop.wait(interval)
+
+    def stop(self):
+        self._stop.set()
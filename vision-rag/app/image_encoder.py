@@ -0,0 +1,62 @@
+from PIL import Image
+from collections import OrderedDict
+from typing import Optional
+import base64
+import io
+import os
+import threading
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# Per-provider payload profiles: pixel budget, output format and quality
+PAYLOAD_PROFILES = {
+    'gpt4': {'max_pixels': 768 * 1024, 'format': 'JPEG', 'quality': 85},
+    'gemini': {'max_pixels': 1024 * 1344, 'format': 'WEBP', 'quality': 85},
+    'ollama': {'max_pixels': 1120 * 1120, 'format': 'JPEG', 'quality': 90},
+}
+
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'PNG': 'image/png',
+}
+
+_payload_cache = OrderedDict()
+_payload_cache_lock = threading.Lock()
+_PAYLOAD_CACHE_SIZE = int(os.getenv("IMAGE_PAYLOAD_CACHE_SIZE", 256))
+
+def _fit_to_budget(image: Image.Image, max_pixels: int) -> Image.Image:
+    width, height = image.size
+    if width * height <= max_pixels:
+        return image
+    scale = (max_pixels / float(width * height)) ** 0.5
+    return image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+
+def encode_image_payload(image_path: str, profile_name: str, max_pixels: Optional[int] = None) -> tuple[str, str]:
+    """
+    Downscales and encodes a page image for a remote provider, to at most
+    max_pixels if given (e.g. the requested resized size) and the profile's budget.
+    Returns (mime_type, base64_data); results are cached per page, profile and budget.
+    """
+    profile = PAYLOAD_PROFILES[profile_name]
+    budget = min(profile['max_pixels'], max_pixels) if max_pixels else profile['max_pixels']
+    stat = os.stat(image_path)
+    key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, profile_name, budget)
+
+    with _payload_cache_lock:
+        if key in _payload_cache:
+            _payload_cache.move_to_end(key)
+            return _payload_cache[key]
+
+    with Image.open(image_path) as image:
+        image = _fit_to_budget(image.convert('RGB'), budget)
+        img_bytes = io.BytesIO()
+        image.save(img_bytes, format=profile['format'], quality=profile['quality'])
+    payload = (MIME_TYPES[profile['format']], base64.b64encode(img_bytes.getvalue()).decode())
+
+    with _payload_cache_lock:
+        _payload_cache[key] = payload
+        while len(_payload_cache) > _PAYLOAD_CACHE_SIZE:
+            _payload_cache.popitem(last=False)
+    return payload
@@ -1,12 +1,18 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
 from fastapi import UploadFile
-from byaldi import RAGMultiModalModel
 from .converter import convert_docs_to_pdfs
+from .tracing import span
 from .logger import get_logger
 import os
 import re
 import unicodedata
 from fastapi import HTTPException
 
+if TYPE_CHECKING:
+    from byaldi import RAGMultiModalModel
+
 logger = get_logger(__name__)
 
 def secure_filename(filename):
@@ -50,20 +56,25 @@ async def index_documents(
             raise HTTPException(status_code=400, detail="No valid files uploaded")
         
         # Convert documents if needed
-        await convert_docs_to_pdfs(files, folder_path)
+        with span("convert"):
+            await convert_docs_to_pdfs(files, folder_path)
         
         # Initialize RAG model
-        RAG = RAGMultiModalModel.from_pretrained(indexer_model)
+        # byaldi pulls in torch and colpali; import it on first indexing
+        from byaldi import RAGMultiModalModel
+        with span("load_indexer", model_choice=indexer_model):
+            RAG = RAGMultiModalModel.from_pretrained(indexer_model)
         if RAG is None:
             raise ValueError(f"Failed to initialize RAG model with {indexer_model}")
             
         # Index documents
-        RAG.index(
-            input_path=folder_path,
-            index_name=session_id,
-            store_collection_with_index=True,
-            overwrite=True
-        )
+        with span("index", model_choice=indexer_model):
+            RAG.index(
+                input_path=folder_path,
+                index_name=session_id,
+                store_collection_with_index=True,
+                overwrite=True
+            )
         
         logger.info(f"Indexing completed for session {session_id}")
         return RAG
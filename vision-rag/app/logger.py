@@ -1,33 +1,144 @@
+import atexit
+import copy
+import json
 import logging
+import os
+import queue
+import random
 import sys
-from logging.handlers import RotatingFileHandler
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Callable, Optional
+
+# Console and file output; the file rotates at LOG_FILE_MAX_BYTES
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.getenv("LOG_FILE", "app.log")
+LOG_FILE_LEVEL = os.getenv("LOG_FILE_LEVEL", "INFO").upper()
+LOG_FILE_MAX_BYTES = int(os.getenv("LOG_FILE_MAX_BYTES", 50 * 1024 * 1024))
+LOG_FILE_BACKUPS = int(os.getenv("LOG_FILE_BACKUPS", 5))
+# "text" or "json" (one JSON object per line)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+def _parse_module_settings(value: str, convert: Callable) -> dict:
+    # "app.retriever=WARNING,app=INFO" -> {"app.retriever": ..., "app": ...}
+    settings = {}
+    for pair in value.split(","):
+        if "=" in pair:
+            module, setting = pair.split("=", 1)
+            settings[module.strip()] = convert(setting.strip())
+    return settings
+
+# Per-module levels, e.g. LOG_LEVELS="app.retriever=WARNING,app.tracing=DEBUG"
+LOG_LEVELS = _parse_module_settings(os.getenv("LOG_LEVELS", ""), str.upper)
+# Fraction of INFO/DEBUG records kept per module, e.g. LOG_SAMPLING="app.retriever=0.1";
+# warnings and errors are never dropped
+LOG_SAMPLING = _parse_module_settings(os.getenv("LOG_SAMPLING", ""), float)
+
+_TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_queue_handler: Optional[QueueHandler] = None
+_setup_lock = threading.Lock()
+
+def _module_setting(name: str, settings: dict):
+    """Returns the setting for the most specific module prefix of a logger name, or None."""
+    while name:
+        if name in settings:
+            return settings[name]
+        name = name.rpartition(".")[0]
+    return None
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON objects."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class _RecordQueueHandler(QueueHandler):
+    """Queues records with message and traceback rendered; the listener does the final formatting."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class SamplingFilter(logging.Filter):
+    """Keeps a configured fraction of INFO and DEBUG records per module."""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+        self._cache: dict = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        if record.name not in self._cache:
+            self._cache[record.name] = _module_setting(record.name, self.rates)
+        rate = self._cache[record.name]
+        return rate is None or random.random() < rate
+
+def _setup() -> QueueHandler:
+    """
+    Starts the background listener that owns the console and file handlers, so
+    a log call only costs an enqueue on the request path.
+    """
+    global _queue_handler
+    with _setup_lock:
+        if _queue_handler is not None:
+            return _queue_handler
+
+        formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(_TEXT_FORMAT)
 
-def get_logger(name):
-    logger = logging.getLogger(name)
-    
-    if not logger.handlers:
-        logger.setLevel(logging.INFO)
-        
         # Console Handler
         console_handler = logging.StreamHandler(sys.stdout)
-        console_handler.setLevel(logging.INFO)
-        console_formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        console_handler.setFormatter(console_formatter)
-        logger.addHandler(console_handler)
-        
+        console_handler.setLevel(LOG_LEVEL)
+        console_handler.setFormatter(formatter)
+
         # File Handler
         file_handler = RotatingFileHandler(
-            'app.log',
-            maxBytes=1024 * 1024,  # 1MB
-            backupCount=5
-        )
-        file_handler.setLevel(logging.INFO)
-        file_formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+            LOG_FILE,
+            maxBytes=LOG_FILE_MAX_BYTES,
+            backupCount=LOG_FILE_BACKUPS
         )
-        file_handler.setFormatter(file_formatter)
-        logger.addHandler(file_handler)
-    
-    return logger 
\ No newline at end of file
+        file_handler.setLevel(LOG_FILE_LEVEL)
+        file_handler.setFormatter(formatter)
+
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+        listener.start()
+        # Drain the queue before the interpreter exits
+        atexit.register(listener.stop)
+
+        _queue_handler = _RecordQueueHandler(log_queue)
+        _queue_handler.addFilter(SamplingFilter(LOG_SAMPLING))
+        return _queue_handler
+
+def get_logger(name):
+    logger = logging.getLogger(name)
+
+    if not logger.handlers:
+        # Records below every handler's level are dropped before they are queued
+        level = _module_setting(name, LOG_LEVELS)
+        if level is None:
+            level = min(logging.getLevelName(LOG_LEVEL), logging.getLevelName(LOG_FILE_LEVEL))
+        logger.setLevel(level)
+        logger.addHandler(_setup())
+
+    return logger
@@ -1,18 +1,22 @@
 # Similar to original but with async support
 from fastapi import HTTPException
-import torch
-from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
+import asyncio
+import time
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
 from .logger import get_logger
 
 load_dotenv()
 logger = get_logger(__name__)
 
 _model_cache = {}
+# In-flight loads per model and total time callers spent waiting on them
+_inflight_loads: dict[str, asyncio.Future] = {}
+load_wait_seconds: dict[str, float] = {}
 
 def detect_device():
+    import torch
+
     if torch.cuda.is_available():
         return 'cuda'
     elif torch.backends.mps.is_available():
@@ -20,15 +24,19 @@ def detect_device():
     else:
         return 'cpu'
 
-async def load_model(model_choice: str):
+def _load_model_sync(model_choice: str):
     """
-    Asynchronously loads and caches AI models.
+    Loads and caches a model; blocking, so callers run it in a worker thread.
     """
     if model_choice in _model_cache:
         return _model_cache[model_choice]
 
     try:
+        # torch/transformers and the provider SDKs are imported on first load to keep startup fast
         if model_choice == 'qwen':
+            import torch
+            from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
+
             device = detect_device()
             model = Qwen2VLForConditionalGeneration.from_pretrained(
                 "Qwen/Qwen2-VL-7B-Instruct",
@@ -43,6 +51,7 @@ async def load_model(model_choice: str):
             api_key = os.getenv("GOOGLE_API_KEY")
             if not api_key:
                 raise HTTPException(status_code=500, detail="GOOGLE_API_KEY not found")
+            import google.generativeai as genai
             genai.configure(api_key=api_key)
             model = genai.GenerativeModel('gemini-1.5-flash-002')
             _model_cache[model_choice] = (model, None, None)
@@ -55,6 +64,13 @@ async def load_model(model_choice: str):
             client = OpenAI(api_key=api_key)
             _model_cache[model_choice] = (client, None, None)
             
+        elif model_choice == 'ollama':
+            from .ollama_client import OllamaClient
+            # The daemon holds the weights; loading only warms it and keeps it alive
+            client = OllamaClient()
+            client.load()
+            _model_cache[model_choice] = (client, None, None)
+
         elif model_choice == 'llama':
             # Add Llama model implementation
             pass
@@ -72,4 +88,28 @@ async def load_model(model_choice: str):
         
     except Exception as e:
         logger.error(f"Error loading model {model_choice}: {e}")
-        raise HTTPException(status_code=500, detail=f"Error loading model: {str(e)}") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error loading model: {str(e)}") 
+
+async def load_model(model_choice: str):
+    """
+    Asynchronously loads and caches AI models.
+    Concurrent callers for the same model share a single in-flight load.
+    """
+    if model_choice in _model_cache:
+        return _model_cache[model_choice]
+
+    task = _inflight_loads.get(model_choice)
+    if task is not None:
+        start_time = time.perf_counter()
+        try:
+            return await asyncio.shield(task)
+        finally:
+            waited = time.perf_counter() - start_time
+            load_wait_seconds[model_choice] = load_wait_seconds.get(model_choice, 0.0) + waited
+            logger.info(f"Waited {waited:.1f}s for in-flight load of model {model_choice}")
+
+    # Model loading blocks for minutes; keep it off the event loop
+    task = asyncio.ensure_future(asyncio.to_thread(_load_model_sync, model_choice))
+    _inflight_loads[model_choice] = task
+    task.add_done_callback(lambda _: _inflight_loads.pop(model_choice, None))
+    return await asyncio.shield(task)
@@ -0,0 +1,88 @@
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Iterator
+import json
+import os
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# Local Ollama daemon used by the 'ollama' model choice
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434").rstrip('/')
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2-vision")
+# How long the daemon keeps the model loaded after a request, e.g. "30m", "-1" (forever)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", 300))
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", 8))
+OLLAMA_MAX_TOKENS = int(os.getenv("OLLAMA_MAX_TOKENS", 512))
+
+class OllamaError(RuntimeError):
+    """Raised when the Ollama daemon reports an error."""
+
+class OllamaClient:
+    """
+    Ollama HTTP client with a pooled session; every request carries keep_alive
+    so the daemon keeps the model loaded between questions. Blocking, so call
+    it via asyncio.to_thread.
+    """
+
+    def __init__(self, host: str = OLLAMA_HOST, model: str = OLLAMA_MODEL,
+                 keep_alive: str = OLLAMA_KEEP_ALIVE, timeout: float = OLLAMA_TIMEOUT):
+        self.host = host
+        self.model = model
+        # Ollama takes durations as strings and plain seconds as numbers
+        self.keep_alive = int(keep_alive) if keep_alive.lstrip('-').isdigit() else keep_alive
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=OLLAMA_POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _post(self, path: str, payload: dict, stream: bool = False) -> requests.Response:
+        response = self.session.post(f"{self.host}{path}", json=payload, stream=stream, timeout=self.timeout)
+        if response.status_code >= 400:
+            try:
+                message = response.json().get('error', response.text)
+            except ValueError:
+                message = response.text
+            response.close()
+            raise OllamaError(f"Ollama returned {response.status_code}: {message}")
+        return response
+
+    def load(self):
+        """Loads the model into the daemon's memory without generating."""
+        self._post('/api/generate', {'model': self.model, 'keep_alive': self.keep_alive}).close()
+        logger.info(f"Ollama model {self.model} loaded (keep_alive={self.keep_alive})")
+
+    def unload(self):
+        """Asks the daemon to release the model's memory now."""
+        self._post('/api/generate', {'model': self.model, 'keep_alive': 0}).close()
+
+    def _chat_payload(self, query: str, images: list[str], stream: bool) -> dict:
+        return {
+            'model': self.model,
+            'messages': [{'role': 'user', 'content': query, 'images': images}],
+            'stream': stream,
+            'keep_alive': self.keep_alive,
+            'options': {'num_predict': OLLAMA_MAX_TOKENS},
+        }
+
+    def chat(self, query: str, images: list[str]) -> str:
+        """Generates a complete answer; images are base64-encoded pages."""
+        with self._post('/api/chat', self._chat_payload(query, images, stream=False)) as response:
+            return response.json()['message']['content']
+
+    def chat_stream(self, query: str, images: list[str]) -> Iterator[str]:
+        """Yields the answer in chunks as the daemon generates it."""
+        with self._post('/api/chat', self._chat_payload(query, images, stream=True), stream=True) as response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if 'error' in chunk:
+                    raise OllamaError(chunk['error'])
+                content = chunk.get('message', {}).get('content')
+                if content:
+                    yield content
+                if chunk.get('done'):
+                    return
@@ -0,0 +1,77 @@
+from PIL import Image
+import asyncio
+import os
+import tempfile
+import time
+from .model_loader import load_model
+from .responder import generate_qwen
+from .worker_client import worker_enabled, worker_status, WORKER_MODELS
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# Comma-separated models to load at startup, e.g. PRELOAD_GENERATION_MODELS="qwen"
+PRELOAD_GENERATION_MODELS = [m.strip() for m in os.getenv("PRELOAD_GENERATION_MODELS", "").split(',') if m.strip()]
+PRELOAD_INDEXER_MODELS = [m.strip() for m in os.getenv("PRELOAD_INDEXER_MODELS", "").split(',') if m.strip()]
+PRELOAD_WARMUP = os.getenv("PRELOAD_WARMUP", "true").lower() == "true"
+
+LOCAL_GENERATION_MODELS = {'qwen'}
+
+model_states: dict[str, dict] = {}
+
+def _warmup_page() -> str:
+    path = os.path.join(tempfile.gettempdir(), "vision-rag-warmup.png")
+    if not os.path.exists(path):
+        Image.new('RGB', (280, 280), 'white').save(path)
+    return path
+
+async def _preload_generation_model(model_choice: str):
+    if worker_enabled() and model_choice in WORKER_MODELS:
+        # The shared model worker owns local models; only check that it answers
+        model_states[model_choice].update(state='loading', served_by='model-worker')
+        await asyncio.to_thread(worker_status)
+        return
+    model_states[model_choice]['state'] = 'loading'
+    model_data = await load_model(model_choice)
+    if PRELOAD_WARMUP and model_choice in LOCAL_GENERATION_MODELS:
+        model_states[model_choice]['state'] = 'warming'
+        # Off the event loop, so /health and /ready keep answering; raises if the generation fails
+        await asyncio.to_thread(generate_qwen, model_data, [_warmup_page()], "Describe this page.", 280, 280)
+
+async def _preload_indexer_model(indexer_model: str):
+    from byaldi import RAGMultiModalModel
+    # Downloads the weights and warms the disk cache for the first upload
+    model_states[indexer_model]['state'] = 'loading'
+    await asyncio.to_thread(RAGMultiModalModel.from_pretrained, indexer_model)
+
+async def preload_models():
+    """
+    Loads and warms the configured models one after another.
+    """
+    jobs = [(name, _preload_generation_model) for name in PRELOAD_GENERATION_MODELS]
+    jobs += [(name, _preload_indexer_model) for name in PRELOAD_INDEXER_MODELS]
+    for name, preload in jobs:
+        start_time = time.perf_counter()
+        try:
+            await preload(name)
+            model_states[name].update(state='ready', seconds=round(time.perf_counter() - start_time, 2))
+            logger.info(f"Preloaded '{name}' in {time.perf_counter() - start_time:.1f}s")
+        except Exception as e:
+            model_states[name].update(state='failed', error=str(e))
+            logger.error(f"Error preloading '{name}': {e}")
+
+def start_preloading() -> asyncio.Task | None:
+    """
+    Schedules background preloading on the running event loop.
+    """
+    for name in PRELOAD_GENERATION_MODELS:
+        model_states[name] = {'kind': 'generation', 'state': 'pending'}
+    for name in PRELOAD_INDEXER_MODELS:
+        model_states[name] = {'kind': 'indexer', 'state': 'pending'}
+    if not model_states:
+        return None
+    logger.info(f"Preloading models in background: {list(model_states)}")
+    return asyncio.create_task(preload_models())
+
+def is_ready() -> bool:
+    return all(state['state'] == 'ready' for state in model_states.values())
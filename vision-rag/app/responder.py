@@ -1,13 +1,36 @@
 from fastapi import HTTPException
 from PIL import Image
 from .model_loader import load_model
-import base64
+from .image_encoder import encode_image_payload
+from .worker_client import worker_enabled, generate_via_worker, WORKER_MODELS
+from typing import AsyncIterator
+import asyncio
 import os
+import threading
+from .tracing import span
 from .logger import get_logger
-from io import BytesIO
 
 logger = get_logger(__name__)
 
+def _ollama_images(images: list[str], max_pixels: int) -> list[str]:
+    return [encode_image_payload(img_path, 'ollama', max_pixels)[1] for img_path in images]
+
+def generate_qwen(model_data: tuple, images: list[str], query: str, resized_height: int, resized_width: int) -> str:
+    """Runs a blocking Qwen generation on already validated page images."""
+    model, processor, device = model_data
+    processed_images = []
+    for img_path in images:
+        image = Image.open(img_path)
+        image = image.resize((resized_width, resized_height))
+        processed_images.append(image)
+    inputs = processor(
+        text=query,
+        images=processed_images,
+        return_tensors="pt"
+    ).to(device)
+    output = model.generate(**inputs, max_new_tokens=512)
+    return processor.decode(output[0], skip_special_tokens=True)
+
 async def generate_response(
     images: list[str],
     query: str,
@@ -19,73 +42,133 @@ async def generate_response(
     """
     Generates response using the selected model.
     """
-    try:
-        logger.info(f"Generating response using model '{model_choice}'")
+    with span("generate", model_choice=model_choice):
+        try:
+            logger.info(f"Generating response using model '{model_choice}'")
         
-        # Validate images
-        valid_images = [img for img in images if os.path.exists(img)]
-        if not valid_images:
-            raise HTTPException(status_code=400, detail="No valid images found")
+            # Validate images
+            valid_images = [img for img in images if os.path.exists(img)]
+            if not valid_images:
+                raise HTTPException(status_code=400, detail="No valid images found")
             
-        # Load model
-        model_data = await load_model(model_choice)
-        
-        # Process images
-        processed_images = []
-        for img_path in valid_images:
-            image = Image.open(img_path)
-            image = image.resize((resized_width, resized_height))
-            processed_images.append(image)
+            # Local models are served by the shared model worker when one is configured
+            if worker_enabled() and model_choice in WORKER_MODELS:
+                response_text = await asyncio.to_thread(
+                    generate_via_worker, valid_images, query, model_choice, resized_height, resized_width
+                )
+                logger.info(f"Response generated for session {session_id}")
+                return response_text
+
+            # Remote payloads are no larger than the requested page size
+            max_pixels = resized_height * resized_width
+
+            # Load model
+            model_data = await load_model(model_choice)
         
-        # Generate response based on model type
-        if model_choice == 'qwen':
-            model, processor, device = model_data
-            inputs = processor(
-                text=query,
-                images=processed_images,
-                return_tensors="pt"
-            ).to(device)
-            output = model.generate(**inputs, max_new_tokens=512)
-            response_text = processor.decode(output[0], skip_special_tokens=True)
+            # Generate response based on model type
+            if model_choice == 'qwen':
+                response_text = generate_qwen(model_data, valid_images, query, resized_height, resized_width)
             
-        elif model_choice == 'gemini':
-            model, _, _ = model_data
-            contents = [{"text": query}]
-            for img in processed_images:
-                img_bytes = BytesIO()
-                img.save(img_bytes, format='PNG')
-                contents.append({
-                    "inline_data": {
-                        "mime_type": "image/png",
-                        "data": base64.b64encode(img_bytes.getvalue()).decode()
-                    }
-                })
-            response = model.generate_content(contents)
-            response_text = response.text
+            elif model_choice == 'gemini':
+                model, _, _ = model_data
+                contents = [{"text": query}]
+                for img_path in valid_images:
+                    mime_type, data = encode_image_payload(img_path, 'gemini', max_pixels)
+                    contents.append({
+                        "inline_data": {
+                            "mime_type": mime_type,
+                            "data": data
+                        }
+                    })
+                response = model.generate_content(contents)
+                response_text = response.text
             
-        elif model_choice == 'gpt4':
-            client, _, _ = model_data
-            messages = [{"role": "user", "content": [{"type": "text", "text": query}]}]
-            for img in processed_images:
-                img_bytes = BytesIO()
-                img.save(img_bytes, format='PNG')
-                base64_image = base64.b64encode(img_bytes.getvalue()).decode()
-                messages[0]["content"].append({
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{base64_image}"}
-                })
-            response = client.chat.completions.create(
-                model="gpt-4-vision-preview",
-                messages=messages,
-                max_tokens=500
-            )
-            response_text = response.choices[0].message.content
+            elif model_choice == 'gpt4':
+                client, _, _ = model_data
+                messages = [{"role": "user", "content": [{"type": "text", "text": query}]}]
+                for img_path in valid_images:
+                    mime_type, data = encode_image_payload(img_path, 'gpt4', max_pixels)
+                    messages[0]["content"].append({
+                        "type": "image_url",
+                        "image_url": {"url": f"data:{mime_type};base64,{data}"}
+                    })
+                response = client.chat.completions.create(
+                    model="gpt-4-vision-preview",
+                    messages=messages,
+                    max_tokens=500
+                )
+                response_text = response.choices[0].message.content
             
-        # Add other model implementations as needed
+            elif model_choice == 'ollama':
+                client, _, _ = model_data
+                response_text = await asyncio.to_thread(client.chat, query, _ollama_images(valid_images, max_pixels))
+
+            # Add other model implementations as needed
         
-        logger.info(f"Response generated for session {session_id}")
-        return response_text
+            logger.info(f"Response generated for session {session_id}")
+            return response_text
         
+        except Exception as e:
+            logger.error(f"Error generating response: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+async def generate_response_stream(
+    images: list[str],
+    query: str,
+    session_id: str,
+    resized_height: int = 280,
+    resized_width: int = 280,
+    model_choice: str = 'qwen'
+) -> AsyncIterator[str]:
+    """
+    Starts generating a response and returns an async iterator of its chunks.
+
+    Validation, model loading and the first chunk happen before this returns,
+    so failures raise HTTPException while an error status can still be sent.
+    Models without streaming support yield the whole response as one chunk.
+    Closing the iterator early (a client disconnect) closes the upstream
+    Ollama stream.
+    """
+    if model_choice != 'ollama':
+        response_text = await generate_response(images, query, session_id, resized_height, resized_width, model_choice)
+
+        async def whole():
+            yield response_text
+        return whole()
+
+    valid_images = [img for img in images if os.path.exists(img)]
+    if not valid_images:
+        raise HTTPException(status_code=400, detail="No valid images found")
+    client, _, _ = await load_model(model_choice)
+    chunks = client.chat_stream(query, _ollama_images(valid_images, resized_height * resized_width))
+    # The blocking stream is advanced in worker threads; the lock keeps close() from racing a pending next()
+    lock = threading.Lock()
+    done = object()
+
+    def pull():
+        with lock:
+            return next(chunks, done)
+
+    def close():
+        with lock:
+            chunks.close()
+
+    try:
+        first = await asyncio.to_thread(pull)
     except Exception as e:
         logger.error(f"Error generating response: {e}")
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def stream():
+        chunk = first
+        try:
+            with span("generate_stream", model_choice=model_choice):
+                # Pull each chunk off the blocking HTTP stream without stalling the event loop
+                while chunk is not done:
+                    yield chunk
+                    chunk = await asyncio.to_thread(pull)
+            logger.info(f"Streamed response generated for session {session_id}")
+        finally:
+            # Not awaited: a cancelled pull may still be running, and close() waits for it
+            asyncio.get_running_loop().run_in_executor(None, close)
+    return stream()
@@ -4,6 +4,8 @@ from io import BytesIO
 import base64
 import os
 import hashlib
+from .disk_gc import mark_page_used
+from .tracing import span
 from .logger import get_logger
 
 logger = get_logger(__name__)
@@ -20,7 +22,8 @@ async def retrieve_documents(
     try:
         logger.info(f"Retrieving documents for query: {query}")
         
-        results = RAG.search(query, k=k)
+        with span("search"):
+            results = RAG.search(query, k=k)
         images = []
         session_images_folder = os.path.join('uploaded_documents', session_id, 'images')
         os.makedirs(session_images_folder, exist_ok=True)
@@ -28,16 +31,22 @@ async def retrieve_documents(
         for result in results:
             if result.base64:
                 # Process and save image
-                image_data = base64.b64decode(result.base64)
-                image = Image.open(BytesIO(image_data))
+                with span("decode_image"):
+                    image_data = base64.b64decode(result.base64)
+                    image = Image.open(BytesIO(image_data))
                 
                 # Generate unique filename
                 image_hash = hashlib.md5(image_data).hexdigest()
                 image_filename = f"retrieved_{image_hash}.png"
                 image_path = os.path.join(session_images_folder, image_filename)
                 
-                if not os.path.exists(image_path):
-                    image.save(image_path, format='PNG')
+                with span("save_image", cache="hit" if os.path.exists(image_path) else "miss"):
+                    if not os.path.exists(image_path):
+                        image.save(image_path, format='PNG')
+                    else:
+                        # Mark the page as recently used for the disk GC; touching the
+                        # file instead would invalidate its cached remote payloads
+                        mark_page_used(image_path)
                     
                 images.append(image_path)
                 
@@ -0,0 +1,437 @@
+from datetime import datetime
+from typing import Callable, Optional
+import atexit
+import bisect
+import json
+import os
+import sqlite3
+import threading
+import time
+from .tracing import span
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# Seconds between compactions (WAL checkpoint, plus VACUUM once enough pages are free); 0 disables
+SESSION_COMPACT_INTERVAL = float(os.getenv("SESSION_COMPACT_INTERVAL", 600))
+SESSION_VACUUM_FREE_RATIO = float(os.getenv("SESSION_VACUUM_FREE_RATIO", 0.25))
+# 'full' (commit and fsync every write), 'normal' (commit every write, fsync at
+# checkpoints) or 'write-behind' (queue appends, commit every SESSION_FLUSH_INTERVAL seconds)
+SESSION_DURABILITY = os.getenv("SESSION_DURABILITY", "normal").lower()
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", 0.5))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_created ON sessions (created_at);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    images TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id);
+
+CREATE TABLE IF NOT EXISTS indexed_files (
+    session_id TEXT NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    filename TEXT NOT NULL,
+    indexed_at REAL NOT NULL,
+    PRIMARY KEY (session_id, filename)
+);
+
+-- Bumped by every session create/rename/delete so cached indexes can detect
+-- changes made by other processes
+CREATE TABLE IF NOT EXISTS sessions_version (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO sessions_version (id, version) VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS sessions_version_insert AFTER INSERT ON sessions
+BEGIN UPDATE sessions_version SET version = version + 1; END;
+CREATE TRIGGER IF NOT EXISTS sessions_version_rename AFTER UPDATE OF name ON sessions
+BEGIN UPDATE sessions_version SET version = version + 1; END;
+CREATE TRIGGER IF NOT EXISTS sessions_version_delete AFTER DELETE ON sessions
+BEGIN UPDATE sessions_version SET version = version + 1; END;
+"""
+
+def _sort_key(session_id: str, name: str) -> tuple[str, str]:
+    return (name.casefold(), session_id)
+
+def _sessions_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT version FROM sessions_version").fetchone()[0]
+
+class SessionIndex:
+    """In-memory session ids and names sorted by name; pages are list slices."""
+
+    def __init__(self, sessions: list[dict], version: int):
+        self.version = version
+        self._names = {s["id"]: s["name"] for s in sessions}
+        self._sorted = sorted(_sort_key(session_id, name) for session_id, name in self._names.items())
+
+    def __len__(self) -> int:
+        return len(self._sorted)
+
+    def put(self, session_id: str, name: str):
+        self.remove(session_id)
+        self._names[session_id] = name
+        bisect.insort(self._sorted, _sort_key(session_id, name))
+
+    def remove(self, session_id: str):
+        name = self._names.pop(session_id, None)
+        if name is not None:
+            del self._sorted[bisect.bisect_left(self._sorted, _sort_key(session_id, name))]
+
+    def page(self, offset: int, limit: int) -> list[dict]:
+        return [{"id": session_id, "name": self._names[session_id]}
+                for _, session_id in self._sorted[offset:offset + limit]]
+
+def _timestamp(value: Optional[str], default: float) -> float:
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return default
+
+def _message_rows(session_id: str, messages: list[dict], default_time: float) -> list[tuple]:
+    return [(session_id, message["role"], message["content"],
+             json.dumps(message["images"]) if message.get("images") else None,
+             _timestamp(message.get("timestamp"), default_time))
+            for message in messages]
+
+def _insert_message_rows(conn: sqlite3.Connection, rows: list[tuple]):
+    # Queued appends for a session deleted in the meantime are dropped
+    conn.executemany(
+        "INSERT INTO messages (session_id, role, content, images, created_at) "
+        "SELECT ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM sessions WHERE id = ?)",
+        [row + (row[0],) for row in rows],
+    )
+
+def _insert_indexed_files(conn: sqlite3.Connection, session_id: str, filenames: list[str], indexed_at: float):
+    conn.executemany(
+        "INSERT OR IGNORE INTO indexed_files (session_id, filename, indexed_at) VALUES (?, ?, ?)",
+        [(session_id, filename, indexed_at) for filename in filenames],
+    )
+
+class SessionStore:
+    """
+    SQLite (WAL) store for session metadata, chat messages and indexed files.
+    Chat history is an append-only log of message rows, periodically compacted
+    in the background. Each thread uses its own connection. In 'write-behind'
+    mode appends are queued and flushed in one transaction per interval; reads
+    of a session flush its pending messages first.
+    """
+
+    def __init__(self, db_path: str, compact_interval: float = SESSION_COMPACT_INTERVAL,
+                 durability: str = SESSION_DURABILITY, flush_interval: float = SESSION_FLUSH_INTERVAL):
+        if durability not in ("full", "normal", "write-behind"):
+            raise ValueError(f"Unknown session durability mode: {durability}")
+        self.db_path = db_path
+        self.compact_interval = compact_interval
+        self.durability = durability
+        self.flush_interval = flush_interval
+        self._session_locks: dict[str, threading.RLock] = {}
+        self._session_locks_lock = threading.Lock()
+        self._pending: list[tuple] = []
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_wakeup = threading.Event()
+        self._local = threading.local()
+        self._compact_lock = threading.Lock()
+        self._last_compaction = time.monotonic()
+        self._index: Optional[SessionIndex] = None
+        self._index_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+        if durability == "write-behind":
+            threading.Thread(target=self._flush_loop, name="session-flush", daemon=True).start()
+            atexit.register(self.flush)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL" if self.durability == "full" else "PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def create_session(self, session_id: str, name: str) -> dict:
+        """Creates the session if it does not exist and returns its metadata."""
+        now = datetime.now().timestamp()
+        with self._connect() as conn:
+            cursor = conn.execute("INSERT OR IGNORE INTO sessions (id, name, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                                  (session_id, name, now, now))
+            if cursor.rowcount:
+                version = _sessions_version(conn)
+        if cursor.rowcount:
+            self._update_index(version, lambda index: index.put(session_id, name))
+        return self.get_session(session_id)
+
+    def get_session(self, session_id: str) -> Optional[dict]:
+        row = self._connect().execute("SELECT id, name, created_at, updated_at FROM sessions WHERE id = ?",
+                                      (session_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "name": row["name"],
+            "created_at": datetime.fromtimestamp(row["created_at"]).isoformat(),
+            "updated_at": datetime.fromtimestamp(row["updated_at"]).isoformat(),
+        }
+
+    def list_sessions(self, offset: int = 0, limit: Optional[int] = None) -> list[dict]:
+        """Returns a page of sessions sorted by name, from the in-memory index."""
+        index = self._current_index()
+        return index.page(offset, len(index) if limit is None else limit)
+
+    def count_sessions(self) -> int:
+        return len(self._current_index())
+
+    def session_ids_by_activity(self) -> list[str]:
+        """Returns all session ids, least recently updated first."""
+        rows = self._connect().execute("SELECT id FROM sessions ORDER BY updated_at, id").fetchall()
+        return [row["id"] for row in rows]
+
+    def _current_index(self) -> SessionIndex:
+        """Returns the session index, rebuilding it if the sessions version moved (e.g. another process wrote)."""
+        conn = self._connect()
+        version = _sessions_version(conn)
+        with self._index_lock:
+            if self._index is None or self._index.version != version:
+                rows = conn.execute("SELECT id, name FROM sessions").fetchall()
+                self._index = SessionIndex([dict(row) for row in rows], version)
+            return self._index
+
+    def _update_index(self, version: int, change: Callable[[SessionIndex], None]):
+        """Applies this process's own write; drops the index if another write happened in between."""
+        with self._index_lock:
+            if self._index is None:
+                return
+            if self._index.version == version - 1:
+                change(self._index)
+                self._index.version = version
+            else:
+                self._index = None
+
+    def session_lock(self, session_id: str) -> threading.RLock:
+        """Lock serializing read-then-write updates of one session."""
+        with self._session_locks_lock:
+            return self._session_locks.setdefault(session_id, threading.RLock())
+
+    def rename_session(self, session_id: str, name: str) -> bool:
+        """Returns False if the session does not exist."""
+        with self.session_lock(session_id), self._connect() as conn:
+            cursor = conn.execute("UPDATE sessions SET name = ?, updated_at = ? WHERE id = ?",
+                                  (name, datetime.now().timestamp(), session_id))
+            if cursor.rowcount:
+                version = _sessions_version(conn)
+        if cursor.rowcount:
+            self._update_index(version, lambda index: index.put(session_id, name))
+        return cursor.rowcount > 0
+
+    def delete_session(self, session_id: str):
+        """Deletes the session with its messages and indexed files."""
+        with self._pending_lock:
+            self._pending = [row for row in self._pending if row[0] != session_id]
+        with self.session_lock(session_id), self._connect() as conn:
+            cursor = conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            if cursor.rowcount:
+                version = _sessions_version(conn)
+        if cursor.rowcount:
+            self._update_index(version, lambda index: index.remove(session_id))
+        with self._session_locks_lock:
+            self._session_locks.pop(session_id, None)
+
+    def get_messages(self, session_id: str, limit: Optional[int] = None,
+                     before_id: Optional[int] = None) -> list[dict]:
+        """
+        Returns the most recent messages (all if limit is None), oldest first;
+        before_id pages back past an already loaded message.
+        """
+        self._flush_session(session_id)
+        query = "SELECT id, role, content, images, created_at FROM messages WHERE session_id = ?"
+        params = [session_id]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        query += " ORDER BY id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with span("session_read"):
+            rows = self._connect().execute(query, params).fetchall()
+            messages = []
+            for row in reversed(rows):
+                message = {"id": row["id"], "role": row["role"], "content": row["content"],
+                           "timestamp": datetime.fromtimestamp(row["created_at"]).isoformat()}
+                if row["images"]:
+                    message["images"] = json.loads(row["images"])
+                messages.append(message)
+            return messages
+
+    def latest_message_id(self, session_id: str, before_id: Optional[int] = None) -> Optional[int]:
+        """Returns the newest message id (older than before_id, if given); it changes only on append."""
+        self._flush_session(session_id)
+        query = "SELECT MAX(id) FROM messages WHERE session_id = ?"
+        params = [session_id]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        return self._connect().execute(query, params).fetchone()[0]
+
+    def add_messages(self, session_id: str, messages: list[dict]):
+        """Appends messages (role, content, optional images and timestamp) to an existing session."""
+        rows = _message_rows(session_id, messages, datetime.now().timestamp())
+        if self.durability == "write-behind":
+            with self._pending_lock:
+                self._pending.extend(rows)
+            self._flush_wakeup.set()
+            return
+        self._write_messages(rows)
+
+    def add_exchange(self, session_id: str, messages: list[dict], session_name: str):
+        """Appends a question and its answer, creating the session if needed."""
+        with span("session_write"), self.session_lock(session_id):
+            self.create_session(session_id, session_name)
+            self.add_messages(session_id, messages)
+
+    def _write_messages(self, rows: list[tuple]):
+        latest: dict[str, float] = {}
+        for row in rows:
+            latest[row[0]] = max(row[4], latest.get(row[0], 0))
+        with self._connect() as conn:
+            _insert_message_rows(conn, rows)
+            conn.executemany("UPDATE sessions SET updated_at = ? WHERE id = ?",
+                             [(created_at, session_id) for session_id, created_at in latest.items()])
+        self._maybe_compact()
+
+    def flush(self):
+        """Commits all queued appends in one transaction."""
+        with self._flush_lock:
+            with self._pending_lock:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return
+            try:
+                self._write_messages(rows)
+            except sqlite3.Error:
+                # Keep the messages queued, ahead of newer ones, for the next flush
+                with self._pending_lock:
+                    self._pending[:0] = rows
+                raise
+
+    def _flush_session(self, session_id: str):
+        with self._pending_lock:
+            pending = any(row[0] == session_id for row in self._pending)
+        if pending:
+            self.flush()
+
+    def _flush_loop(self):
+        while True:
+            self._flush_wakeup.wait()
+            # Let a burst of appends accumulate so it is committed at once
+            time.sleep(self.flush_interval)
+            self._flush_wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.error(f"Error flushing session writes, will retry: {e}")
+                self._flush_wakeup.set()
+
+    def get_indexed_files(self, session_id: str) -> list[str]:
+        rows = self._connect().execute(
+            "SELECT filename FROM indexed_files WHERE session_id = ? ORDER BY rowid", (session_id,)
+        ).fetchall()
+        return [row["filename"] for row in rows]
+
+    def add_indexed_files(self, session_id: str, filenames: list[str]):
+        with self._connect() as conn:
+            _insert_indexed_files(conn, session_id, filenames, datetime.now().timestamp())
+
+    def compact(self):
+        """Runs VACUUM if enough pages are free, then checkpoints and truncates the WAL."""
+        with self._compact_lock:
+            conn = self._connect()
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if page_count and free_pages / page_count >= SESSION_VACUUM_FREE_RATIO:
+                conn.execute("VACUUM")
+                logger.info(f"Vacuumed session database ({free_pages} of {page_count} pages were free)")
+            busy = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0]
+            self._last_compaction = time.monotonic()
+            if busy:
+                logger.warning("Session database checkpoint was blocked by active readers")
+
+    def _maybe_compact(self):
+        if self.compact_interval <= 0 or time.monotonic() - self._last_compaction < self.compact_interval:
+            return
+        if self._compact_lock.locked():
+            return
+        self._last_compaction = time.monotonic()
+        threading.Thread(target=self._compact_safely, name="session-compaction", daemon=True).start()
+
+    def _compact_safely(self):
+        try:
+            self.compact()
+        except sqlite3.Error as e:
+            logger.error(f"Error compacting session database: {e}")
+
+    def migrate_json_sessions(self, session_folder: str) -> int:
+        """
+        Imports legacy <id>.json session files, renaming each to <id>.json.migrated.
+        Safe to run from several processes at once. Returns the number of sessions imported.
+        """
+        imported = 0
+        for filename in sorted(os.listdir(session_folder)):
+            if not filename.endswith(".json"):
+                continue
+            session_id = filename[:-5]
+            path = os.path.join(session_folder, filename)
+            try:
+                modified = os.path.getmtime(path)
+                with open(path, "r") as f:
+                    data = json.load(f)
+                # One write transaction per session, so a crash never leaves it half imported
+                with self._connect() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    created_at = _timestamp(data.get("created_at"), modified)
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO sessions (id, name, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                        (session_id, data.get("session_name", "Untitled Session"), created_at, modified))
+                    if cursor.rowcount:
+                        _insert_message_rows(conn, _message_rows(session_id, data.get("chat_history", []), modified))
+                        _insert_indexed_files(conn, session_id, data.get("indexed_files", []), modified)
+                        imported += 1
+                os.replace(path, path + ".migrated")
+            except FileNotFoundError:
+                # Another process migrated this file first
+                continue
+            except (OSError, ValueError) as e:
+                logger.error(f"Skipping unreadable session file {path}: {e}")
+                continue
+        if imported:
+            logger.info(f"Migrated {imported} JSON session file(s) into {self.db_path}")
+        return imported
+
+def main():
+    """Imports legacy JSON session files once, before the web workers start."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import legacy JSON session files into the session database.")
+    parser.add_argument("--sessions", default="sessions", help="Folder with the <id>.json files")
+    parser.add_argument("--db", default=os.getenv("SESSION_DB_PATH"), help="Session database (default: <sessions>/sessions.db)")
+    args = parser.parse_args()
+    store = SessionStore(args.db or os.path.join(args.sessions, "sessions.db"))
+    print(f"Imported {store.migrate_json_sessions(args.sessions)} session(s)")
+
+if __name__ == "__main__":
+    main()
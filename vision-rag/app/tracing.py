@@ -0,0 +1,104 @@
+from contextlib import contextmanager
+from typing import Iterator, Optional
+import contextvars
+import importlib.util
+import logging
+import threading
+import time
+import uuid
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# prometheus_client is optional; without it spans are only logged
+PROMETHEUS_AVAILABLE = importlib.util.find_spec("prometheus_client") is not None
+
+# Stages range from milliseconds (session reads) to minutes (indexing)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 900.0)
+
+# Carried into asyncio tasks and asyncio.to_thread calls automatically
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_metrics: Optional[dict] = None
+_metrics_lock = threading.Lock()
+
+_base_record_factory = logging.getLogRecordFactory()
+
+def _record_factory(*args, **kwargs) -> logging.LogRecord:
+    # Tags every log record with the request being handled (shown in JSON logs)
+    record = _base_record_factory(*args, **kwargs)
+    record.request_id = _request_id.get()
+    return record
+
+logging.setLogRecordFactory(_record_factory)
+
+def start_request(request_id: Optional[str] = None) -> tuple[str, contextvars.Token]:
+    """Sets the current request id (a new one if none was sent); returns it and a reset token."""
+    request_id = request_id or uuid.uuid4().hex
+    return request_id, _request_id.set(request_id)
+
+def end_request(token: contextvars.Token):
+    _request_id.reset(token)
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+# Values allowed in the model_choice metric label; model names come from clients,
+# so anything else is reported as "other" to bound label cardinality
+METRIC_MODEL_CHOICES = {
+    "qwen", "gemini", "gpt4", "ollama", "llama", "llama-vision", "pixtral", "molmo",
+    "vidore/colpali", "vidore/colpali-v1.2", "vidore/colqwen2-v0.1",
+}
+
+def _metric_model_choice(model_choice: str) -> str:
+    if not model_choice or model_choice in METRIC_MODEL_CHOICES:
+        return model_choice
+    return "other"
+
+def _get_metrics() -> Optional[dict]:
+    global _metrics
+    if _metrics is None and PROMETHEUS_AVAILABLE:
+        with _metrics_lock:
+            if _metrics is None:
+                from prometheus_client import Histogram
+                _metrics = {
+                    "stage": Histogram("vision_rag_stage_duration_seconds", "Time spent in each pipeline stage",
+                                       ["stage", "model_choice", "cache"], buckets=STAGE_BUCKETS),
+                    "request": Histogram("vision_rag_request_duration_seconds", "HTTP request latency",
+                                         ["endpoint", "method", "status"], buckets=STAGE_BUCKETS),
+                }
+    return _metrics
+
+@contextmanager
+def span(stage: str, model_choice: str = "", cache: str = "") -> Iterator[dict]:
+    """
+    Times a pipeline stage under the current request id. The yielded label dict
+    may be updated inside the block, e.g. labels["cache"] = "hit".
+    """
+    labels = {"model_choice": model_choice or "", "cache": cache or ""}
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield labels
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics = _get_metrics()
+        if metrics is not None:
+            metrics["stage"].labels(stage, _metric_model_choice(labels["model_choice"]), labels["cache"]).observe(elapsed)
+        details = "".join(f" {name}={value}" for name, value in labels.items() if value)
+        logger.debug(f"[{current_request_id() or '-'}] {stage}{details} {'failed' if failed else 'took'} {elapsed:.3f}s")
+
+def observe_request(endpoint: Optional[str], method: str, status: int, seconds: float):
+    metrics = _get_metrics()
+    if metrics is not None:
+        metrics["request"].labels(endpoint or "unknown", method, str(status)).observe(seconds)
+
+def metrics_payload() -> Optional[tuple[bytes, str]]:
+    """Returns (body, content_type) in the Prometheus text format, or None without prometheus_client."""
+    if not PROMETHEUS_AVAILABLE:
+        return None
+    from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+    _get_metrics()
+    return generate_latest(), CONTENT_TYPE_LATEST
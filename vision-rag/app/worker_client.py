@@ -0,0 +1,76 @@
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client
+import hashlib
+import os
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# When set, local models run in the shared model worker (localgpt-vision/model_worker.py)
+MODEL_WORKER_ADDRESS = os.getenv("MODEL_WORKER_ADDRESS")
+# Shared secret for the worker socket; required, there is no default
+MODEL_WORKER_AUTHKEY = os.getenv("MODEL_WORKER_AUTHKEY", "").encode()
+
+# Backends the model worker serves
+WORKER_MODELS = {'qwen', 'llama-vision', 'pixtral', 'molmo'}
+
+def worker_enabled() -> bool:
+    return bool(MODEL_WORKER_ADDRESS)
+
+if worker_enabled() and not MODEL_WORKER_AUTHKEY:
+    raise RuntimeError("MODEL_WORKER_AUTHKEY must be set to use the model worker")
+
+def _call_worker(message: dict) -> dict:
+    with Client(MODEL_WORKER_ADDRESS, family='AF_UNIX', authkey=MODEL_WORKER_AUTHKEY) as conn:
+        conn.send(message)
+        reply = conn.recv()
+    if 'error' in reply:
+        raise RuntimeError(f"Model worker error: {reply['error']}")
+    return reply
+
+def worker_status() -> dict:
+    """
+    Returns the model worker's queue depth and model residency. Blocking.
+    """
+    return _call_worker({'op': 'status'})
+
+def generate_via_worker(images: list[str], query: str, model_choice: str,
+                        resized_height: int, resized_width: int) -> str:
+    """
+    Sends a generation request to the model worker; page images travel through shared memory.
+    Blocking, so call it via asyncio.to_thread.
+    """
+    blocks = []
+    try:
+        descriptors = []
+        for image_path in images:
+            with open(image_path, 'rb') as f:
+                data = f.read()
+            block = shared_memory.SharedMemory(create=True, size=len(data))
+            block.buf[:len(data)] = data
+            blocks.append(block)
+            descriptors.append({
+                'shm': block.name,
+                'size': len(data),
+                'digest': hashlib.md5(data).hexdigest(),
+                'suffix': os.path.splitext(image_path)[1] or '.png',
+            })
+
+        reply = _call_worker({
+            'op': 'generate',
+            'model_choice': model_choice,
+            'query': query,
+            'images': descriptors,
+            'options': {
+                'resized_height': resized_height,
+                'resized_width': resized_width,
+                'visual_token_budget': None,
+                'latency_target': None,
+            },
+        })
+        logger.info(f"Model worker answered in {reply['seconds']:.2f}s (queued {reply['queue_seconds']:.2f}s)")
+        return reply['text']
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()